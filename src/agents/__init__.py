@@ -1,7 +1,12 @@
 from .base_agent import BaseAgent
 from .agent_prompt_generator import PromptGenAgent
+from .llm_client_pool import LLMClientPool, llm_client_pool
+from .prompt_cache import PromptCache
 
 __all__ =[
     "BaseAgent",
-    "PromptGenAgent"
+    "PromptGenAgent",
+    "LLMClientPool",
+    "llm_client_pool",
+    "PromptCache"
 ]
\ No newline at end of file
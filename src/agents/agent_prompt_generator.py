@@ -1,4 +1,9 @@
 import os, sys
+import re
+import json
+import time
+import asyncio
+from typing import List, Optional
 from loguru import logger
 
 path_this = os.path.dirname(os.path.abspath(__file__))
@@ -7,6 +12,24 @@ path_root = os.path.dirname(os.path.join(path_this, '../..'))
 sys.path.extend([path_this, path_project, path_root])
 
 from agents.base_agent import BaseAgent
+from agents.prompt_cache import PromptCache
+from agents.retry_policy import IncompleteResponseError
+from agents import structured_output
+from tools.metrics import LLM_IN_FLIGHT
+
+PACK_SYSTEM_SUFFIX = """
+
+You will receive a JSON array of independent requests. Apply the instructions above to
+each request separately. Reply with ONLY a JSON array of strings with exactly the same
+number of elements, in the same order, where element i is your answer for request i.
+"""
+
+PACK_HUMAN_PROMPT = """
+Here are {count} prompts as a JSON array:
+{items}
+
+"""
+
 
 class PromptGenAgent(BaseAgent):
     def __init__(
@@ -22,8 +45,13 @@ class PromptGenAgent(BaseAgent):
         system_prompt: str = None,
         human_prompt: str = None,
         provider = "ai-hanes",
+        cache: Optional[PromptCache] = None,
+        cache_max_temperature: float = 0.1,
         **kwargs,
     ):
+        self.cache = cache
+        self.cache_max_temperature = cache_max_temperature
+        self.pack_stats = {"packed_calls": 0, "packed_items": 0, "fallbacks": 0}
         super().__init__(
             agent_name=agent_name,
             system_prompt=system_prompt,
@@ -39,21 +67,183 @@ class PromptGenAgent(BaseAgent):
             **kwargs
         )
         
+    def _cache_key(self, data_input: str) -> Optional[str]:
+        """Key cache hanya dibuat untuk setting deterministik (temperature rendah)."""
+        if self.cache is None:
+            return None
+        if self.model_kwargs.get("temperature", 1.0) > self.cache_max_temperature:
+            return None
+        sampling = {k: v for k, v in self.model_kwargs.items() if k != "timeout"}
+        return PromptCache.make_key(data_input, self.raw_system_prompt, self.model_name, sampling)
+
     def analyze(self, data_input: str = None):
         try:
+            cache_key = self._cache_key(data_input)
+            if cache_key is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Prompt cache hit, skip LLM call")
+                    return cached
+
             result = super().analyze(data_input=data_input)
             logger.success(f"SUCCESS Generate Comment Agent")
             
             if result == data_input:
                 logger.error("Agent returned input data instead of generated content")
                 return None
-                
+
+            if cache_key is not None and result:
+                self.cache.set(cache_key, result)
             return result
         except Exception as e:
             logger.error(f"Error in CommentContentAgent: {str(e)}")
             logger.exception("traceback")
             return None
 
+    async def aget_cached(self, data_input: str) -> Optional[str]:
+        """Hasil ekspansi dari cache saja, tanpa call LLM (None kalau miss/cache mati)."""
+        cache_key = self._cache_key(data_input)
+        if cache_key is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, cache_key)
+
+    async def aanalyze(self, data_input: str = None, check_cache: bool = True):
+        """`check_cache=False` kalau pemanggil sudah mengecek cache lewat aget_cached."""
+        try:
+            cache_key = self._cache_key(data_input)
+            if cache_key is not None and check_cache:
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+                if cached is not None:
+                    logger.info("Prompt cache hit, skip LLM call")
+                    return cached
+
+            result = await super().aanalyze(data_input=data_input)
+            logger.success(f"SUCCESS Generate Comment Agent")
+
+            if result == data_input:
+                logger.error("Agent returned input data instead of generated content")
+                return None
+
+            if cache_key is not None and result:
+                await asyncio.to_thread(self.cache.set, cache_key, result)
+            return result
+        except Exception as e:
+            logger.error(f"Error in CommentContentAgent: {str(e)}")
+            logger.exception("traceback")
+            return None
+
+    # ---------- packed expansion ----------
+    @staticmethod
+    def parse_packed(content: str, count: int) -> Optional[List[str]]:
+        """Ambil JSON array dari jawaban LLM (boleh dibungkus code fence/teks lain)."""
+        if not content:
+            return None
+        match = re.search(r"\[.*\]", content, re.DOTALL)
+        if match is None:
+            return None
+        try:
+            items = json.loads(match.group(0))
+        except ValueError:
+            return None
+        if not isinstance(items, list) or len(items) != count:
+            return None
+        return [str(item).strip() for item in items]
+
+    def _packed_items(self, content: str, count: int) -> Optional[List[str]]:
+        """parse_packed, atau di mode structured: {"items": [...]} tervalidasi, tiap item jadi JSON."""
+        if self.output_model is None:
+            return self.parse_packed(content, count)
+        packed = structured_output.parse_output(structured_output.packed_model(self.output_model), content)
+        if packed is None or len(packed.items) != count:
+            return None
+        return [item.model_dump_json() for item in packed.items]
+
+    def _packed_request(self, count: int):
+        """(suffix system prompt, override model_kwargs) untuk satu packed call."""
+        params = {}
+        if self.max_tokens:
+            # budget token per item, jadi jawaban packed tidak terpotong
+            params["max_tokens"] = self.max_tokens * count
+        if self.output_model is None:
+            return PACK_SYSTEM_SUFFIX, params
+        packed = structured_output.packed_model(self.output_model)
+        params["response_format"] = structured_output.response_format(packed, self.response_format_mode)
+        suffix = structured_output.PACK_OUTPUT_INSTRUCTION.format(schema=structured_output.schema_json(self.output_model))
+        return suffix, {k: v for k, v in params.items() if v is not None}
+
+    async def _apacked_call(self, inputs: List[str]) -> Optional[List[str]]:
+        suffix, params = self._packed_request(len(inputs))
+        messages = [
+            {"role": "system", "content": self.system_prompt + suffix},
+            {"role": "user", "content": PACK_HUMAN_PROMPT.format(
+                count=len(inputs), items=json.dumps(inputs, ensure_ascii=False)
+            )},
+        ]
+        def validate(response):
+            valid = self._packed_items(response.choices[0].message.content, len(inputs)) is not None
+            if self.output_model is not None:
+                self.output_stats["parsed" if valid else "invalid"] += 1
+            if not valid:
+                raise IncompleteResponseError("jawaban packed tidak valid", response)
+
+        start_time = time.time()
+        LLM_IN_FLIGHT.inc()
+        try:
+            response = await self._acomplete(messages, validate, params, packed=len(inputs))
+            self._record_metrics(start_time, response.usage)
+            return self._packed_items(response.choices[0].message.content, len(inputs))
+        except IncompleteResponseError:
+            self._metric_error.inc()
+            return None
+        except Exception:
+            self._metric_error.inc()
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec()
+
+    async def aanalyze_many(self, inputs: List[str], cached: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        Ekspansi beberapa prompt sekaligus dalam satu chat completion (jawaban berupa
+        JSON array). Item yang ada di cache tidak ikut dikirim; kalau jawaban packed
+        tidak valid, item dikerjakan satu per satu lewat aanalyze.
+        `cached` = hasil aget_cached per item kalau pemanggil sudah membaca cache.
+        """
+        results: List[Optional[str]] = [None] * len(inputs)
+        keys = [self._cache_key(data_input) for data_input in inputs]
+        if cached is None:
+            cached = [await asyncio.to_thread(self.cache.get, key) if key is not None else None for key in keys]
+        pending = []
+        for idx, hit in enumerate(cached):
+            if hit is not None:
+                results[idx] = hit
+            else:
+                pending.append(idx)
+        if not pending:
+            return results
+
+        packed = None
+        if len(pending) > 1:
+            try:
+                packed = await self._apacked_call([inputs[idx] for idx in pending])
+            except Exception as e:
+                logger.warning(f"Packed prompt expansion gagal: {e}")
+
+        if packed is None:
+            if len(pending) > 1:
+                self.pack_stats["fallbacks"] += 1
+            expanded = await asyncio.gather(*(self.aanalyze(data_input=inputs[idx], check_cache=False) for idx in pending))
+            for idx, result in zip(pending, expanded):
+                results[idx] = result
+            return results
+
+        self.pack_stats["packed_calls"] += 1
+        self.pack_stats["packed_items"] += len(pending)
+        for idx, result in zip(pending, packed):
+            results[idx] = result or None
+            if result and keys[idx] is not None:
+                await asyncio.to_thread(self.cache.set, keys[idx], result)
+        return results
+
 if __name__ == "__main__":
     system_prompt = """
 
@@ -1,21 +1,30 @@
 import os
 import sys
 import json
+import asyncio
 from configparser import ConfigParser
 import time
-from typing import Dict, Any, List, Literal
+from typing import Dict, Any, List, Literal, Optional, Callable, Type
 import hashlib
 import traceback
 
 from openai import OpenAI, AsyncOpenAI
 from openai.types import CompletionUsage
 from loguru import logger
+from pydantic import BaseModel
 
 path_this = os.path.dirname(os.path.abspath(__file__))
 path_project = os.path.dirname(os.path.join(path_this, '..'))
 path_root = os.path.dirname(path_this)
 sys.path.extend([path_root, path_project, path_this])
 
+from agents.llm_client_pool import llm_client_pool
+from agents.retry_policy import RetryPolicy, HedgePolicy, IncompleteResponseError, AttemptCancelledError, classify_error
+from agents import structured_output
+from tools.metrics import LLM_IN_FLIGHT, LLM_REQUESTS, LLM_TOKENS, LLM_RETRIES, LLM_HEDGES, stage
+from tools.tracing import tracer, KIND_CLIENT
+from tools import deadline
+
 class BaseAgent:
     def __init__(
         self,
@@ -26,6 +35,11 @@ class BaseAgent:
         multiagent_name: str = None,
         stage: str = "test",
         max_retries: int = 3,
+        retry_policy: Optional[RetryPolicy] = None,
+        hedge: Optional[HedgePolicy] = None,
+        output_model: Optional[Type[BaseModel]] = None,
+        response_format: str = "json_schema",
+        max_tokens: Optional[int] = None,
         **model_kwargs: Any,
     ):
         self.system_prompt = system_prompt
@@ -35,6 +49,8 @@ class BaseAgent:
         self.multiagent_name = multiagent_name
         self.stage = stage
         self.max_retries = max_retries
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries)
+        self.hedge = hedge if hedge is not None and hedge.enabled else None
         
         self.timeout = model_kwargs.get("timeout", 180)
         self.model_name = model_kwargs.get("model_name")
@@ -42,9 +58,11 @@ class BaseAgent:
         self.api_key = model_kwargs.get("api_key")
         
         self._validate_model_kwargs(model_kwargs)
+        self._init_structured_output(output_model, response_format, max_tokens)
 
         self._init_config()
         self.raw_system_prompt = system_prompt
+        self._init_metrics()
 
     def _validate_model_kwargs(self, model_kwargs: Dict[str, Any]):
         model_kwargs.pop("model_name", None)
@@ -58,6 +76,56 @@ class BaseAgent:
             
         self.model_kwargs = model_kwargs
 
+    def _init_structured_output(self, output_model: Optional[Type[BaseModel]], mode: str, max_tokens: Optional[int]):
+        """
+        Mode structured (opsional): jawaban dibatasi JSON schema `output_model`
+        lewat response_format dan divalidasi sebelum dipakai; jawaban yang tidak
+        valid ikut retry policy. `max_tokens` = budget token output per call.
+        """
+        self.output_model = output_model
+        self.response_format_mode = mode
+        self.max_tokens = max_tokens
+        self.output_stats = {"parsed": 0, "invalid": 0}
+        if max_tokens:
+            self.model_kwargs["max_tokens"] = max_tokens
+        self._output_instruction = ""
+        if output_model is not None:
+            fmt = structured_output.response_format(output_model, mode)
+            if fmt is not None:
+                self.model_kwargs["response_format"] = fmt
+            self._output_instruction = structured_output.OUTPUT_INSTRUCTION.format(
+                schema=structured_output.schema_json(output_model)
+            )
+
+    def _init_metrics(self):
+        """Child metric per model dibuat sekali di sini, hot path cukup observe/inc."""
+        model = self.model_name or "unknown"
+        self._metric_seconds = stage("llm_expansion")
+        self._metric_ok = LLM_REQUESTS.labels(model, "ok")
+        self._metric_error = LLM_REQUESTS.labels(model, "error")
+        self._metric_input_tokens = LLM_TOKENS.labels(model, "input")
+        self._metric_output_tokens = LLM_TOKENS.labels(model, "output")
+        self._metric_hedge_fired = LLM_HEDGES.labels(model, "fired")
+        self._metric_hedge_won = LLM_HEDGES.labels(model, "won")
+
+    def _record_metrics(self, start_time: float, usage: CompletionUsage = None):
+        """Durasi dan token call LLM yang berhasil ke /metrics."""
+        self._metric_seconds.observe(time.time() - start_time)
+        self._metric_ok.inc()
+        if usage is not None:
+            self._metric_input_tokens.inc(usage.prompt_tokens or 0)
+            self._metric_output_tokens.inc(usage.completion_tokens or 0)
+
+    @staticmethod
+    def _trace_response(span, response):
+        """finish_reason dan token satu attempt ke span-nya."""
+        if not span.sampled:
+            return
+        span.set("finish_reason", response.choices[0].finish_reason)
+        if response.usage is not None:
+            span.set("input_tokens", response.usage.prompt_tokens)
+            span.set("output_tokens", response.usage.completion_tokens)
+
     def _init_config(self):
         self.config = ConfigParser(allow_no_value=True)
         self.config.read(os.path.join(path_root, "config.ini"))
@@ -68,64 +136,213 @@ class BaseAgent:
         """
         system_content = self.system_prompt.format(**kwargs) if kwargs else self.system_prompt
         user_content = self.human_prompt.format(**kwargs) if kwargs else self.human_prompt
+        # ditambahkan setelah format supaya kurung kurawal schema tidak dianggap placeholder
+        system_content += self._output_instruction
         return [
             {"role": "system", "content": system_content},
             {"role": "user", "content": user_content}
         ]
         
-    def _llm(self):
-        return OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-        )
+    def _llm(self) -> OpenAI:
+        """Client dari registry process-wide, dipakai bersama semua agent."""
+        return llm_client_pool.get(self.base_url, self.api_key, self.timeout)
     
-    def _allm(self):
-        return AsyncOpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            timeout=self.timeout
-        )
-        
+    def _allm(self) -> AsyncOpenAI:
+        return llm_client_pool.aget(self.base_url, self.api_key, self.timeout)
+
+    @staticmethod
+    def pool_stats() -> Dict[str, Any]:
+        return llm_client_pool.stats()
+
+    def retry_stats(self) -> Dict[str, Any]:
+        return {
+            **self.retry_policy.stats(),
+            "hedge": self.hedge.stats() if self.hedge is not None else {"enabled": False},
+            "structured_output": {
+                "enabled": self.output_model is not None,
+                "response_format": self.response_format_mode if self.output_model is not None else None,
+                "max_tokens": self.max_tokens,
+                **self.output_stats,
+            },
+        }
+
+    # ---------- structured output ----------
+    def parse_output(self, content: Optional[str]) -> Optional[BaseModel]:
+        """Jawaban LLM sebagai instance `output_model`; None kalau mode structured mati atau tidak valid."""
+        if self.output_model is None:
+            return None
+        return structured_output.parse_output(self.output_model, content)
+
+    def _validate_output(self, response):
+        if self.parse_output(response.choices[0].message.content) is None:
+            self.output_stats["invalid"] += 1
+            raise IncompleteResponseError(f"jawaban tidak sesuai schema {self.output_model.__name__}", response)
+        self.output_stats["parsed"] += 1
+
+    def _output_validator(self) -> Optional[Callable[[Any], None]]:
+        return self._validate_output if self.output_model is not None else None
+
+    def _output_text(self, response) -> str:
+        """Isi jawaban; di mode structured dinormalisasi jadi JSON hasil validasi (tanpa code fence/teks lain)."""
+        content = response.choices[0].message.content
+        if self.output_model is None:
+            return content
+        return self.parse_output(content).model_dump_json()
+
+    # ---------- retry / hedging ----------
+    @staticmethod
+    def _check_response(response, validate: Optional[Callable[[Any], None]] = None):
+        """finish_reason selain stop (biasanya kena batas token) dan jawaban yang gagal validasi dianggap retryable."""
+        finish_reason = response.choices[0].finish_reason
+        if finish_reason != "stop":
+            raise IncompleteResponseError(f"finish_reason={finish_reason}", response)
+        if validate is not None:
+            validate(response)
+
+    def _on_retry(self, error: Exception, attempt: int, delay: float):
+        LLM_RETRIES.labels(self.model_name or "unknown", classify_error(error)).inc()
+        logger.warning(f"Retry {attempt + 2} / {self.retry_policy.max_attempts} dalam {delay:.2f}s: {error}")
+
+    def _attempt(self, messages: List[Dict[str, str]], attempt: int, validate=None, params=None, **span_attrs):
+        with tracer.span("llm.attempt", kind=KIND_CLIENT, attempt=attempt + 1, **span_attrs) as span:
+            response = self._llm().chat.completions.create(
+                model=self.model_name, messages=messages, **{**self.model_kwargs, **(params or {})}
+            )
+            self._trace_response(span, response)
+            self._check_response(response, validate)
+        return response
+
+    async def _aattempt(self, base_url: str, messages: List[Dict[str, str]], attempt: int, validate=None, params=None,
+                        **span_attrs):
+        start = time.time()
+        with tracer.span("llm.attempt", kind=KIND_CLIENT, attempt=attempt + 1, base_url=base_url, **span_attrs) as span:
+            llm = llm_client_pool.aget(base_url, self.api_key, self.timeout)
+            kwargs = {**self.model_kwargs, **(params or {})}
+            if deadline.current() is not None:
+                kwargs = {**kwargs, "timeout": deadline.timeout(kwargs.get("timeout", self.timeout))}
+            response = await llm.chat.completions.create(model=self.model_name, messages=messages, **kwargs)
+            self._trace_response(span, response)
+            self._check_response(response, validate)
+        if self.hedge is not None:
+            self.hedge.observe(time.time() - start)
+        return response
+
+    @staticmethod
+    def _attempt_error(task: asyncio.Future) -> Optional[BaseException]:
+        """Error task attempt yang sudah selesai; attempt yang di-cancel dihitung gagal, bukan CancelledError."""
+        if task.cancelled():
+            return AttemptCancelledError("attempt LLM di-cancel")
+        return task.exception()
+
+    def _attempt_result(self, task: asyncio.Future):
+        error = self._attempt_error(task)
+        if error is not None:
+            raise error
+        return task.result()
+
+    async def _ahedged(self, messages: List[Dict[str, str]], attempt: int, validate=None, params=None, **span_attrs):
+        """
+        Satu attempt dengan hedging: kalau primary belum selesai setelah delay
+        hedge, kirim request yang sama ke base_url cadangan dan pakai jawaban
+        valid yang pertama; request yang kalah di-cancel.
+        """
+        primary = asyncio.ensure_future(self._aattempt(self.base_url, messages, attempt, validate, params, **span_attrs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge.delay())
+            if done:
+                return self._attempt_result(primary)
+            if not self.retry_policy.budget.try_spend():
+                self.hedge.record("skipped_budget")
+                await asyncio.wait({primary})
+                return self._attempt_result(primary)
+
+            self.hedge.record("hedged")
+            self._metric_hedge_fired.inc()
+            hedged = asyncio.ensure_future(
+                self._aattempt(self.hedge.next_url(), messages, attempt, validate, params, hedge=True, **span_attrs)
+            )
+            tasks.append(hedged)
+            pending = {primary, hedged}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if self._attempt_error(task) is None:
+                        if task is hedged:
+                            self.hedge.record("hedge_wins")
+                            self._metric_hedge_won.inc()
+                        else:
+                            self.hedge.record("primary_wins")
+                        return task.result()
+            # dua-duanya gagal: error primary yang diteruskan ke retry policy
+            return self._attempt_result(primary)
+        finally:
+            # request yang kalah (atau semua, kalau pemanggil di-cancel) dibatalkan
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _complete(self, messages: List[Dict[str, str]], validate=None, params=None, **span_attrs):
+        """
+        Chat completion dengan retry policy (backoff + jitter, budget). Versi sync tanpa hedging.
+        `params` menimpa model_kwargs untuk call ini saja (mis. response_format packed).
+        """
+        self.retry_policy.start()
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(messages, attempt, validate, params, **span_attrs)
+            except Exception as e:
+                delay = self.retry_policy.next_delay(e, attempt)
+                if delay is None:
+                    raise
+                self._on_retry(e, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    async def _acomplete(self, messages: List[Dict[str, str]], validate=None, params=None, **span_attrs):
+        self.retry_policy.start()
+        attempt = 0
+        while True:
+            try:
+                if self.hedge is not None:
+                    return await self._ahedged(messages, attempt, validate, params, **span_attrs)
+                return await self._aattempt(self.base_url, messages, attempt, validate, params, **span_attrs)
+            except Exception as e:
+                delay = self.retry_policy.next_delay(e, attempt)
+                current = deadline.current()
+                # retry yang pasti melewati deadline hanya membuang token
+                if delay is None or (current is not None and delay >= current.remaining()):
+                    raise
+                self._on_retry(e, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
     def analyze(self, **kwargs: Any) -> str:
         start_time = time.time()
+        LLM_IN_FLIGHT.inc()
         try:
-            tries = 0
-            while tries < self.max_retries:
-                with self._llm() as llm:
-                    response=llm.chat.completions.create(
-                        model=self.model_name,
-                        messages=self.chat_prompt(**kwargs),
-                        **self.model_kwargs
-                    )
-                if response.choices[0].finish_reason == "stop":
-                    self._log_success(response.choices[0].message, start_time, response.usage, **kwargs)
-                    return response.choices[0].message.content
-                tries += 1
-            
-            raise Exception(f"Max retries exceeded on query input {self.human_prompt}")
+            with tracer.span("llm.analyze", agent=self.agent_name, model=self.model_name):
+                response = self._complete(self.chat_prompt(**kwargs), self._output_validator())
+                self._log_success(response.choices[0].message, start_time, response.usage, **kwargs)
+                return self._output_text(response)
         except Exception as e:
             self._handle_error(e, start_time, **kwargs)
+        finally:
+            LLM_IN_FLIGHT.dec()
 
     async def aanalyze(self, **kwargs: Any) -> str:
         start_time = time.time()
+        LLM_IN_FLIGHT.inc()
         try:
-            tries = 0
-            while tries < self.max_retries:
-                async with self._allm() as llm:
-                    response = await llm.chat.completions.create(
-                        model=self.model_name,
-                        messages=self.chat_prompt(**kwargs),
-                        **self.model_kwargs
-                    )
-                    if response.choices[0].finish_reason == "stop":
-                        self._log_success(response.choices[0].message, start_time, response.usage, **kwargs)
-                        return response.choices[0].message.content
-                    tries += 1
-                    logger.warning(f"Retry {tries + 1} / {self.max_retries}")
-                    
-            raise Exception(f"Max retries exceeded on query input {self.chat_prompt(**kwargs)}")
+            with tracer.span("llm.analyze", agent=self.agent_name, model=self.model_name):
+                response = await self._acomplete(self.chat_prompt(**kwargs), self._output_validator())
+                self._log_success(response.choices[0].message, start_time, response.usage, **kwargs)
+                return self._output_text(response)
         except Exception as e:
             self._handle_error(e, start_time, **kwargs)
+        finally:
+            LLM_IN_FLIGHT.dec()
             
     def _get_system_prompt(self, **kwargs) -> str:
         try:
@@ -142,6 +359,7 @@ class BaseAgent:
             return "Error occurred while extracting human prompt"
 
     def _log_success(self, result: List[Any], start_time: float, usage: CompletionUsage, **kwargs):
+        self._record_metrics(start_time, usage)
         try:
             log_data = self._prepare_log_data(result, start_time, usage, **kwargs)
             logger.info("Successfully processed request", **log_data)
@@ -149,6 +367,7 @@ class BaseAgent:
             logger.warning(f"Failed to log success: {traceback.format_exc()}")
 
     def _handle_error(self, error: Exception, start_time: float, **kwargs):
+        self._metric_error.inc()
         error_message = str(error)
         logger.error(f"Error: {error_message}")
         logger.error(f"Failed to generate result: {traceback.format_exc()}")
@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Any, Dict
+
+from loguru import logger
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# nilai gauge per state untuk /metrics
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker per dependency (mis. LLM ekspansi prompt).
+    - closed    : semua call lewat; `failure_threshold` kegagalan berturut-turut -> open
+    - open      : call langsung ditolak (pemanggil pakai fallback) selama `reset_timeout` detik
+    - half_open : satu call percobaan boleh lewat; sukses -> closed, gagal -> open lagi
+    Call percobaan yang tidak pernah melapor (mis. di-cancel) dianggap hilang
+    setelah `reset_timeout`, lalu percobaan baru diizinkan.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: float = 0.0
+        self._probe_started_at: float = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "rejected": 0, "successes": 0, "failures": 0, "opened": 0}
+
+    @classmethod
+    def from_config(cls, config, name: str, prefix: str, section: str = "default") -> "CircuitBreaker":
+        return cls(
+            name,
+            failure_threshold=config.getint(section, f"{prefix}_breaker_failures", fallback=5),
+            reset_timeout=config.getfloat(section, f"{prefix}_breaker_reset_seconds", fallback=30.0),
+        )
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.time()
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_started_at = 0.0
+            if self.state == HALF_OPEN:
+                if now - self._probe_started_at < self.reset_timeout:
+                    self._counters["rejected"] += 1
+                    return False
+                self._probe_started_at = now
+            elif self.state == OPEN:
+                self._counters["rejected"] += 1
+                return False
+            self._counters["allowed"] += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._counters["successes"] += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info(f"Circuit breaker {self.name} closed")
+                self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._counters["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker {self.name} open setelah {self.consecutive_failures} kegagalan")
+                self.state = OPEN
+                self.opened_at = time.time()
+                self._counters["opened"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "state_value": STATE_VALUES[self.state],
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "opened_at": self.opened_at or None,
+            **self._counters,
+        }
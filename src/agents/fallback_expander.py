@@ -0,0 +1,99 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Kosakata gaya yang sama dengan contoh prompt di README / system prompt agent_com.
+# Bisa ditimpa lewat key `fallback_vocabulary` di system_prompts.json.
+DEFAULT_VOCABULARY: Dict[str, Any] = {
+    "styles": {
+        "professional": {
+            "keywords": ["formal", "kantor", "office", "bisnis", "business", "linkedin", "kerja", "jas", "suit",
+                         "dasi", "tie", "corporate", "ceo", "manager", "dokter", "doctor", "pengacara", "lawyer",
+                         "profesional", "professional", "blazer", "kemeja", "eksekutif", "executive"],
+            "tags": ["professional corporate headshot", "business attire", "clean background",
+                     "professional lighting", "confident expression", "polished appearance"],
+        },
+        "casual": {
+            "keywords": ["santai", "casual", "kasual", "outdoor", "pantai", "beach", "taman", "park", "jalan",
+                         "street", "liburan", "holiday", "kaos", "t-shirt", "hoodie", "senyum", "smile", "smiling"],
+            "tags": ["casual outdoor portrait", "natural lighting", "smiling", "authentic expression",
+                     "social media style"],
+        },
+        "creative": {
+            "keywords": ["kreatif", "creative", "artistik", "artistic", "seni", "art", "seniman", "artist", "musisi",
+                         "musician", "desainer", "designer", "fotografer", "photographer", "sinematik", "cinematic",
+                         "aesthetic", "estetik"],
+            "tags": ["artistic portrait", "creative background", "soft lighting", "cinematic look"],
+        },
+    },
+    "default_style": "professional",
+    "subjects": [
+        [["pria", "laki-laki", "laki", "cowok", "man", "male", "bapak", "mas"], "man"],
+        [["wanita", "perempuan", "cewek", "woman", "female", "ibu", "mbak"], "woman"],
+        [["anak", "child", "kid"], "child"],
+    ],
+    "attributes": [
+        [["muda", "young", "remaja"], "young"],
+        [["tua", "senior", "paruh baya", "elderly", "older"], "mature"],
+        [["ganteng", "tampan", "handsome"], "handsome"],
+        [["cantik", "beautiful", "pretty"], "beautiful"],
+        [["hijab", "berhijab", "jilbab", "berjilbab", "kerudung"], "wearing hijab"],
+        [["kacamata", "berkacamata", "glasses"], "wearing glasses"],
+        [["jenggot", "berjenggot", "beard"], "with beard"],
+        [["berjas", "jas", "suit"], "wearing a suit"],
+        [["kemeja", "berkemeja", "shirt"], "wearing a shirt"],
+    ],
+    "quality": ["sharp focus", "high detail", "85mm lens", "8k resolution", "high quality"],
+}
+
+_FILLER = re.compile(r"\b(buatkan|buat|bikin|tolong|saya|aku|gue|gambar|foto|poto|photo|profil|profile|"
+                     r"yang|dengan|dan|untuk|seorang|sebuah|please|make|me|a|an|the|of|with)\b")
+
+
+class FallbackPromptExpander:
+    """
+    Ekspansi prompt lokal tanpa LLM, dipakai saat LLM lambat/down. Deterministik:
+    input yang sama selalu menghasilkan prompt yang sama. Prompt user dicocokkan
+    dengan keyword (Indonesia/Inggris) untuk memilih gaya, subjek dan atribut,
+    lalu dilengkapi tag gaya + kualitas dari kosakata yang sama dengan system prompt.
+    """
+
+    def __init__(self, vocabulary: Optional[Dict[str, Any]] = None):
+        self.vocabulary = {**DEFAULT_VOCABULARY, **(vocabulary or {})}
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(re.sub(r"[^\w\s-]", " ", text.lower()).split())
+
+    @staticmethod
+    def _has(text: str, keywords: List[str]) -> bool:
+        return any(re.search(rf"\b{re.escape(k)}\b", text) for k in keywords)
+
+    def _style(self, text: str) -> Tuple[str, List[str]]:
+        styles = self.vocabulary["styles"]
+        scores = {name: sum(1 for k in s["keywords"] if self._has(text, [k])) for name, s in styles.items()}
+        best = max(scores, key=lambda name: (scores[name], name == self.vocabulary["default_style"]))
+        if scores[best] == 0:
+            best = self.vocabulary["default_style"]
+        return best, list(styles[best]["tags"])
+
+    def expand(self, prompt: str) -> str:
+        text = self._normalize(prompt)
+        _, style_tags = self._style(text)
+        subject = next((label for words, label in self.vocabulary["subjects"] if self._has(text, words)), "person")
+        attributes = [label for words, label in self.vocabulary["attributes"] if self._has(text, words)]
+
+        # sisa kata user tetap dibawa supaya detail spesifik (profesi, warna baju) tidak hilang
+        detail = " ".join(_FILLER.sub(" ", text).split())
+        head = " ".join(a for a in attributes if not a.startswith(("wearing", "with")))
+        parts = [f"portrait of a {head} {subject}".replace("  ", " ")]
+        parts += [a for a in attributes if a.startswith(("wearing", "with"))]
+        if detail:
+            parts.append(detail)
+        parts += style_tags + self.vocabulary["quality"]
+
+        seen, unique = set(), []
+        for part in parts:
+            if part not in seen:
+                seen.add(part)
+                unique.append(part)
+        return ", ".join(unique)
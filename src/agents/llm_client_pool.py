@@ -0,0 +1,164 @@
+import importlib.util
+import threading
+import time
+from typing import Dict, Any, Tuple, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from loguru import logger
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+PoolKey = Tuple[str, str, float]
+
+
+class LLMClientPool:
+    """
+    Registry client OpenAI process-wide, key (base_url, api_key, timeout).
+    Satu client (dan satu connection pool) dipakai bersama oleh semua agent
+    sehingga handshake TCP/TLS hanya terjadi sekali per backend.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_keepalive_connections: int = 16,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        sdk_max_retries: int = 2,
+    ):
+        self.configure(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            http2=http2,
+            sdk_max_retries=sdk_max_retries,
+        )
+        self._clients: Dict[PoolKey, OpenAI] = {}
+        self._async_clients: Dict[PoolKey, AsyncOpenAI] = {}
+        self._stats: Dict[PoolKey, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+        sdk_max_retries: Optional[int] = None,
+    ):
+        """
+        Ubah setting pool; hanya berlaku untuk client yang dibuat sesudahnya.
+        `sdk_max_retries` = retry internal SDK openai; set 0 kalau retry sudah
+        diatur RetryPolicy di BaseAgent supaya tidak berlipat.
+        """
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_keepalive_connections is not None:
+            self.max_keepalive_connections = max_keepalive_connections
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        if http2 is not None:
+            self.http2 = http2 and HTTP2_AVAILABLE
+        if sdk_max_retries is not None:
+            self.sdk_max_retries = sdk_max_retries
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _record(self, key: PoolKey, created: bool, is_async: bool):
+        stats = self._stats.setdefault(key, {
+            "created_at": time.time(),
+            "sync_acquires": 0,
+            "async_acquires": 0,
+            "clients_created": 0,
+        })
+        stats["async_acquires" if is_async else "sync_acquires"] += 1
+        if created:
+            stats["clients_created"] += 1
+
+    def get(self, base_url: str, api_key: str, timeout: float) -> OpenAI:
+        key = (base_url, api_key, timeout)
+        with self._lock:
+            client = self._clients.get(key)
+            created = client is None
+            if created:
+                logger.debug(f"Create pooled OpenAI client for {base_url}")
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=timeout,
+                    max_retries=self.sdk_max_retries,
+                    http_client=httpx.Client(limits=self._limits(), http2=self.http2, timeout=timeout),
+                )
+                self._clients[key] = client
+            self._record(key, created, is_async=False)
+            return client
+
+    def aget(self, base_url: str, api_key: str, timeout: float) -> AsyncOpenAI:
+        key = (base_url, api_key, timeout)
+        with self._lock:
+            client = self._async_clients.get(key)
+            created = client is None
+            if created:
+                logger.debug(f"Create pooled AsyncOpenAI client for {base_url}")
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=timeout,
+                    max_retries=self.sdk_max_retries,
+                    http_client=httpx.AsyncClient(limits=self._limits(), http2=self.http2, timeout=timeout),
+                )
+                self._async_clients[key] = client
+            self._record(key, created, is_async=True)
+            return client
+
+    @staticmethod
+    def _open_connections(client) -> int:
+        # best-effort: httpx tidak punya API publik untuk jumlah koneksi di pool
+        try:
+            return len(client._client._transport._pool.connections)
+        except Exception:
+            return -1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients = []
+            for key, stats in self._stats.items():
+                base_url, _, timeout = key
+                clients.append({
+                    "base_url": base_url,
+                    "timeout": timeout,
+                    **stats,
+                    "sync_open_connections": self._open_connections(self._clients[key]) if key in self._clients else 0,
+                    "async_open_connections": self._open_connections(self._async_clients[key]) if key in self._async_clients else 0,
+                })
+            return {
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry,
+                "http2": self.http2,
+                "sdk_max_retries": self.sdk_max_retries,
+                "clients": clients,
+            }
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+        for client in clients:
+            await client.close()
+        self.close()
+
+
+llm_client_pool = LLMClientPool()
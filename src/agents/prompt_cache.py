@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from loguru import logger
+
+
+class PromptCache:
+    """
+    Cache dua tingkat untuk hasil ekspansi prompt:
+    in-memory LRU di depan, SQLite di belakang (tetap ada setelah restart).
+    Entry kedaluwarsa setelah `ttl` detik dan dievict berdasarkan jumlah entry.
+    """
+
+    # eviction disk dicek tiap N write, supaya COUNT(*) tidak jalan di setiap set()
+    EVICT_EVERY = 64
+
+    def __init__(
+        self,
+        path: Optional[str] = "cache/prompt_cache.sqlite3",
+        ttl: float = 7 * 24 * 3600,
+        memory_max_entries: int = 1024,
+        disk_max_entries: int = 100_000,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_access ON prompt_cache(last_access)")
+
+    # ---------- key ----------
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+    @classmethod
+    def make_key(cls, data_input: str, system_prompt: str, model_name: str, sampling: Dict[str, Any]) -> str:
+        system_hash = hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()
+        raw = json.dumps(
+            [cls.normalize(data_input), system_hash, model_name, sampling],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ---------- get / set ----------
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM prompt_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._conn.execute("UPDATE prompt_cache SET last_access = ? WHERE key = ?", (now, key))
+                        self._put_memory(key, expires_at, value)
+                        self._counters["disk_hits"] += 1
+                        return value
+                    self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                    self._counters["expired"] += 1
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._put_memory(key, expires_at, value)
+            self._counters["sets"] += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now),
+                )
+                if self._counters["sets"] % self.EVICT_EVERY == 0:
+                    self._evict_disk(now)
+
+    def _put_memory(self, key: str, expires_at: float, value: str):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self._counters["memory_evictions"] += 1
+
+    def _evict_disk(self, now: float):
+        self._conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (now,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM prompt_cache WHERE key IN ("
+                " SELECT key FROM prompt_cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._counters["disk_evictions"] += overflow
+            logger.debug(f"Prompt cache evicted {overflow} entries from disk")
+
+    # ---------- stats ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            disk_entries = 0
+            if self._conn is not None:
+                (disk_entries,) = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
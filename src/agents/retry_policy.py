@@ -0,0 +1,254 @@
+import random
+import threading
+import time
+from collections import deque
+from itertools import cycle
+from typing import Any, Dict, List, Optional
+
+import httpx
+import openai
+
+# status HTTP yang layak dicoba ulang; 4xx lain (auth, bad request) tidak akan berubah hasilnya
+RETRYABLE_STATUS = (408, 409, 425, 429, 500, 502, 503, 504)
+
+
+class IncompleteResponseError(Exception):
+    """Jawaban LLM tidak bisa dipakai (finish_reason != stop, format tidak valid); boleh dicoba ulang."""
+
+    def __init__(self, message: str, response: Any = None):
+        super().__init__(message)
+        self.response = response
+
+
+class AttemptCancelledError(Exception):
+    """Task attempt (primary/hedge) di-cancel dari dalam, mis. oleh client HTTP; dihitung attempt gagal."""
+
+
+def classify_error(exc: BaseException) -> Optional[str]:
+    """Alasan retry untuk error ini, None kalau tidak retryable."""
+    if isinstance(exc, IncompleteResponseError):
+        return "incomplete"
+    if isinstance(exc, AttemptCancelledError):
+        return "cancelled"
+    if isinstance(exc, (openai.APITimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(exc, (openai.APIConnectionError, httpx.TransportError)):
+        return "connection"
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code in RETRYABLE_STATUS or exc.status_code >= 500:
+            return f"http_{exc.status_code}"
+    return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    # IncompleteResponseError.response adalah ChatCompletion, bukan response HTTP
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is None:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Batas retry per jendela waktu: retry (dan hedge) hanya boleh selama jumlahnya
+    di bawah `ratio` x request di jendela yang sama, minimal `min_retries`. Saat
+    backend LLM down semua request gagal bersamaan; tanpa budget retry justru
+    melipatgandakan beban ke backend yang sedang bermasalah.
+    """
+
+    def __init__(self, ratio: float = 0.2, window: float = 10.0, min_retries: int = 3):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _prune(self, now: float):
+        cutoff = now - self.window
+        for q in (self._requests, self._retries):
+            while q and q[0] < cutoff:
+                q.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            if len(self._retries) >= max(self.min_retries, self.ratio * len(self._requests)):
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.time())
+            return {
+                "ratio": self.ratio,
+                "window_seconds": self.window,
+                "requests_in_window": len(self._requests),
+                "retries_in_window": len(self._retries),
+                "exhausted": self.exhausted,
+            }
+
+
+class RetryPolicy:
+    """Exponential backoff dengan full jitter, hanya untuk error yang retryable dan selama budget masih ada."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 5.0,
+        multiplier: float = 2.0,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.budget = budget or RetryBudget()
+        self._counters: Dict[str, int] = {"requests": 0, "retries": 0, "gave_up": 0, "not_retryable": 0}
+        self.reasons: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, config, max_attempts: int = 3, section: str = "default") -> "RetryPolicy":
+        return cls(
+            max_attempts=config.getint(section, "llm_retry_max_attempts", fallback=max_attempts),
+            base_delay=config.getfloat(section, "llm_retry_base_delay_ms", fallback=200.0) / 1000.0,
+            max_delay=config.getfloat(section, "llm_retry_max_delay_ms", fallback=5000.0) / 1000.0,
+            budget=RetryBudget(
+                ratio=config.getfloat(section, "llm_retry_budget_ratio", fallback=0.2),
+                window=config.getfloat(section, "llm_retry_budget_window", fallback=10.0),
+                min_retries=config.getint(section, "llm_retry_budget_min", fallback=3),
+            ),
+        )
+
+    def start(self):
+        """Catat satu request baru (basis budget retry)."""
+        self._counters["requests"] += 1
+        self.budget.record_request()
+
+    def backoff(self, attempt: int) -> float:
+        """Delay sebelum attempt ke-(attempt + 1); full jitter supaya retry dari banyak request tidak serempak."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** attempt))
+
+    def next_delay(self, exc: BaseException, attempt: int) -> Optional[float]:
+        """
+        Dipanggil setelah attempt ke-`attempt` (mulai 0) gagal dengan `exc`.
+        Return detik tunggu sebelum retry, atau None kalau harus menyerah.
+        """
+        reason = classify_error(exc)
+        if reason is None:
+            self._counters["not_retryable"] += 1
+            return None
+        if attempt + 1 >= self.max_attempts or not self.budget.try_spend():
+            self._counters["gave_up"] += 1
+            return None
+        self._counters["retries"] += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        delay = self.backoff(attempt)
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            "base_delay": self.base_delay,
+            "max_delay": self.max_delay,
+            **self._counters,
+            "reasons": dict(self.reasons),
+            "budget": self.budget.stats(),
+        }
+
+
+class HedgePolicy:
+    """
+    Hedged request ke base_url lain: kalau attempt utama belum selesai setelah
+    delay (kuantil latency attempt sukses terakhir, default p95), request kedua
+    dikirim ke replica berikutnya dan yang selesai duluan dipakai. Hedge memakai
+    budget yang sama dengan retry.
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        quantile: float = 0.95,
+        min_delay: float = 0.2,
+        initial_delay: float = 2.0,
+        window: int = 256,
+        min_samples: int = 20,
+    ):
+        self.base_urls = [u for u in base_urls if u]
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._latencies: deque = deque(maxlen=window)
+        self._urls = cycle(self.base_urls) if self.base_urls else None
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "skipped_budget": 0}
+
+    @classmethod
+    def from_config(cls, config, section: str = "default") -> Optional["HedgePolicy"]:
+        """None kalau `llm_hedge_base_urls` kosong (hedging mati)."""
+        urls = [u.strip() for u in config.get(section, "llm_hedge_base_urls", fallback="").split(",") if u.strip()]
+        if not urls:
+            return None
+        return cls(
+            urls,
+            quantile=config.getfloat(section, "llm_hedge_quantile", fallback=0.95),
+            min_delay=config.getfloat(section, "llm_hedge_min_delay_ms", fallback=200.0) / 1000.0,
+            initial_delay=config.getfloat(section, "llm_hedge_initial_delay_ms", fallback=2000.0) / 1000.0,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.base_urls)
+
+    def observe(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def current_delay(self) -> float:
+        """Delay hedge saat ini; initial_delay sampai sampel latency cukup."""
+        samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        idx = min(len(samples) - 1, int(self.quantile * len(samples)))
+        return max(self.min_delay, samples[idx])
+
+    def delay(self) -> float:
+        """Delay untuk satu request baru (dihitung ke hedge_rate)."""
+        self.record("requests")
+        return self.current_delay()
+
+    def next_url(self) -> str:
+        with self._lock:
+            return next(self._urls)
+
+    def record(self, event: str):
+        with self._lock:
+            self._counters[event] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hedged = self._counters["hedged"]
+        return {
+            "enabled": True,
+            "base_urls": self.base_urls,
+            "current_delay": self.current_delay(),
+            **self._counters,
+            "hedge_rate": hedged / self._counters["requests"] if self._counters["requests"] else 0.0,
+            "hedge_win_rate": self._counters["hedge_wins"] / hedged if hedged else 0.0,
+        }
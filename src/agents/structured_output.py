@@ -0,0 +1,92 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+# mode response_format:
+# - json_schema : server membatasi decoding ke schema (OpenAI, vLLM, llama.cpp)
+# - json_object : JSON mode, schema hanya lewat instruksi di system prompt
+# - none        : tanpa response_format, tetap divalidasi (server lama)
+RESPONSE_FORMAT_MODES = ("json_schema", "json_object", "none")
+
+OUTPUT_INSTRUCTION = """
+
+Reply with ONLY a JSON object (no markdown, no extra text) that matches this JSON schema:
+{schema}
+"""
+
+PACK_OUTPUT_INSTRUCTION = """
+
+You will receive a JSON array of independent requests. Apply the instructions above to
+each request separately. Reply with ONLY a JSON object of the form {{"items": [...]}} with
+exactly the same number of elements in "items", in the same order, where element i is your
+answer for request i and matches this JSON schema:
+{schema}
+"""
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class ExpandedPrompt(BaseModel):
+    """Stable Diffusion prompt expanded from the user request."""
+
+    positive_prompt: str = Field(..., min_length=1, description="Detailed Stable Diffusion prompt in English")
+    negative_prompt: str = Field("", description="Comma separated things to avoid in the image")
+    style_tags: List[str] = Field(default_factory=list, description="Short style tags, e.g. 'studio lighting'")
+
+    @property
+    def text(self) -> str:
+        """Prompt positif + style tag yang belum disebut di prompt."""
+        lowered = self.positive_prompt.lower()
+        tags = [t.strip() for t in self.style_tags if t.strip() and t.strip().lower() not in lowered]
+        return ", ".join([self.positive_prompt.strip(), *tags])
+
+    def negative(self, default: str = "") -> str:
+        """Negative prompt dari LLM digabung `default` (term yang sama tidak diulang)."""
+        terms, seen = [], set()
+        for term in f"{self.negative_prompt},{default}".split(","):
+            term = term.strip()
+            if term and term.lower() not in seen:
+                seen.add(term.lower())
+                terms.append(term)
+        return ", ".join(terms)
+
+
+def schema_json(model: Type[BaseModel]) -> str:
+    return json.dumps(model.model_json_schema(), ensure_ascii=False)
+
+
+def response_format(model: Type[BaseModel], mode: str = "json_schema") -> Optional[Dict[str, Any]]:
+    """Nilai `response_format` chat completion untuk `model`, None untuk mode `none`."""
+    if mode not in RESPONSE_FORMAT_MODES:
+        raise ValueError(f"response_format mode tidak dikenal: {mode}")
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": model.model_json_schema()}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+def packed_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """Model pembungkus {"items": [model, ...]} untuk packed expansion."""
+    return create_model(f"Packed{model.__name__}", items=(List[model], ...))
+
+
+def parse_output(model: Type[BaseModel], content: Optional[str]) -> Optional[BaseModel]:
+    """Validasi jawaban LLM terhadap `model`; None kalau bukan JSON yang valid."""
+    if not content:
+        return None
+    text = _FENCE.sub("", content.strip())
+    try:
+        return model.model_validate_json(text)
+    except ValidationError:
+        pass
+    # server tanpa constrained decoding kadang menambah teks di sekitar objek JSON
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        return model.model_validate_json(text[start:end + 1])
+    except ValidationError:
+        return None
@@ -0,0 +1,343 @@
+"""
+Server tiruan untuk benchmark: OpenAI chat-completions dan A1111 txt2img/img2img.
+
+    python benchmark/stubs.py llm   --port 9101 --latency lognormal:400:0.35
+    python benchmark/stubs.py a1111 --port 9201 --latency lognormal:2500:0.2 --png-kb 420
+
+Latency ditulis sebagai spec (milidetik):
+- fixed:MS
+- uniform:LO:HI
+- lognormal:MEDIAN:SIGMA
+
+Stub A1111 mensimulasikan GPU: hanya `--gpu-slots` request yang dikerjakan
+bersamaan, sisanya antre. Waktu layanan diskalakan dengan jumlah gambar,
+steps dan resolusi relatif ke setting referensi (20 steps, 512x512). Gambar
+yang dikembalikan adalah PNG noise yang ukurannya dikalibrasi ke `--png-kb`
+supaya biaya decode/simpan/encode di service mirip hasil SD asli.
+"""
+import json
+import time
+import math
+import random
+import base64
+import asyncio
+import argparse
+from io import BytesIO
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from PIL import Image, ImageChops
+from PIL.PngImagePlugin import PngInfo
+
+REFERENCE_STEPS = 20
+REFERENCE_PIXELS = 512 * 512
+
+
+class LatencyModel:
+    """Distribusi latency dari spec `fixed:MS`, `uniform:LO:HI` atau `lognormal:MEDIAN:SIGMA`."""
+
+    def __init__(self, spec: str, seed: int = 0):
+        kind, *params = spec.split(":")
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"latency spec tidak dikenal: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self._rng = random.Random(seed)
+
+    def sample(self) -> float:
+        """Satu sampel latency dalam detik."""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self._rng.uniform(self.params[0], self.params[1])
+        else:
+            median, sigma = self.params
+            ms = self._rng.lognormvariate(math.log(median), sigma)
+        return max(ms, 0.0) / 1000.0
+
+
+def make_png(width: int, height: int, sigma: float, seed: int = 0) -> bytes:
+    """PNG gradient + noise gaussian; makin besar `sigma` makin besar file-nya."""
+    base = Image.merge("RGB", [
+        Image.linear_gradient("L").resize((width, height)),
+        Image.linear_gradient("L").rotate(90).resize((width, height)),
+        Image.new("L", (width, height), 96 + seed % 64),
+    ])
+    noise = Image.merge("RGB", [Image.effect_noise((width, height), sigma) for _ in range(3)])
+    info = PngInfo()
+    info.add_text("parameters", f"benchmark stub image\nSteps: 20, Seed: {seed}, Size: {width}x{height}")
+    buf = BytesIO()
+    ImageChops.add(base, noise, scale=1.0, offset=-128).save(buf, format="PNG", pnginfo=info)
+    return buf.getvalue()
+
+
+def calibrate_noise(width: int, height: int, target_bytes: int) -> float:
+    """Cari sigma noise yang menghasilkan PNG sekitar `target_bytes` (ukuran naik monoton terhadap sigma)."""
+    lo, hi = 0.0, 128.0
+    if len(make_png(width, height, hi)) <= target_bytes:
+        return hi
+    for _ in range(8):
+        mid = (lo + hi) / 2
+        if len(make_png(width, height, mid)) < target_bytes:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+class StubStats:
+    """Counter dan sampel waktu layanan stub, dibaca runner lewat /bench/stats."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.counters: Dict[str, float] = {"requests": 0, "images": 0, "busy_seconds": 0.0}
+        self.service: List[float] = []
+        self.queue_wait: List[float] = []
+
+    def record(self, service: float, queue_wait: float = 0.0, images: int = 0):
+        self.counters["requests"] += 1
+        self.counters["images"] += images
+        self.counters["busy_seconds"] += service
+        self.service.append(service)
+        self.queue_wait.append(queue_wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "window_seconds": time.time() - self.started_at,
+            "service": self.service,
+            "queue_wait": self.queue_wait,
+        }
+
+
+# ---------- OpenAI ----------
+def create_llm_app(latency: LatencyModel) -> FastAPI:
+    app = FastAPI(title="Stub OpenAI chat-completions")
+    stats = StubStats()
+
+    def expand(text: str) -> str:
+        text = " ".join(text.split()) or "portrait"
+        return f"professional profile photo, {text}, soft studio lighting, 85mm lens, sharp focus, high detail"
+
+    def structured(text: str) -> Dict[str, Any]:
+        # bentuk ExpandedPrompt, untuk request dengan response_format (llm_structured_output)
+        return {
+            "positive_prompt": expand(text),
+            "negative_prompt": "cartoon, painting, harsh shadows",
+            "style_tags": ["studio portrait", "natural skin texture"],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        start = time.time()
+        content = str(body["messages"][-1]["content"])
+        is_structured = "response_format" in body
+        await asyncio.sleep(latency.sample())
+
+        if "JSON array" in content:
+            # request packed dari aanalyze_many: jawab array dengan jumlah elemen yang sama
+            start_idx, end_idx = content.find("["), content.rfind("]")
+            try:
+                items = json.loads(content[start_idx:end_idx + 1])
+            except ValueError:
+                items = []
+            if is_structured:
+                answer = json.dumps({"items": [structured(str(item)) for item in items]})
+            else:
+                answer = json.dumps([expand(str(item)) for item in items])
+        elif is_structured:
+            answer = json.dumps(structured(content.replace('Here is the prompt:', '')))
+        else:
+            answer = f"response: {expand(content.replace('Here is the prompt:', ''))}"
+
+        stats.record(time.time() - start)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body["messages"])
+        completion_tokens = len(answer.split())
+        return {
+            "id": f"chatcmpl-stub-{int(start * 1000)}",
+            "object": "chat.completion",
+            "created": int(start),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    @app.get("/bench/stats")
+    async def bench_stats():
+        return stats.snapshot()
+
+    @app.post("/bench/reset")
+    async def bench_reset():
+        stats.reset()
+        return {"ok": True}
+
+    return app
+
+
+# ---------- A1111 ----------
+def create_a1111_app(
+    latency: LatencyModel,
+    png_bytes: int,
+    width: int = 512,
+    height: int = 512,
+    gpu_slots: int = 1,
+    batch_cost: float = 0.6,
+    swap_latency: float = 0.0,
+    checkpoint: str = "realisticUniversalBase_100.safetensors",
+    pool_size: int = 4,
+) -> FastAPI:
+    app = FastAPI(title="Stub A1111")
+    stats = StubStats()
+    gpu = asyncio.Semaphore(gpu_slots)
+    sigma = calibrate_noise(width, height, png_bytes)
+    images = [base64.b64encode(make_png(width, height, sigma, seed=i)).decode("utf-8") for i in range(pool_size)]
+    state = {"checkpoint": checkpoint, "running": []}
+
+    async def generate(body: Dict[str, Any]) -> Dict[str, Any]:
+        count = max(int(body.get("batch_size") or 1), 1) * max(int(body.get("n_iter") or 1), 1)
+        steps = int(body.get("steps") or REFERENCE_STEPS)
+        pixels = int(body.get("width") or 512) * int(body.get("height") or 512)
+        if body.get("enable_hr"):
+            steps += int(body.get("hr_second_pass_steps") or steps)
+        scale = (steps / REFERENCE_STEPS) * (pixels / REFERENCE_PIXELS) * (1 + batch_cost * (count - 1))
+
+        queued = time.time()
+        async with gpu:
+            started = time.time()
+            duration = latency.sample() * scale
+            job = {"started": started, "duration": duration, "steps": steps, "interrupted": asyncio.Event()}
+            state["running"].append(job)
+            try:
+                # /sdapi/v1/interrupt menghentikan job lebih awal, seperti A1111
+                await asyncio.wait_for(job["interrupted"].wait(), timeout=duration)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                state["running"].remove(job)
+        stats.record(time.time() - started, started - queued, count)
+
+        seed = int(body.get("seed", -1))
+        if seed == -1:
+            seed = random.randint(0, 2 ** 32 - count - 1)
+        subseed = int(body.get("subseed", -1))
+        if subseed == -1:
+            subseed = random.randint(0, 2 ** 32 - count - 1)
+        if float(body.get("subseed_strength") or 0) > 0:
+            all_seeds, all_subseeds = [seed] * count, [subseed + i for i in range(count)]
+        else:
+            all_seeds, all_subseeds = [seed + i for i in range(count)], [subseed + i for i in range(count)]
+        info = {"seed": seed, "all_seeds": all_seeds, "subseed": subseed, "all_subseeds": all_subseeds}
+        return {
+            "images": [images[(seed + i) % len(images)] for i in range(count)],
+            "parameters": {},
+            "info": json.dumps(info),
+        }
+
+    @app.post("/sdapi/v1/txt2img")
+    async def txt2img(request: Request):
+        return await generate(await request.json())
+
+    @app.post("/sdapi/v1/img2img")
+    async def img2img(request: Request):
+        return await generate(await request.json())
+
+    @app.get("/sdapi/v1/progress")
+    async def progress():
+        if not state["running"]:
+            return {"progress": 0.0, "eta_relative": 0.0, "state": {}, "current_image": None}
+        job = state["running"][0]
+        done = min((time.time() - job["started"]) / max(job["duration"], 1e-6), 1.0)
+        return {
+            "progress": done,
+            "eta_relative": max(job["duration"] - (time.time() - job["started"]), 0.0),
+            "state": {"sampling_step": int(done * job["steps"]), "sampling_steps": job["steps"]},
+            "current_image": None,
+        }
+
+    @app.get("/sdapi/v1/options")
+    async def get_options():
+        return {"sd_model_checkpoint": state["checkpoint"]}
+
+    @app.post("/sdapi/v1/options")
+    async def set_options(request: Request):
+        body = await request.json()
+        if "sd_model_checkpoint" in body and body["sd_model_checkpoint"] != state["checkpoint"]:
+            async with gpu:
+                await asyncio.sleep(swap_latency)
+            state["checkpoint"] = body["sd_model_checkpoint"]
+        return None
+
+    @app.post("/sdapi/v1/interrupt")
+    async def interrupt():
+        if state["running"]:
+            state["running"][0]["interrupted"].set()
+            stats.counters["interrupts"] = stats.counters.get("interrupts", 0) + 1
+        return {}
+
+    @app.get("/internal/ping")
+    async def ping():
+        return {}
+
+    @app.get("/bench/stats")
+    async def bench_stats():
+        return {**stats.snapshot(), "gpu_slots": gpu_slots, "png_bytes": [len(base64.b64decode(i)) for i in images]}
+
+    @app.post("/bench/reset")
+    async def bench_reset():
+        stats.reset()
+        return {"ok": True}
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Stub OpenAI / A1111 untuk benchmark")
+    parser.add_argument("kind", choices=("llm", "a1111"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", default=None, help="Spec latency (ms), mis. lognormal:2500:0.2")
+    parser.add_argument("--seed", type=int, default=0, help="Seed RNG latency")
+    parser.add_argument("--png-kb", type=int, default=420, help="Target ukuran PNG hasil (KB)")
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--gpu-slots", type=int, default=1, help="Request yang dikerjakan bersamaan")
+    parser.add_argument("--batch-cost", type=float, default=0.6, help="Biaya tiap gambar tambahan dalam satu batch")
+    parser.add_argument("--swap-ms", type=float, default=8000.0, help="Waktu ganti checkpoint (ms)")
+    parser.add_argument("--checkpoint", default="realisticUniversalBase_100.safetensors", help="Checkpoint yang resident saat start")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.kind == "llm":
+        app = create_llm_app(LatencyModel(args.latency or "lognormal:400:0.35", seed=args.seed))
+    else:
+        app = create_a1111_app(
+            LatencyModel(args.latency or "lognormal:2500:0.2", seed=args.seed),
+            png_bytes=args.png_kb * 1024,
+            width=args.width,
+            height=args.height,
+            gpu_slots=args.gpu_slots,
+            batch_cost=args.batch_cost,
+            swap_latency=args.swap_ms / 1000.0,
+            checkpoint=args.checkpoint,
+        )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
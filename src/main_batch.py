@@ -0,0 +1,401 @@
+"""
+Batch offline txt2img / img2img dari file JSONL, bisa dilanjutkan setelah crash.
+
+    python main_batch.py jobs.jsonl --out batch_runs/onboarding --concurrency 16
+
+Satu baris input = satu job:
+    {"kind": "txt2img", "prompt": "poto profil pria formal", "seed": -1}
+    {"kind": "img2img", "prompt": "...", "images": ["foto/a.jpg"], "denoising_strength": 0.6}
+`id` opsional (default nomor baris), `kind` default txt2img.
+
+Output di folder --out:
+- manifest.jsonl  : satu baris per job yang selesai (sukses/error), ditulis begitu job selesai
+- checkpoint.json : posisi input yang sudah pasti selesai + ringkasan, ditulis atomik berkala
+- images/         : hasil img2img (txt2img tetap di image store `output_dir`)
+
+Menjalankan ulang dengan --out yang sama melanjutkan dari checkpoint; job yang
+sudah tercatat di manifest tidak dikerjakan lagi. Job yang gagal karena error
+backend (mis. backend mati di tengah run) diulang dengan --retry-failed, juga
+setelah batch selesai.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from configparser import ConfigParser
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from loguru import logger
+
+path_this = os.path.dirname(os.path.abspath(__file__))
+path_project = os.path.dirname(os.path.join(path_this, ".."))
+path_root = os.path.dirname(os.path.join(path_this, "../.."))
+sys.path.extend([path_this, path_project, path_root])
+
+from tools.backend_pool import BackendPool
+from tools.generation_index import GenerationIndex
+from tools.tools_generate_i2i import SDImg2Img
+from tools.tracing import configure_logging
+
+IMG2IMG_FIELDS = ("negative_prompt", "steps", "cfg_scale", "denoising_strength", "sampler_name", "width", "height")
+
+
+class BatchCheckpoint:
+    """
+    Progress batch. `watermark` = nomor baris pertama yang belum pasti selesai,
+    `input_offset` = byte offset baris itu di file input, sehingga resume cukup
+    seek tanpa membaca ulang seluruh input. Job yang selesai di atas watermark
+    (urutan selesai tidak berurutan) disimpan di `done_above`.
+    """
+
+    def __init__(self, out_dir: str):
+        self.path = os.path.join(out_dir, "checkpoint.json")
+        self.input_path: Optional[str] = None
+        self.watermark = 0
+        self.input_offset = 0
+        self.manifest_offset = 0
+        self.done_above: Dict[int, int] = {}
+        self.counts = {"succeeded": 0, "failed": 0}
+        self.started_at = time.time()
+        self.finished = False
+
+    def load(self) -> bool:
+        if not os.path.isfile(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.input_path = data["input_path"]
+        self.watermark = data["watermark"]
+        self.input_offset = data["input_offset"]
+        self.manifest_offset = data["manifest_offset"]
+        self.done_above = {int(k): v for k, v in data.get("done_above", {}).items()}
+        self.counts = data.get("counts", self.counts)
+        self.started_at = data.get("started_at", self.started_at)
+        self.finished = data.get("finished", False)
+        return True
+
+    def save(self, manifest_offset: int):
+        self.manifest_offset = manifest_offset
+        data = {
+            "input_path": self.input_path,
+            "watermark": self.watermark,
+            "input_offset": self.input_offset,
+            "manifest_offset": self.manifest_offset,
+            "done_above": self.done_above,
+            "counts": self.counts,
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "finished": self.finished,
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def is_done(self, line_no: int) -> bool:
+        return line_no < self.watermark or line_no in self.done_above
+
+    def mark_done(self, line_no: int, input_end: int):
+        """Catat baris selesai lalu majukan watermark selama baris berikutnya juga sudah selesai."""
+        if line_no < self.watermark:
+            return
+        self.done_above[line_no] = input_end
+        while self.watermark in self.done_above:
+            self.input_offset = self.done_above.pop(self.watermark)
+            self.watermark += 1
+
+
+class BatchRunner:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.config = ConfigParser()
+        self.config.read(os.environ.get("PHOTO_AGENT_CONFIG", os.path.join(path_this, "config.ini")))
+        configure_logging(self.config.get("default", "log_level", fallback="DEBUG"))
+        self.out_dir = args.out
+        self.images_dir = os.path.join(self.out_dir, "images")
+        self.manifest_path = os.path.join(self.out_dir, "manifest.jsonl")
+        os.makedirs(self.images_dir, exist_ok=True)
+
+        self.checkpoint = BatchCheckpoint(self.out_dir)
+        self.llm_sem = asyncio.Semaphore(args.llm_concurrency)
+        self.sd_sem = asyncio.Semaphore(args.sd_concurrency)
+        self._agent = None
+        self._img2img_ready = False
+        self._manifest = None
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.time()
+        self._processed = 0
+        self._retrying: set = set()
+
+    # ---------- backend, dibuat hanya kalau job jenis itu ada ----------
+    async def _t2i_agent(self):
+        if self._agent is None:
+            from main_photo_generatort2i import ImageGenAgent
+            self._agent = ImageGenAgent()
+            await self._agent.astart()
+        return self._agent
+
+    def _ensure_img2img(self):
+        if not self._img2img_ready:
+            SDImg2Img.configure_pool(BackendPool.from_config(self.config, fallback_urls=SDImg2Img.DEFAULT_BACKEND))
+            SDImg2Img.pool.start()
+            SDImg2Img.configure_index(GenerationIndex(
+                os.path.join(path_project, self.config.get("default", "generation_index_path", fallback="index/generations.sqlite3"))
+            ))
+            self._img2img_ready = True
+
+    async def close(self):
+        if self._agent is not None:
+            await self._agent.aclose()
+        if self._img2img_ready:
+            await SDImg2Img.pool.stop()
+            await SDImg2Img.aclose()
+            SDImg2Img.index.close()
+
+    # ---------- job ----------
+    async def _run_txt2img(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        agent = await self._t2i_agent()
+        async with self.llm_sem:
+            expanded, prompt_seconds = await agent.aexpand_prompt(job["prompt"])
+        async with self.sd_sem:
+            return await agent.agenerate_expanded(
+                f"session_{uuid.uuid4().hex[:8]}", job["prompt"], expanded, prompt_seconds,
+                seed=job.get("seed", -1), include_base64=False,
+            )
+
+    async def _run_img2img(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        self._ensure_img2img()
+        width, height = job.get("width", 512), job.get("height", 512)
+        images_b64 = job.get("images_b64") or [
+            await asyncio.to_thread(SDImg2Img.file_to_base64, path, width, height) for path in job["images"]
+        ]
+        sd = SDImg2Img(
+            images_b64=images_b64,
+            prompt=job["prompt"],
+            output_dir=self.images_dir,
+            **{k: job[k] for k in IMG2IMG_FIELDS if k in job},
+        )
+        async with self.sd_sem:
+            images = await sd.agenerate_and_save(include_base64=False)
+        return {"images": images}
+
+    async def _process(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        kind = job.get("kind", "txt2img")
+        if kind == "txt2img":
+            return await self._run_txt2img(job)
+        if kind == "img2img":
+            return await self._run_img2img(job)
+        raise ValueError(f"kind tidak dikenal: {kind}")
+
+    async def _process_with_retry(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(self.args.retries + 1):
+            try:
+                return await self._process(job)
+            except (ValueError, KeyError):
+                raise
+            except Exception as e:
+                if attempt >= self.args.retries:
+                    raise
+                delay = self.args.retry_backoff * (2 ** attempt)
+                logger.warning(f"Job {job.get('id')} gagal ({e}), retry dalam {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    # ---------- manifest / checkpoint ----------
+    def _resume(self):
+        """Muat checkpoint lalu baca manifest setelah checkpoint terakhir (job yang selesai sesudahnya)."""
+        input_path = os.path.abspath(self.args.input)
+        if self.checkpoint.load():
+            if self.checkpoint.input_path != input_path:
+                raise SystemExit(f"--out sudah dipakai untuk input lain: {self.checkpoint.input_path}")
+            logger.info(f"Resume dari baris {self.checkpoint.watermark} ({self.checkpoint.counts})")
+        self.checkpoint.input_path = input_path
+
+        if not os.path.isfile(self.manifest_path):
+            return
+        with open(self.manifest_path, "rb+") as f:
+            f.seek(self.checkpoint.manifest_offset)
+            good_end = self.checkpoint.manifest_offset
+            recovered = 0
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    row = json.loads(raw)
+                except ValueError:
+                    break
+                good_end += len(raw)
+                if not self.checkpoint.is_done(row["line"]):
+                    self.checkpoint.mark_done(row["line"], row["input_end"])
+                    self.checkpoint.counts["succeeded" if row["status"] == "success" else "failed"] += 1
+                    recovered += 1
+            # baris terakhir yang terpotong saat crash dibuang
+            f.truncate(good_end)
+        if recovered:
+            logger.info(f"{recovered} job dipulihkan dari manifest setelah checkpoint terakhir")
+
+    def _retryable_failures(self) -> Set[int]:
+        """Baris yang hasil terakhirnya di manifest error backend (bukan input tidak valid)."""
+        failed: Set[int] = set()
+        if not os.path.isfile(self.manifest_path):
+            return failed
+        with open(self.manifest_path, "rb") as f:
+            for raw in f:
+                row = json.loads(raw)
+                if row["status"] == "error" and row.get("retryable", True):
+                    failed.add(row["line"])
+                else:
+                    failed.discard(row["line"])
+        return failed
+
+    def _write_result(self, row: Dict[str, Any]):
+        self._manifest.write(json.dumps(row, default=str).encode("utf-8") + b"\n")
+        self._manifest.flush()
+        if row["line"] in self._retrying:
+            # hasil ulang menggantikan error sebelumnya di hitungan
+            self._retrying.discard(row["line"])
+            self.checkpoint.counts["failed"] -= 1
+        self.checkpoint.mark_done(row["line"], row["input_end"])
+        self.checkpoint.counts["succeeded" if row["status"] == "success" else "failed"] += 1
+        self._processed += 1
+        self._since_checkpoint += 1
+        if (
+            self._since_checkpoint >= self.args.checkpoint_every
+            or time.time() - self._last_checkpoint >= self.args.checkpoint_interval
+        ):
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+        self.checkpoint.save(self._manifest.tell())
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.time()
+
+    def _read_input(self, offset: Optional[int] = None, line_no: Optional[int] = None) -> Iterator[Tuple[int, int, bytes]]:
+        """(nomor baris, byte offset akhir baris, isi) mulai dari watermark checkpoint (default)."""
+        offset = self.checkpoint.input_offset if offset is None else offset
+        line_no = self.checkpoint.watermark if line_no is None else line_no
+        with open(self.args.input, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                offset += len(raw)
+                yield line_no, offset, raw
+                line_no += 1
+
+    # ---------- main loop ----------
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line_no, input_end, job = item
+            start = time.time()
+            row = {"line": line_no, "input_end": input_end, "id": job.get("id", line_no), "kind": job.get("kind", "txt2img")}
+            try:
+                row["data"] = await self._process_with_retry(job)
+                row["status"] = "success"
+            except Exception as e:
+                logger.error(f"Job {row['id']} (baris {line_no}) gagal: {e}")
+                row["status"] = "error"
+                row["error"] = str(e)
+                # error backend (setelah retry habis) bisa diulang dengan --retry-failed, job tidak valid tidak
+                row["retryable"] = not isinstance(e, (ValueError, KeyError))
+            row["elapsed"] = time.time() - start
+            self._write_result(row)
+
+    def _parse(self, line_no: int, input_end: int, raw: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            job = json.loads(raw)
+            if not isinstance(job, dict) or not job.get("prompt"):
+                raise ValueError("job harus object JSON dengan field prompt")
+            return job
+        except ValueError as e:
+            self._write_result({
+                "line": line_no, "input_end": input_end, "id": line_no, "status": "error",
+                "error": f"baris tidak valid: {e}", "retryable": False, "elapsed": 0.0,
+            })
+            return None
+
+    async def _report(self, started: float):
+        while True:
+            await asyncio.sleep(self.args.report_interval)
+            rate = self._processed / max(time.time() - started, 1e-9)
+            logger.info(
+                f"Batch: {self.checkpoint.counts['succeeded']} sukses, {self.checkpoint.counts['failed']} gagal, "
+                f"watermark baris {self.checkpoint.watermark}, {rate:.2f} job/s"
+            )
+
+    async def run(self):
+        self._resume()
+        if self.args.retry_failed:
+            self._retrying = self._retryable_failures()
+        if self.checkpoint.finished and not self._retrying:
+            logger.info("Batch ini sudah selesai, tidak ada yang dikerjakan")
+            return
+        self._manifest = open(self.manifest_path, "ab")
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.args.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.args.concurrency)]
+        reporter = asyncio.create_task(self._report(time.time()))
+        try:
+            if self._retrying:
+                # job gagal ada di bawah watermark, input dibaca dari awal khusus baris itu
+                logger.info(f"Mengulang {len(self._retrying)} job yang gagal karena error backend")
+                retry = set(self._retrying)
+                for line_no, input_end, raw in self._read_input(0, 0):
+                    if line_no in retry:
+                        job = self._parse(line_no, input_end, raw)
+                        if job is not None:
+                            await queue.put((line_no, input_end, job))
+            for line_no, input_end, raw in self._read_input():
+                if self.checkpoint.is_done(line_no):
+                    continue
+                if not raw.strip():
+                    self.checkpoint.mark_done(line_no, input_end)
+                    continue
+                job = self._parse(line_no, input_end, raw)
+                if job is not None:
+                    await queue.put((line_no, input_end, job))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self.checkpoint.finished = True
+        finally:
+            reporter.cancel()
+            for task in workers:
+                task.cancel()
+            self._save_checkpoint()
+            self._manifest.close()
+            await self.close()
+        logger.success(f"Batch selesai: {self.checkpoint.counts}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Batch txt2img/img2img dari file JSONL (resumable)")
+    parser.add_argument("input", help="File JSONL, satu job per baris")
+    parser.add_argument("--out", default="batch_runs/default", help="Folder manifest, checkpoint dan hasil img2img")
+    parser.add_argument("--concurrency", type=int, default=8, help="Jumlah job yang dikerjakan paralel")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Maksimal call LLM paralel")
+    parser.add_argument("--sd-concurrency", type=int, default=4, help="Maksimal call SD paralel")
+    parser.add_argument("--retries", type=int, default=2, help="Retry per job untuk error backend")
+    parser.add_argument(
+        "--retry-failed", action="store_true",
+        help="Ulangi job yang gagal karena error backend (dicatat di manifest) sebelum melanjutkan",
+    )
+    parser.add_argument("--retry-backoff", type=float, default=2.0, help="Detik backoff awal, dikali 2 tiap retry")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="Tulis checkpoint tiap N job selesai")
+    parser.add_argument("--checkpoint-interval", type=float, default=30.0, help="...atau tiap N detik")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="Log progress tiap N detik")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        asyncio.run(BatchRunner(args).run())
+    except KeyboardInterrupt:
+        logger.warning("Dihentikan, jalankan ulang dengan --out yang sama untuk melanjutkan")
@@ -0,0 +1,557 @@
+"""
+Benchmark / load test service txt2img dan img2img terhadap backend tiruan.
+
+    python main_benchmark.py --scenarios t2i,img2img --concurrency 1,4,16 --requests 64
+
+Runner menjalankan stub OpenAI dan stub A1111 (benchmark/stubs.py), lalu
+menjalankan main_service_photo_gent2i dan main_service_img2img sebagai proses
+uvicorn dengan config.ini sementara (env PHOTO_AGENT_CONFIG) yang mengarah ke
+stub. Tiap kombinasi skenario x concurrency dijalankan closed-loop: N worker
+masing-masing langsung mengirim request berikutnya begitu response diterima.
+
+Hasil per level:
+- latency p50/p95/p99 (sisi client) dan throughput
+- breakdown per stage: timings dari generation index (prompt_expansion, generate),
+  overhead service (total - stage), antre dan waktu layanan di stub
+- peak RSS proses service (termasuk worker process pool)
+
+Semua ditulis ke `--out/bench_<waktu>_<commit>.json`; `--baseline file.json`
+mencetak selisih p95/throughput terhadap hasil sebelumnya.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+path_this = os.path.dirname(os.path.abspath(__file__))
+path_project = os.path.dirname(os.path.join(path_this, ".."))
+path_root = os.path.dirname(os.path.join(path_this, "../.."))
+sys.path.extend([path_this, path_project, path_root])
+
+STUBS_SCRIPT = os.path.join(path_this, "benchmark", "stubs.py")
+SERVICES = {
+    "t2i": "main_service_photo_gent2i:app",
+    "img2img": "main_service_img2img:app",
+}
+PROMPTS = (
+    "poto profil pria formal kemeja biru",
+    "foto profil wanita hijab latar kantor",
+    "headshot profesional dokter jas putih",
+    "foto profil casual outdoor tersenyum",
+    "portrait kreatif desainer grafis studio",
+)
+
+
+# ---------- statistik ----------
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentile dengan interpolasi linear (q 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(values: List[float], scale: float = 1000.0) -> Dict[str, Any]:
+    """Ringkasan distribusi (default detik -> milidetik)."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) * scale,
+        "min": min(values) * scale,
+        "p50": percentile(values, 50) * scale,
+        "p95": percentile(values, 95) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale,
+    }
+
+
+# ---------- proses ----------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int) -> Dict[str, int]:
+    """VmRSS/VmHWM (bytes) dari /proc/<pid>/status."""
+    result = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    result[key] = int(value.split()[0]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return result
+
+
+def _process_tree(pid: int) -> List[int]:
+    """pid beserta semua turunannya (worker ProcessPoolExecutor ikut dihitung)."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+class RSSSampler:
+    """Sampling RSS process tree service secara berkala; peak di-reset per level."""
+
+    def __init__(self, pids: Dict[str, int], interval: float = 0.2):
+        self.pids = pids
+        self.interval = interval
+        self.peak: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.available = os.path.isdir("/proc")
+
+    def reset(self):
+        self.peak = {name: 0 for name in self.pids}
+
+    def sample(self):
+        for name, pid in self.pids.items():
+            total = sum(_proc_status(p).get("VmRSS", 0) for p in _process_tree(pid))
+            self.peak[name] = max(self.peak.get(name, 0), total)
+
+    async def _loop(self):
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.reset()
+        if self.available and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def high_water(self) -> Dict[str, Optional[int]]:
+        """VmHWM proses utama service (peak kernel sejak start)."""
+        return {name: _proc_status(pid).get("VmHWM") for name, pid in self.pids.items()}
+
+
+# ---------- runner ----------
+class BenchmarkRunner:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+        unknown = set(self.scenarios) - set(SERVICES)
+        if unknown:
+            raise ValueError(f"skenario tidak dikenal: {', '.join(sorted(unknown))}")
+        self.levels = [int(c) for c in str(args.concurrency).split(",")]
+        self.workdir = tempfile.mkdtemp(prefix="photo_bench_")
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.urls: Dict[str, str] = {}
+        self.sd_urls: List[str] = []
+        self.client: Optional[httpx.AsyncClient] = None
+        self.sampler: Optional[RSSSampler] = None
+        self._init_image_b64: Optional[str] = None
+
+    # ---------- setup ----------
+    def _spawn(self, name: str, cmd: List[str], env: Optional[Dict[str, str]] = None):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "wb")
+        self.processes[name] = subprocess.Popen(
+            cmd, cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT,
+            env={**os.environ, **(env or {})},
+        )
+
+    def _start_stubs(self):
+        args = self.args
+        port = free_port()
+        self.urls["stub_llm"] = f"http://127.0.0.1:{port}"
+        self._spawn("stub_llm", [
+            sys.executable, STUBS_SCRIPT, "llm", "--port", str(port), "--latency", args.llm_latency,
+        ])
+        for i in range(args.sd_backends):
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            self.sd_urls.append(url)
+            self.urls[f"stub_sd{i}"] = url
+            self._spawn(f"stub_sd{i}", [
+                sys.executable, STUBS_SCRIPT, "a1111", "--port", str(port),
+                "--latency", args.sd_latency, "--seed", str(i),
+                "--png-kb", str(args.png_kb), "--gpu-slots", str(args.gpu_slots),
+                "--batch-cost", str(args.batch_cost), "--swap-ms", str(args.swap_ms),
+                "--checkpoint", args.sd_checkpoint,
+            ])
+
+    def _write_config(self) -> str:
+        prompts_path = os.path.join(self.workdir, "system_prompts.json")
+        with open(prompts_path, "w") as f:
+            json.dump({"agent_com": {"system_prompt": "Expand the user's request into a detailed Stable Diffusion prompt."}}, f)
+        config = {
+            "base_url": f"{self.urls['stub_llm']}/v1",
+            "model_name": "stub",
+            "system_prompt_path_copy": prompts_path,
+            "sd_backends": ",".join(self.sd_urls),
+            "sd_base_url": self.sd_urls[0],
+            # prompt benchmark unik per request, cache hanya menambah noise pengukuran
+            "prompt_cache_enabled": "false",
+            "prompt_cache_path": os.path.join(self.workdir, "cache", "prompt_cache.sqlite3"),
+            "generation_index_path": os.path.join(self.workdir, "index", "generations.sqlite3"),
+            "derivative_cache_path": os.path.join(self.workdir, "cache", "derivatives"),
+            "output_dir": os.path.join(self.workdir, "output"),
+        }
+        for item in self.args.set or []:
+            key, _, value = item.partition("=")
+            config[key.strip()] = value.strip()
+        path = os.path.join(self.workdir, "config.ini")
+        with open(path, "w") as f:
+            f.write("[default]\n")
+            for key, value in config.items():
+                f.write(f"{key} = {value}\n")
+        self.config = config
+        return path
+
+    def _start_services(self, config_path: str):
+        for scenario in self.scenarios:
+            port = free_port()
+            self.urls[scenario] = f"http://127.0.0.1:{port}"
+            self._spawn(scenario, [
+                sys.executable, "-m", "uvicorn", SERVICES[scenario], "--app-dir", path_this,
+                "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log",
+            ], env={"PHOTO_AGENT_CONFIG": config_path})
+
+    async def _wait_ready(self, name: str, path: str, timeout: float = 90.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.processes[name].poll() is not None:
+                raise RuntimeError(f"{name} berhenti saat startup, lihat {self.workdir}/{name}.log")
+            try:
+                r = await self.client.get(f"{self.urls[name]}{path}", timeout=2.0)
+                if r.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+        raise RuntimeError(f"{name} tidak siap dalam {timeout:.0f}s, lihat {self.workdir}/{name}.log")
+
+    async def setup(self):
+        self.client = httpx.AsyncClient(
+            timeout=self.args.timeout,
+            limits=httpx.Limits(max_connections=max(self.levels) * 2 + 8, max_keepalive_connections=max(self.levels) * 2),
+        )
+        self._start_stubs()
+        stubs = [name for name in self.processes]
+        await asyncio.gather(*(self._wait_ready(name, "/bench/stats") for name in stubs))
+        self._start_services(self._write_config())
+        await asyncio.gather(*(self._wait_ready(name, "/stats/backends") for name in self.scenarios))
+        self.sampler = RSSSampler({name: self.processes[name].pid for name in self.scenarios})
+        logger.info(f"Stub dan service siap di {self.workdir}")
+
+    async def teardown(self):
+        if self.sampler is not None:
+            await self.sampler.stop()
+        if self.client is not None:
+            await self.client.aclose()
+        for proc in self.processes.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.args.keep_workdir:
+            logger.info(f"Workdir dipertahankan: {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    # ---------- request ----------
+    def _init_image(self) -> str:
+        if self._init_image_b64 is None:
+            from benchmark.stubs import calibrate_noise, make_png
+            size = self.args.init_size
+            sigma = calibrate_noise(size, size, self.args.init_kb * 1024)
+            self._init_image_b64 = base64.b64encode(make_png(size, size, sigma, seed=7)).decode("utf-8")
+        return self._init_image_b64
+
+    def _request(self, scenario: str, seq: int) -> Dict[str, Any]:
+        prompt = f"{PROMPTS[seq % len(PROMPTS)]} #{seq}-{random.randint(0, 1 << 30)}"
+        params = {"response_format": self.args.response_format}
+        if scenario == "t2i":
+            return {"url": f"{self.urls['t2i']}/generate-photo-profile/", "params": params,
+                    "json": {"prompt": prompt, "seed": -1}}
+        return {"url": f"{self.urls['img2img']}/img2img", "params": params,
+                "json": {"images_b64": [self._init_image()], "prompt": prompt, "steps": 20}}
+
+    @staticmethod
+    def _parse(scenario: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Ambil id generation dan timing sisi server dari body response."""
+        data = body.get("data") or {}
+        if scenario == "t2i":
+            items = data.get("variants") or [data]
+            return {"generation_ids": [i.get("generation_id") for i in items if i.get("generation_id")]}
+        images = data.get("images") or []
+        generate = max((i.get("elapsed_time") or 0.0 for i in images), default=0.0)
+        return {
+            "generation_ids": [i.get("id") for i in images if i.get("id")],
+            "stages": {"server_total": body.get("elapsed_time") or 0.0, "generate": generate},
+        }
+
+    async def _one(self, scenario: str, seq: int) -> Dict[str, Any]:
+        req = self._request(scenario, seq)
+        start = time.perf_counter()
+        try:
+            r = await self.client.post(req["url"], params=req["params"], json=req["json"])
+            latency = time.perf_counter() - start
+            result = {"latency": latency, "status": r.status_code, "bytes": len(r.content)}
+            if r.status_code == 200 and r.headers.get("content-type", "").startswith("application/json"):
+                result.update(self._parse(scenario, r.json()))
+            return result
+        except httpx.HTTPError as e:
+            return {"latency": time.perf_counter() - start, "status": None, "error": type(e).__name__}
+
+    async def _closed_loop(self, scenario: str, concurrency: int, total: int) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        counter = iter(range(total))
+
+        async def worker():
+            for seq in counter:
+                results.append(await self._one(scenario, seq))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results
+
+    # ---------- stage breakdown ----------
+    async def _generation_timings(self, scenario: str, results: List[Dict[str, Any]]) -> List[Dict[str, float]]:
+        sem = asyncio.Semaphore(16)
+
+        async def fetch(result: Dict[str, Any]) -> Dict[str, float]:
+            timings = {**(result.get("stages") or {}), "_latency": result["latency"]}
+            async with sem:
+                try:
+                    r = await self.client.get(f"{self.urls[scenario]}/generations/{result['generation_ids'][0]}")
+                    if r.status_code == 200:
+                        timings.update(r.json().get("timings") or {})
+                except (httpx.HTTPError, ValueError):
+                    pass
+            return timings
+
+        return await asyncio.gather(*(fetch(r) for r in results if r.get("generation_ids")))
+
+    def _stages(self, scenario: str, timings: List[Dict[str, float]]) -> Dict[str, Any]:
+        per_stage: Dict[str, List[float]] = {}
+        for t in timings:
+            latency = t.pop("_latency")
+            if scenario == "t2i":
+                t["overhead"] = latency - t.get("prompt_expansion", 0.0) - t.get("generate", 0.0)
+            else:
+                t["preprocess_and_save"] = t.get("server_total", 0.0) - t.get("generate", 0.0)
+                t["overhead"] = latency - t.get("server_total", 0.0)
+                t.pop("server_total", None)
+            for stage, seconds in t.items():
+                if isinstance(seconds, (int, float)):
+                    per_stage.setdefault(stage, []).append(float(seconds))
+        return {stage: summarize(values) for stage, values in per_stage.items()}
+
+    async def _stub_stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        names = ["stub_llm"] + [f"stub_sd{i}" for i in range(len(self.sd_urls))]
+        for name in names:
+            try:
+                data = (await self.client.get(f"{self.urls[name]}/bench/stats")).json()
+            except (httpx.HTTPError, ValueError):
+                continue
+            entry = {
+                "requests": data["requests"],
+                "service": summarize(data["service"]),
+            }
+            if name != "stub_llm":
+                entry["images"] = data["images"]
+                entry["queue_wait"] = summarize(data["queue_wait"])
+                entry["utilization"] = data["busy_seconds"] / max(data["window_seconds"] * data["gpu_slots"], 1e-9)
+            out[name] = entry
+        return out
+
+    async def _reset_stubs(self):
+        names = ["stub_llm"] + [f"stub_sd{i}" for i in range(len(self.sd_urls))]
+        await asyncio.gather(*(self.client.post(f"{self.urls[n]}/bench/reset") for n in names))
+
+    async def _service_stats(self, scenario: str) -> Dict[str, Any]:
+        paths = ["/stats/backends", "/stats/jobs", "/stats/storage"]
+        if scenario == "t2i":
+            paths += ["/stats/batching", "/stats/llm-pool"]
+        out = {}
+        for path in paths:
+            try:
+                r = await self.client.get(f"{self.urls[scenario]}{path}")
+                if r.status_code == 200:
+                    out[path.rsplit("/", 1)[1]] = r.json()
+            except (httpx.HTTPError, ValueError):
+                continue
+        return out
+
+    # ---------- run ----------
+    async def run_level(self, scenario: str, concurrency: int) -> Dict[str, Any]:
+        if self.args.warmup:
+            await self._closed_loop(scenario, concurrency, self.args.warmup)
+        await self._reset_stubs()
+        self.sampler.reset()
+        self.sampler.sample()
+
+        started = time.perf_counter()
+        results = await self._closed_loop(scenario, concurrency, self.args.requests)
+        duration = time.perf_counter() - started
+        self.sampler.sample()
+
+        ok = [r for r in results if r["status"] == 200]
+        errors: Dict[str, int] = {}
+        for r in results:
+            if r["status"] != 200:
+                key = str(r.get("error") or r["status"])
+                errors[key] = errors.get(key, 0) + 1
+
+        level = {
+            "scenario": scenario,
+            "concurrency": concurrency,
+            "requests": len(results),
+            "succeeded": len(ok),
+            "errors": errors,
+            "duration_s": duration,
+            "throughput_rps": len(ok) / duration if duration else 0.0,
+            "latency_ms": summarize([r["latency"] for r in ok]),
+            "response_bytes": summarize([r["bytes"] for r in ok], scale=1.0),
+            "stages_ms": self._stages(scenario, await self._generation_timings(scenario, ok)),
+            "stubs": await self._stub_stats(),
+            "peak_rss_bytes": self.sampler.peak.get(scenario),
+            "service_stats": await self._service_stats(scenario),
+        }
+        lat = level["latency_ms"]
+        logger.info(
+            f"{scenario} c={concurrency}: {level['throughput_rps']:.2f} req/s, "
+            f"p50 {lat.get('p50', 0):.0f}ms p95 {lat.get('p95', 0):.0f}ms p99 {lat.get('p99', 0):.0f}ms, "
+            f"errors {sum(errors.values())}, peak RSS {(level['peak_rss_bytes'] or 0) / 1024 ** 2:.0f}MB"
+        )
+        return level
+
+    async def run(self) -> Dict[str, Any]:
+        report = {"meta": self._meta(), "levels": []}
+        try:
+            await self.setup()
+            self.sampler.start()
+            for scenario in self.scenarios:
+                for concurrency in self.levels:
+                    report["levels"].append(await self.run_level(scenario, concurrency))
+            report["peak_rss_hwm_bytes"] = self.sampler.high_water()
+        finally:
+            await self.teardown()
+        report["meta"]["finished_at"] = time.time()
+        return report
+
+    def _meta(self) -> Dict[str, Any]:
+        def git(*cmd: str) -> Optional[str]:
+            try:
+                return subprocess.check_output(["git", *cmd], cwd=path_this, stderr=subprocess.DEVNULL).decode().strip()
+            except (OSError, subprocess.CalledProcessError):
+                return None
+
+        return {
+            "started_at": time.time(),
+            "commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(self.args),
+        }
+
+
+# ---------- laporan ----------
+def write_report(report: Dict[str, Any], out_dir: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(report["meta"]["started_at"]))
+    commit = (report["meta"]["commit"] or "nogit")[:10]
+    path = os.path.join(out_dir, f"bench_{stamp}_{commit}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+
+def compare(report: Dict[str, Any], baseline_path: str):
+    """Cetak selisih p95 dan throughput per (skenario, concurrency) terhadap baseline."""
+    with open(baseline_path) as f:
+        baseline = {(l["scenario"], l["concurrency"]): l for l in json.load(f)["levels"]}
+    for level in report["levels"]:
+        base = baseline.get((level["scenario"], level["concurrency"]))
+        if base is None:
+            continue
+        p95, base_p95 = level["latency_ms"].get("p95"), base["latency_ms"].get("p95")
+        tput, base_tput = level["throughput_rps"], base["throughput_rps"]
+        p95_delta = (p95 / base_p95 - 1) * 100 if p95 and base_p95 else float("nan")
+        tput_delta = (tput / base_tput - 1) * 100 if base_tput else float("nan")
+        print(
+            f"{level['scenario']:>8} c={level['concurrency']:<4} "
+            f"p95 {base_p95 or 0:8.0f} -> {p95 or 0:8.0f} ms ({p95_delta:+.1f}%)  "
+            f"throughput {base_tput:7.2f} -> {tput:7.2f} req/s ({tput_delta:+.1f}%)"
+        )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark service txt2img/img2img dengan backend tiruan")
+    parser.add_argument("--scenarios", default="t2i,img2img", help="Dipisah koma: t2i, img2img")
+    parser.add_argument("--concurrency", default="1,4,16", help="Level concurrency dipisah koma")
+    parser.add_argument("--requests", type=int, default=64, help="Request terukur per level")
+    parser.add_argument("--warmup", type=int, default=4, help="Request pemanasan per level (tidak diukur)")
+    parser.add_argument("--llm-latency", default="lognormal:400:0.35", help="Latency stub OpenAI (ms)")
+    parser.add_argument("--sd-latency", default="lognormal:2500:0.2", help="Latency stub A1111 per gambar 512x512/20 steps (ms)")
+    parser.add_argument("--sd-backends", type=int, default=2, help="Jumlah stub A1111")
+    parser.add_argument("--gpu-slots", type=int, default=1, help="Request paralel per stub A1111")
+    parser.add_argument("--batch-cost", type=float, default=0.6, help="Biaya relatif tiap gambar tambahan dalam satu batch")
+    parser.add_argument("--swap-ms", type=float, default=8000.0, help="Waktu ganti checkpoint di stub A1111 (ms)")
+    parser.add_argument("--sd-checkpoint", default="realisticUniversalBase_100.safetensors", help="Checkpoint resident awal stub A1111")
+    parser.add_argument("--png-kb", type=int, default=420, help="Ukuran PNG hasil stub A1111 (KB)")
+    parser.add_argument("--init-kb", type=int, default=600, help="Ukuran init image img2img (KB)")
+    parser.add_argument("--init-size", type=int, default=768, help="Sisi init image img2img (px)")
+    parser.add_argument("--response-format", default="url", help="response_format yang diminta ke service")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Timeout per request (detik)")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="Override key config.ini service (boleh berulang)")
+    parser.add_argument("--out", default="bench_results", help="Folder file hasil JSON")
+    parser.add_argument("--baseline", default=None, help="File hasil sebelumnya untuk dibandingkan")
+    parser.add_argument("--keep-workdir", action="store_true", help="Jangan hapus workdir (log, output, index)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(BenchmarkRunner(args).run())
+    path = write_report(report, args.out)
+    logger.success(f"Hasil benchmark: {path}")
+    if args.baseline:
+        compare(report, args.baseline)
@@ -1,13 +1,15 @@
 import os
 import re
 import sys
+import time
 import uuid
+import asyncio
 import json
 import srsly
 from dateutil import parser
 from loguru import logger
 from urllib.parse import urlparse
-from typing import Dict, Any
+from typing import Dict, Any, List, AsyncIterator, Optional
 from configparser import ConfigParser   
 
 path_this = os.path.dirname(os.path.abspath(__file__))
@@ -16,18 +18,56 @@ path_root = os.path.dirname(os.path.join(path_this, "../.."))
 sys.path.extend([path_this, path_project, path_root])
 
 from agents.agent_prompt_generator import PromptGenAgent
-from tools.tools_generate_i2i import SDClientT2I
+from agents.llm_client_pool import llm_client_pool
+from agents.prompt_cache import PromptCache
+from agents.retry_policy import RetryPolicy, HedgePolicy
+from agents.circuit_breaker import CircuitBreaker
+from agents.fallback_expander import FallbackPromptExpander
+from agents.structured_output import ExpandedPrompt
+from tools.tools_generate_t2i import SDClientT2I
+from tools.image_store import ImageStore
+from tools.backend_pool import BackendPool
+from tools.generation_index import GenerationIndex
+from tools.storage_codec import StorageCodec, CODECS
+from tools.progress import progress_hub
+from tools.tracing import tracer, SpanExporter, configure_logging, log_context
+from tools import deadline
+from tools.metrics import metrics
+
+PROMPT_EXPANSIONS = metrics.counter(
+    "photo_prompt_expansions_total", "Ekspansi prompt per sumber, source = llm/cache/fallback", ("source",)
+)
+PROMPT_FALLBACKS = metrics.counter(
+    "photo_prompt_fallbacks_total", "Ekspansi prompt lewat fallback lokal, reason = breaker_open/budget/error", ("reason",)
+)
 
 class ImageGenAgent:
     def __init__(self):
         self.config = ConfigParser()
-        self.config.read(os.path.join(path_this, "config.ini"))
+        self.config.read(os.environ.get("PHOTO_AGENT_CONFIG", os.path.join(path_this, "config.ini")))
         self._init_agent()
         self._init_tools()
 
     def _init_agent(self):
+        llm_client_pool.configure(
+            max_connections=self.config.getint("default", "llm_max_connections", fallback=32),
+            max_keepalive_connections=self.config.getint("default", "llm_max_keepalive", fallback=16),
+            keepalive_expiry=self.config.getfloat("default", "llm_keepalive_expiry", fallback=60.0),
+            http2=self.config.getboolean("default", "llm_http2", fallback=True),
+            sdk_max_retries=self.config.getint("default", "llm_sdk_max_retries", fallback=0),
+        )
         self.system_prompts_path = os.path.join(path_project, self.config.get("default", "system_prompt_path_copy"))
         self.system_prompts = srsly.read_json(self.system_prompts_path)
+        self.prompt_cache = None
+        if self.config.getboolean("default", "prompt_cache_enabled", fallback=True):
+            self.prompt_cache = PromptCache(
+                path=os.path.join(path_project, self.config.get("default", "prompt_cache_path", fallback="cache/prompt_cache.sqlite3")),
+                ttl=self.config.getfloat("default", "prompt_cache_ttl", fallback=7 * 24 * 3600),
+                memory_max_entries=self.config.getint("default", "prompt_cache_memory_entries", fallback=1024),
+                disk_max_entries=self.config.getint("default", "prompt_cache_disk_entries", fallback=100_000),
+            )
+        # json_schema / json_object / none = jawaban LLM berupa ExpandedPrompt tervalidasi, off = teks bebas
+        structured = self.config.get("default", "llm_structured_output", fallback="off")
         self.agentpromptgenerator = PromptGenAgent(
             system_prompt=self.system_prompts['agent_com']['system_prompt'],
             human_prompt = """
@@ -41,25 +81,140 @@ class ImageGenAgent:
             model_name=self.config.get('default','model_name'),  
             api_key="api_key",
             max_retries=3,
-        
+            retry_policy=RetryPolicy.from_config(self.config, max_attempts=3),
+            hedge=HedgePolicy.from_config(self.config),
+            cache=self.prompt_cache,
+            output_model=ExpandedPrompt if structured != "off" else None,
+            response_format=structured,
+            max_tokens=self.config.getint("default", "llm_max_tokens", fallback=0) or None,
         )
+        # circuit breaker + fallback lokal supaya LLM lambat/down tidak menahan generate
+        self.llm_breaker = CircuitBreaker.from_config(self.config, "llm_expansion", prefix="llm")
+        self.fallback_expander = FallbackPromptExpander(self.system_prompts['agent_com'].get('fallback_vocabulary'))
+        self.llm_fallback_enabled = self.config.getboolean("default", "llm_fallback_enabled", fallback=True)
+        # batas detik ekspansi LLM per request (0 = hanya dibatasi deadline request)
+        self.llm_expansion_budget = self.config.getfloat("default", "llm_expansion_budget", fallback=8.0)
+        self._expansion = {"llm": 0, "cache": 0, "fallback": 0}
+        self._fallback_reasons = {"breaker_open": 0, "budget": 0, "error": 0}
 
     def _init_tools(self):
-        self.agent_text2img = SDClientT2I()
+        self.generation_index = GenerationIndex(
+            os.path.join(path_project, self.config.get("default", "generation_index_path", fallback="index/generations.sqlite3"))
+        )
+        self.image_store = ImageStore(
+            root=self.config.get("default", "output_dir", fallback="output"),
+            max_bytes=self.config.getint("default", "output_max_bytes", fallback=5 * 1024 ** 3),
+            alt_suffixes=tuple({c[0] for c in CODECS.values() if c}),
+            # file yang dievict/pindah ikut diupdate di index, lookup /generations tidak basi
+            on_change=self.generation_index.relink,
+        )
+        self.storage_codec = StorageCodec(
+            codec=self.config.get("default", "storage_codec", fallback="png"),
+            quality=self.config.getint("default", "storage_quality", fallback=90),
+            max_workers=self.config.getint("default", "storage_workers", fallback=1),
+            unlink_delay=self.config.getfloat("default", "storage_unlink_delay", fallback=30.0),
+        )
+        self._background_tasks = set()
+        configure_logging(self.config.get("default", "log_level", fallback="DEBUG"))
+        tracer.configure(
+            exporter=SpanExporter.from_config(self.config, service_name="txt2img"),
+            sample_ratio=self.config.getfloat("default", "trace_sample_ratio", fallback=0.01),
+        )
+        progress_hub.configure(
+            poll_interval=self.config.getfloat("default", "progress_poll_interval", fallback=1.0),
+            preview_size=self.config.getint("default", "progress_preview_size", fallback=128),
+        )
+        self.backend_pool = BackendPool.from_config(
+            self.config, fallback_urls=self.config.get("default", "sd_base_url", fallback="http://127.0.0.1:7860")
+        )
+        self.agent_text2img = SDClientT2I(
+            timeout=self.config.getfloat("default", "sd_timeout", fallback=300.0),
+            max_connections=self.config.getint("default", "sd_max_connections", fallback=8),
+            store=self.image_store,
+            pool=self.backend_pool,
+            batch_window=self.config.getfloat("default", "sd_batch_window_ms", fallback=0.0) / 1000.0,
+            max_batch_size=self.config.getint("default", "sd_max_batch_size", fallback=4),
+            max_gpu_batch=self.config.getint("default", "sd_max_gpu_batch", fallback=4),
+        )
+        # mode draft-then-refine
+        self.draft_count = self.config.getint("default", "draft_count", fallback=4)
+        self.draft_settings = SDClientT2I.draft_settings(
+            width=self.config.getint("default", "draft_width", fallback=384),
+            height=self.config.getint("default", "draft_height", fallback=384),
+            steps=self.config.getint("default", "draft_steps", fallback=12),
+        )
+        # porsi sisa deadline request untuk ekspansi prompt, sisanya untuk SD
+        self.deadline_llm_share = self.config.getfloat("default", "deadline_llm_share", fallback=0.35)
+        self.llm_pack_size = self.config.getint("default", "llm_pack_size", fallback=4)
+        self.llm_batch_concurrency = self.config.getint("default", "llm_batch_concurrency", fallback=4)
+        self.sd_batch_concurrency = self.config.getint(
+            "default", "sd_batch_concurrency", fallback=self.backend_pool.total_capacity * 2
+        )
+        self.refine_width = self.config.getint("default", "refine_width", fallback=512)
+        self.refine_second_pass_steps = self.config.getint("default", "refine_second_pass_steps", fallback=20)
+        self.refine_denoising_strength = self.config.getfloat("default", "refine_denoising_strength", fallback=0.5)
+        self._gpu = {
+            "full": {"photos": 0, "gpu_seconds": 0.0},
+            "draft": {"sessions": 0, "images": 0, "gpu_seconds": 0.0},
+            "refine": {"photos": 0, "gpu_seconds": 0.0},
+        }
 
-    
-    def process_generate_image(self,prompt:str):
-        logger.info(f"process generate photo with prompt: {prompt}")
-        session_id = f"session_{uuid.uuid4().hex[:8]}"
+    async def astart(self):
+        """Jalankan background task yang butuh event loop."""
+        self.backend_pool.start()
+        self.image_store.start_compaction(
+            interval=self.config.getfloat("default", "output_compaction_interval", fallback=300.0)
+        )
 
-        process_generate_prompt = self.agentpromptgenerator.analyze(data_input=prompt)
-        
+    async def aclose(self):
+        await self.image_store.stop_compaction()
+        self.storage_codec.shutdown()
+        await self.backend_pool.stop()
+        await progress_hub.aclose()
+        await llm_client_pool.aclose()
+        await self.agent_text2img.aclose()
+        if self.prompt_cache is not None:
+            self.prompt_cache.close()
+        self.generation_index.close()
+        tracer.shutdown()
+
+    async def acompress_output(self, metadata: Dict[str, Any]):
+        """
+        Kompres ulang file hasil generate dengan storage codec (dipanggil setelah
+        response terkirim), lalu catat path/ukuran baru di image store dan index.
+        """
+        if metadata.get("cached") or not metadata.get("path_file"):
+            return
+        result = await self.storage_codec.compress(metadata["path_file"])
+        if result is None:
+            return
+        key = os.path.splitext(os.path.basename(metadata["path_file"]))[0]
+        self.image_store.relocate(key, result["path"], result["stored_bytes"])
+        if metadata.get("generation_id"):
+            await asyncio.to_thread(self.generation_index.update_storage, metadata["generation_id"], result)
+        # file lama baru dihapus setelah store/index menunjuk path baru
+        self.storage_codec.retire(result)
 
+    def schedule_compression(self, metadata: Dict[str, Any]):
+        """Jalankan acompress_output di background tanpa menahan pemanggil."""
+        if not self.storage_codec.enabled:
+            return
+        task = asyncio.create_task(self.acompress_output(metadata))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _clean_prompt(self, process_generate_prompt: str) -> ExpandedPrompt:
         if not process_generate_prompt:
             raise ValueError("Agent tidak mengembalikan komentar (respons kosong)")
 
         logger.success("Komentar berhasil digenerate")
-            
+
+        expanded = self.agentpromptgenerator.parse_output(process_generate_prompt)
+        if expanded is not None:
+            logger.info(f"result generator prompt: {expanded.text}")
+            return expanded
+
+        # teks bebas: mode structured mati, fallback lokal, atau entry cache lama
         cleaned_text_prompt = (
             str(process_generate_prompt).strip('"')
                 .replace('\\"', '"')
@@ -70,20 +225,404 @@ class ImageGenAgent:
                 .strip()
             )
         logger.info(f"result generator prompt: {cleaned_text_prompt}")
+        return ExpandedPrompt(positive_prompt=cleaned_text_prompt)
 
-        process_generate_photo = self.agent_text2img.generate(cleaned_text_prompt)
+    @staticmethod
+    def _sd_overrides(expanded: ExpandedPrompt) -> Dict[str, Any]:
+        """Field payload SD dari hasil ekspansi: negative prompt LLM + default SDClientT2I."""
+        return {"negative_prompt": expanded.negative(SDClientT2I.DEFAULT_NEGATIVE_PROMPT)}
 
-        get_base_64 = process_generate_photo.get("base64","")
+    @staticmethod
+    def _build_metadata(session_id: str, process_generate_photo: Dict[str, Any]) -> Dict[str, Any]:
         get_path = process_generate_photo.get("path","")
         
         metadata = {
             "id":session_id,
-            "base64":get_base_64,
-            "path_file":get_path
+            "path_file":get_path,
+            "seed":process_generate_photo.get("seed", -1),
+            "cached":process_generate_photo.get("cached", False)
         }
+        if "subseed" in process_generate_photo:
+            metadata["subseed"] = process_generate_photo["subseed"]
+            metadata["subseed_strength"] = process_generate_photo["subseed_strength"]
+        if "base64" in process_generate_photo:
+            metadata["base64"] = process_generate_photo["base64"]
 
         return metadata
 
+    def _record_generation(self, session_id: str, prompt: str, expanded_prompt: str,
+                           process_generate_photo: Dict[str, Any], timings: Dict[str, float],
+                           kind: str = "txt2img", negative_prompt: str = "", **extra_params) -> str:
+        params = dict(process_generate_photo.get("params", {}))
+        params["user_prompt"] = prompt
+        params.update(extra_params)
+        return self.generation_index.record(
+            kind,
+            process_generate_photo.get("path", ""),
+            session_id=session_id,
+            prompt=expanded_prompt,
+            negative_prompt=negative_prompt,
+            sha256=process_generate_photo.get("sha256"),
+            bytes=process_generate_photo.get("bytes"),
+            params=params,
+            timings=timings,
+        )
+
+    def process_generate_image(self,prompt:str, seed: int = -1, include_base64: bool = True):
+        logger.info(f"process generate photo with prompt: {prompt}")
+        session_id = f"session_{uuid.uuid4().hex[:8]}"
+
+        with tracer.span("photo.generate", session_id=session_id), log_context(session_id=session_id):
+            t0 = time.time()
+            process_generate_prompt = None
+            if self.llm_breaker.allow():
+                process_generate_prompt = self.agentpromptgenerator.analyze(data_input=prompt)
+                self._record_llm(process_generate_prompt)
+                source = "llm" if process_generate_prompt else "error"
+            else:
+                source = "breaker_open"
+            expanded, _ = self._finish_expansion(prompt, process_generate_prompt, source)
+            t1 = time.time()
+
+            overrides = self._sd_overrides(expanded)
+            process_generate_photo = self.agent_text2img.generate(
+                expanded.text, seed=seed, include_base64=include_base64, **overrides
+            )
+            timings = {"prompt_expansion": t1 - t0, "generate": time.time() - t1}
+            self._count_gpu("full", [process_generate_photo])
+
+            metadata = self._build_metadata(session_id, process_generate_photo)
+            metadata["generation_id"] = self._record_generation(
+                session_id, prompt, expanded.text, process_generate_photo, timings,
+                negative_prompt=overrides["negative_prompt"],
+            )
+        return metadata
+
+    async def aprocess_generate_image(self, prompt: str, seed: int = -1, include_base64: bool = True):
+        """Pipeline async penuh: LLM via aanalyze lalu SD via pooled async client."""
+        logger.info(f"process generate photo with prompt: {prompt}")
+        session_id = f"session_{uuid.uuid4().hex[:8]}"
+
+        with tracer.span("photo.generate", session_id=session_id), log_context(session_id=session_id):
+            expanded, prompt_seconds = await self.aexpand_prompt(prompt)
+            return await self.agenerate_expanded(session_id, prompt, expanded, prompt_seconds, seed, include_base64)
+
+    # ---------- prompt expansion ----------
+    def _record_llm(self, result):
+        """Lapor hasil call LLM ke circuit breaker (hasil kosong dihitung gagal)."""
+        if result:
+            self.llm_breaker.record_success()
+        else:
+            self.llm_breaker.record_failure()
+
+    def _finish_expansion(self, prompt: str, expanded: Optional[str], source: str):
+        """
+        ExpandedPrompt + sumbernya. `source` llm/cache, atau alasan gagal
+        (breaker_open/budget/error) yang diganti fallback lokal kalau aktif.
+        """
+        if source not in self._expansion:
+            if not self.llm_fallback_enabled:
+                # perilaku lama: request gagal (504 kalau deadline request habis)
+                deadline.check("llm_expansion")
+                return self._clean_prompt(expanded), source
+            logger.warning(f"Ekspansi prompt pakai fallback lokal ({source})")
+            self._fallback_reasons[source] += 1
+            PROMPT_FALLBACKS.labels(source).inc()
+            expanded, source = self.fallback_expander.expand(prompt), "fallback"
+        self._expansion[source] += 1
+        PROMPT_EXPANSIONS.labels(source).inc()
+        return self._clean_prompt(expanded), source
+
+    async def _allm_expand(self, prompt: str):
+        """
+        Call LLM dibatasi `llm_expansion_budget` dan porsi deadline request
+        (mana yang lebih dulu habis); return (hasil, source).
+        """
+        with deadline.stage_share(self.deadline_llm_share) as sub:
+            limit = self.llm_expansion_budget or None
+            if sub is not None:
+                limit = sub.remaining() if limit is None else min(limit, sub.remaining())
+            with deadline.scope(deadline.Deadline(limit) if limit is not None else sub):
+                try:
+                    async with deadline.cancel_after(limit):
+                        result = await self.agentpromptgenerator.aanalyze(data_input=prompt, check_cache=False)
+                except asyncio.TimeoutError:
+                    self.llm_breaker.record_failure()
+                    return None, "budget"
+        self._record_llm(result)
+        return result, "llm" if result else "error"
+
+    async def _allm_expand_pack(self, pack: List[str], cached: List[Optional[str]]):
+        """
+        Ekspansi satu pack batch dalam satu call LLM, dibatasi `llm_expansion_budget`
+        seperti _allm_expand; budget habis -> hit cache tetap dipakai, sisanya fallback.
+        """
+        limit = self.llm_expansion_budget or None
+        with deadline.scope(deadline.Deadline(limit) if limit is not None else None):
+            try:
+                async with deadline.cancel_after(limit):
+                    expanded = await self.agentpromptgenerator.aanalyze_many(pack, cached=cached)
+            except asyncio.TimeoutError:
+                self.llm_breaker.record_failure()
+                return list(cached), "budget"
+            except Exception as e:
+                logger.error(f"Batch prompt expansion gagal: {e}")
+                expanded = list(cached)
+        # hanya item yang dikirim ke LLM yang dinilai (bukan hit cache); sukses kalau semuanya terjawab
+        self._record_llm(all(text for text, hit in zip(expanded, cached) if not hit))
+        return expanded, "llm"
+
+    async def aexpand_prompt(self, prompt: str):
+        """
+        Ekspansi prompt user: cache, lalu LLM kalau circuit breaker mengizinkan.
+        Breaker open / budget habis / LLM error -> fallback lokal deterministik,
+        jadi latency ekspansi tetap terbatas. Return (ExpandedPrompt, detik).
+        """
+        t0 = time.time()
+        expanded = await self.agentpromptgenerator.aget_cached(prompt)
+        if expanded:
+            source = "cache"
+        elif self.llm_breaker.allow():
+            expanded, source = await self._allm_expand(prompt)
+        else:
+            source = "breaker_open"
+        result, source = self._finish_expansion(prompt, expanded, source)
+        seconds = time.time() - t0
+        progress_hub.emit("prompt_expanded", prompt=result.text, seconds=seconds, source=source)
+        return result, seconds
+
+    def prompt_expansion_stats(self) -> Dict[str, Any]:
+        """Sumber ekspansi prompt dan degradation rate (porsi yang jatuh ke fallback)."""
+        total = sum(self._expansion.values())
+        return {
+            "fallback_enabled": self.llm_fallback_enabled,
+            "expansion_budget": self.llm_expansion_budget,
+            "total": total,
+            "sources": dict(self._expansion),
+            "fallback_reasons": dict(self._fallback_reasons),
+            "degradation_rate": self._expansion["fallback"] / total if total else 0.0,
+            "breaker": self.llm_breaker.stats(),
+        }
+
+    async def agenerate_expanded(self, session_id: str, prompt: str, expanded: ExpandedPrompt,
+                                 prompt_seconds: float, seed: int = -1, include_base64: bool = True):
+        """Generate SD dari prompt yang sudah diekspansi, lalu catat di generation index."""
+        with log_context(session_id=session_id):
+            t1 = time.time()
+            overrides = self._sd_overrides(expanded)
+            process_generate_photo = await self.agent_text2img.agenerate(
+                expanded.text, seed=seed, include_base64=include_base64, **overrides
+            )
+            timings = {"prompt_expansion": prompt_seconds, "generate": time.time() - t1}
+            self._count_gpu("full", [process_generate_photo])
+
+            metadata = self._build_metadata(session_id, process_generate_photo)
+            metadata["generation_id"] = await asyncio.to_thread(
+                self._record_generation, session_id, prompt, expanded.text, process_generate_photo, timings,
+                negative_prompt=overrides["negative_prompt"],
+            )
+            return metadata
+
+    async def aprocess_batch(self, prompts: List[str], seed: int = -1, include_base64: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate banyak prompt sekaligus, hasil di-yield begitu selesai (urutan tidak dijamin):
+        - ekspansi LLM dipak `llm_pack_size` prompt per chat completion, maks `llm_batch_concurrency` paralel
+        - generate SD dijadwalkan lewat backend pool, maks `sd_batch_concurrency` paralel
+        Error per item di-yield sebagai {"index", "status": "error"} tanpa menghentikan batch.
+        """
+        llm_sem = asyncio.Semaphore(self.llm_batch_concurrency)
+        sd_sem = asyncio.Semaphore(self.sd_batch_concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+        tasks = set()
+
+        async def generate_one(idx: int, prompt: str, expanded: Optional[str], source: str, prompt_seconds: float):
+            try:
+                result, _ = self._finish_expansion(prompt, expanded, source)
+                async with sd_sem:
+                    metadata = await self.agenerate_expanded(
+                        f"session_{uuid.uuid4().hex[:8]}", prompt, result, prompt_seconds, seed, include_base64
+                    )
+                await results.put({"index": idx, "status": "success", "data": metadata})
+            except Exception as e:
+                logger.error(f"Batch item {idx} gagal: {e}")
+                await results.put({"index": idx, "status": "error", "error": str(e)})
+
+        async def expand_pack(start: int, pack: List[str]):
+            # consumer menunggu tepat len(prompts) hasil, jadi error apa pun di sini tetap menghasilkan satu baris per item
+            try:
+                async with llm_sem:
+                    t0 = time.time()
+                    cached = [await self.agentpromptgenerator.aget_cached(p) for p in pack]
+                    if all(cached):
+                        expanded, source = cached, "cache"
+                    elif self.llm_breaker.allow():
+                        expanded, source = await self._allm_expand_pack(pack, cached)
+                    else:
+                        expanded, source = cached, "breaker_open"
+                    prompt_seconds = (time.time() - t0) / len(pack)
+            except Exception as e:
+                logger.error(f"Batch pack {start} gagal: {e}")
+                for offset in range(len(pack)):
+                    await results.put({"index": start + offset, "status": "error", "error": str(e)})
+                return
+            for offset, (prompt, text, hit) in enumerate(zip(pack, expanded, cached)):
+                if hit:
+                    item_source = "cache"
+                elif text or source in ("breaker_open", "budget"):
+                    item_source = source
+                else:
+                    item_source = "error"
+                task = asyncio.create_task(generate_one(start + offset, prompt, text, item_source, prompt_seconds))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        pack_size = max(1, self.llm_pack_size)
+        for start in range(0, len(prompts), pack_size):
+            task = asyncio.create_task(expand_pack(start, prompts[start:start + pack_size]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            for _ in range(len(prompts)):
+                yield await results.get()
+        finally:
+            # client putus: item yang belum selesai dibatalkan
+            for task in list(tasks):
+                task.cancel()
+
+    async def aprocess_generate_variants(
+        self, prompt: str, num_variants: int, seed: int = -1, variation_strength: float = 0.0,
+        include_base64: bool = True,
+    ):
+        """
+        Beberapa varian dari satu ekspansi prompt, dalam satu call A1111 (batch_size/n_iter).
+        Seed (dan subseed kalau variation_strength > 0) tiap varian ikut dikembalikan.
+        """
+        logger.info(f"process generate {num_variants} variants with prompt: {prompt}")
+        session_id = f"session_{uuid.uuid4().hex[:8]}"
+
+        with log_context(session_id=session_id):
+            expanded, prompt_seconds = await self.aexpand_prompt(prompt)
+            overrides = self._sd_overrides(expanded)
+            t1 = time.time()
+
+            variants = await self.agent_text2img.agenerate_batch(
+                expanded.text, num_variants, seed=seed,
+                include_base64=include_base64, variation_strength=variation_strength, **overrides,
+            )
+            timings = {"prompt_expansion": prompt_seconds, "generate": time.time() - t1}
+            self._count_gpu("full", variants)
+
+            results = []
+            for idx, variant in enumerate(variants):
+                metadata = self._build_metadata(session_id, variant)
+                metadata["generation_id"] = await asyncio.to_thread(
+                    self._record_generation, session_id, prompt, expanded.text, variant, timings,
+                    negative_prompt=overrides["negative_prompt"], variant=idx,
+                )
+                results.append(metadata)
+            return {"session_id": session_id, "prompt": expanded.text, "variants": results}
+
+    # ---------- draft-then-refine ----------
+    def _count_gpu(self, mode: str, results):
+        fresh = [r for r in results if not r.get("cached")]
+        if not fresh:
+            return
+        stats = self._gpu[mode]
+        stats["gpu_seconds"] += sum(r.get("gpu_seconds", 0.0) for r in fresh)
+        if mode == "draft":
+            stats["sessions"] += 1
+            stats["images"] += len(fresh)
+        else:
+            stats["photos"] += len(fresh)
+
+    async def aprocess_drafts(self, prompt: str, num_drafts: int = None, seed: int = -1, include_base64: bool = True):
+        """
+        Fase 1: beberapa draft murah (resolusi rendah, step sedikit) dalam satu
+        call batch dengan seed tetap. Tiap draft dicatat di index sebagai kind `draft`
+        supaya bisa di-refine lewat aprocess_refine(generation_id).
+        """
+        logger.info(f"process drafts with prompt: {prompt}")
+        session_id = f"session_{uuid.uuid4().hex[:8]}"
+
+        with log_context(session_id=session_id):
+            expanded, prompt_seconds = await self.aexpand_prompt(prompt)
+            overrides = self._sd_overrides(expanded)
+            t1 = time.time()
+
+            drafts = await self.agent_text2img.agenerate_batch(
+                expanded.text, num_drafts or self.draft_count, seed=seed,
+                include_base64=include_base64, **self.draft_settings, **overrides,
+            )
+            timings = {"prompt_expansion": prompt_seconds, "generate": time.time() - t1}
+            self._count_gpu("draft", drafts)
+
+            results = []
+            for draft in drafts:
+                metadata = self._build_metadata(session_id, draft)
+                metadata["generation_id"] = await asyncio.to_thread(
+                    self._record_generation, session_id, prompt, expanded.text, draft, timings, kind="draft",
+                    negative_prompt=overrides["negative_prompt"],
+                )
+                results.append(metadata)
+            return {"session_id": session_id, "prompt": expanded.text, "drafts": results}
+
+    async def aprocess_refine(self, generation_id: str, include_base64: bool = True):
+        """
+        Fase 2: refine satu draft ke kualitas penuh. First pass sama persis dengan
+        draft (seed, ukuran, step) lalu hires-fix + restore_faces.
+        """
+        draft = await asyncio.to_thread(self.generation_index.get, generation_id)
+        if draft is None or draft["kind"] != "draft":
+            raise KeyError(f"Draft {generation_id} tidak ditemukan")
+        with log_context(session_id=draft["session_id"]):
+            params = draft["params"] or {}
+            seed = params["seed"]
+            logger.info(f"refine draft {generation_id} seed {seed}")
+
+            t0 = time.time()
+            settings = SDClientT2I.refine_settings(
+                params,
+                target_width=self.refine_width,
+                second_pass_steps=self.refine_second_pass_steps,
+                denoising_strength=self.refine_denoising_strength,
+            )
+            # first pass harus sama dengan draft, termasuk negative prompt dari LLM
+            settings["negative_prompt"] = draft.get("negative_prompt") or SDClientT2I.DEFAULT_NEGATIVE_PROMPT
+            process_generate_photo = await self.agent_text2img.agenerate(
+                draft["prompt"], seed=seed, include_base64=include_base64, **settings
+            )
+            timings = {"generate": time.time() - t0}
+            self._count_gpu("refine", [process_generate_photo])
+
+            metadata = self._build_metadata(draft["session_id"], process_generate_photo)
+            metadata["generation_id"] = await asyncio.to_thread(
+                self._record_generation, draft["session_id"], params.get("user_prompt", ""), draft["prompt"],
+                process_generate_photo, timings, negative_prompt=settings["negative_prompt"], draft_id=generation_id,
+            )
+            metadata["draft_id"] = generation_id
+            return metadata
+
+    def progressive_stats(self) -> Dict[str, Any]:
+        """
+        GPU-seconds per foto yang diterima: mode draft-then-refine (semua draft +
+        refine, dibagi jumlah refine) dibanding generate penuh langsung.
+        """
+        full, draft, refine = self._gpu["full"], self._gpu["draft"], self._gpu["refine"]
+        full_per_photo = full["gpu_seconds"] / full["photos"] if full["photos"] else None
+        progressive_per_photo = (
+            (draft["gpu_seconds"] + refine["gpu_seconds"]) / refine["photos"] if refine["photos"] else None
+        )
+        return {
+            **{mode: dict(stats) for mode, stats in self._gpu.items()},
+            "drafts_per_accepted": draft["images"] / refine["photos"] if refine["photos"] else None,
+            "gpu_seconds_per_photo_full": full_per_photo,
+            "gpu_seconds_per_photo_progressive": progressive_per_photo,
+            "progressive_to_full_ratio": (
+                progressive_per_photo / full_per_photo if full_per_photo and progressive_per_photo else None
+            ),
+        }
+
 if __name__ == "__main__":
 
     prompt=""
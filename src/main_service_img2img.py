@@ -1,7 +1,8 @@
 
-from fastapi import FastAPI, HTTPException, Body, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Body, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from fastapi.exceptions import RequestValidationError
 from loguru import logger
@@ -10,7 +11,9 @@ import traceback
 import os
 import sys
 import time
-from typing import Optional, Dict, Any, List
+import asyncio
+from configparser import ConfigParser
+from typing import Optional, Dict, Any, List, Literal
 
 path_this = os.path.dirname(os.path.abspath(__file__))
 path_project = os.path.dirname(os.path.join(path_this, '..'))
@@ -18,6 +21,29 @@ path_root = os.path.dirname(os.path.join(path_this, '../..'))
 sys.path.extend([path_this, path_project, path_root])
 
 from tools.tools_generate_i2i import SDImg2Img   
+from tools.job_queue import JobQueue, QueueFullError
+from tools.backend_pool import BackendPool
+from tools.generation_index import GenerationIndex
+from tools.image_preprocess import ImagePreprocessor
+from tools.image_response import RESPONSE_FORMATS, wants_base64, build_image_response, serve_image
+from tools.derivatives import DerivativeCache
+from tools.storage_codec import StorageCodec, CODECS
+from tools.progress import progress_hub, sse_stream, websocket_stream
+from tools.metrics import (
+    metrics, CONTENT_TYPE, HTTP_IN_FLIGHT, InFlightMiddleware,
+    backend_pool_collector, job_queue_collector, cache_collector, hits_misses,
+)
+from tools.tracing import tracer, SpanExporter, TracingMiddleware, configure_logging
+from tools.deadline import DeadlineMiddleware, DeadlineExceeded
+from tools import deadline
+
+config = ConfigParser()
+config.read(os.environ.get("PHOTO_AGENT_CONFIG", os.path.join(path_this, "config.ini")))
+configure_logging(config.get("default", "log_level", fallback="DEBUG"))
+tracer.configure(
+    exporter=SpanExporter.from_config(config, service_name="img2img"),
+    sample_ratio=config.getfloat("default", "trace_sample_ratio", fallback=0.01),
+)
 
 app = FastAPI(
     title="Image2Image API",
@@ -35,6 +61,9 @@ class Img2ImgRequest(BaseModel):
     denoising_strength: Optional[float] = Field(0.75, ge=0.0, le=1.0, description="Denoising strength")
     sampler_name: Optional[str] = Field("DPM++ 2M Karras", description="Sampler name")
     output_dir: Optional[str] = Field("result", description="Folder to save outputs")
+    width: Optional[int] = Field(512, ge=64, le=2048, description="Target width, dibulatkan ke kelipatan 64")
+    height: Optional[int] = Field(512, ge=64, le=2048, description="Target height, dibulatkan ke kelipatan 64")
+    preprocess: Optional[bool] = Field(True, description="Downscale/crop init images ke target sebelum dikirim ke SD")
 
 class APIResponse(BaseModel):
     status: str
@@ -52,6 +81,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(InFlightMiddleware, gauge=HTTP_IN_FLIGHT.labels("img2img"))
+app.add_middleware(TracingMiddleware, service="img2img")
+app.add_middleware(
+    DeadlineMiddleware,
+    service="img2img",
+    default=config.getfloat("default", "request_deadline_default", fallback=0.0),
+    max_seconds=config.getfloat("default", "request_deadline_max", fallback=600.0),
+)
 
 # -------------------------------------------------
 # Exception handlers
@@ -69,6 +106,12 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         ).dict()
     )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exception_handler(request: Request, exc: DeadlineExceeded):
+    logger.warning(f"{request.url.path}: {exc}")
+    return JSONResponse(status_code=504, content={"detail": str(exc), "stage": exc.stage, "status": "error"})
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled error: {traceback.format_exc()}")
@@ -90,35 +133,176 @@ def health_check():
     return {"status": "ok", "service": "img2img-fastapi"}
 
 
+# -------------------------------------------------
+# Job queue
+# -------------------------------------------------
+job_queue: Optional[JobQueue] = None
+derivatives = DerivativeCache(
+    root=os.path.join(path_project, config.get("default", "derivative_cache_path", fallback="cache/derivatives")),
+    max_bytes=config.getint("default", "derivative_cache_max_bytes", fallback=1024 ** 3),
+    max_workers=config.getint("default", "derivative_workers", fallback=2),
+)
+storage_codec = StorageCodec(
+    codec=config.get("default", "storage_codec", fallback="png"),
+    quality=config.getint("default", "storage_quality", fallback=90),
+    max_workers=config.getint("default", "storage_workers", fallback=1),
+    unlink_delay=config.getfloat("default", "storage_unlink_delay", fallback=30.0),
+)
+background_tasks = set()
+progress_hub.configure(
+    poll_interval=config.getfloat("default", "progress_poll_interval", fallback=1.0),
+    preview_size=config.getint("default", "progress_preview_size", fallback=128),
+)
+preprocessor = ImagePreprocessor(
+    max_workers=config.getint("default", "preprocess_workers", fallback=2),
+    process_threshold_bytes=config.getint("default", "preprocess_process_threshold_bytes", fallback=2 * 1024 * 1024),
+)
+
+
+def serves_output_dir(payload: Img2ImgRequest) -> bool:
+    """/result/{filename} hanya melayani folder default."""
+    return os.path.normpath(payload.output_dir or "result") == "result"
+
+
+def require_served_output_dir(payload: Img2ImgRequest):
+    """Response tanpa base64 (url, job, stream) hanya bisa mengembalikan gambar lewat /result."""
+    if not serves_output_dir(payload):
+        raise HTTPException(
+            status_code=400,
+            detail="output_dir selain 'result' hanya didukung untuk response_format json-base64/png/multipart",
+        )
+
+
+async def run_img2img(payload: Img2ImgRequest, include_base64: bool = True) -> List[Dict[str, Any]]:
+    images_b64 = payload.images_b64
+    if payload.preprocess:
+        images_b64, infos = await preprocessor.aprocess_many(images_b64, payload.width, payload.height)
+        logger.debug(f"Preprocess init images: {infos}")
+        progress_hub.emit("preprocessed", images=infos)
+    deadline.check("preprocess")
+    sd = SDImg2Img(
+        images_b64=images_b64,
+        prompt=payload.prompt,
+        negative_prompt=payload.negative_prompt,
+        steps=payload.steps,
+        cfg_scale=payload.cfg_scale,
+        denoising_strength=payload.denoising_strength,
+        sampler_name=payload.sampler_name,
+        output_dir=payload.output_dir,
+        width=ImagePreprocessor.snap(payload.width),
+        height=ImagePreprocessor.snap(payload.height),
+    )
+    return await sd.agenerate_and_save(include_base64=include_base64)
+
+
+async def compress_outputs(metadata: List[Dict[str, Any]]):
+    """
+    Kompres ulang output dengan storage codec setelah response terkirim,
+    path/ukuran baru dan infotext dicatat di generation index.
+    """
+    for item in metadata:
+        result = await storage_codec.compress(item["path_file"])
+        if result is None:
+            continue
+        if item.get("id") and SDImg2Img.index is not None:
+            await asyncio.to_thread(SDImg2Img.index.update_storage, item["id"], result)
+        storage_codec.retire(result)
+
+
+async def run_img2img_job(payload: Img2ImgRequest) -> List[Dict[str, Any]]:
+    # hasil job disimpan JobQueue sampai job_result_ttl, jadi cukup path; gambar diambil lewat url
+    metadata = await run_img2img(payload, include_base64=False)
+    if storage_codec.enabled:
+        task = asyncio.create_task(compress_outputs(metadata))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return metadata
+
+
+@app.on_event("startup")
+async def startup_event():
+    global job_queue
+    SDImg2Img.configure_pool(BackendPool.from_config(config, fallback_urls=SDImg2Img.DEFAULT_BACKEND))
+    SDImg2Img.pool.start()
+    SDImg2Img.configure_index(GenerationIndex(
+        os.path.join(path_project, config.get("default", "generation_index_path", fallback="index/generations.sqlite3"))
+    ))
+    job_queue = JobQueue(
+        run_img2img_job,
+        max_size=config.getint("default", "job_queue_size", fallback=64),
+        workers=config.getint("default", "job_workers", fallback=4),
+        result_ttl=config.getfloat("default", "job_result_ttl", fallback=3600.0),
+        name="img2img",
+        progress=progress_hub,
+        max_finished=config.getint("default", "job_max_finished", fallback=1000),
+    )
+    await job_queue.start()
+    metrics.register_collector(backend_pool_collector(SDImg2Img.pool, "img2img"))
+    metrics.register_collector(job_queue_collector(lambda: job_queue))
+    metrics.register_collector(cache_collector({"derivatives": lambda: hits_misses(*derivatives.stats().values())}))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if job_queue:
+        await job_queue.stop()
+    await SDImg2Img.pool.stop()
+    await progress_hub.aclose()
+    await SDImg2Img.aclose()
+    preprocessor.shutdown()
+    storage_codec.shutdown()
+    derivatives.shutdown()
+    if SDImg2Img.index is not None:
+        SDImg2Img.index.close()
+    tracer.shutdown()
+    logger.info("Application shutdown complete")
+
+
 @app.post("/img2img", response_model=APIResponse)
-def img2img_endpoint(payload: Img2ImgRequest = Body(...)):
+async def img2img_endpoint(
+    request: Request,
+    payload: Img2ImgRequest = Body(...),
+    response_format: str = Query("json-base64", description=f"Salah satu dari: {', '.join(RESPONSE_FORMATS)}"),
+):
     """
     Generate images from base64 init images using Stable Diffusion img2img.
     Returns metadata containing base64, local file path, and elapsed time.
+    `response_format` url/png/multipart tidak menyertakan base64 dan men-stream file dari disk.
     """
     start = time.time()
+    include_base64 = wants_base64(response_format)
+    if response_format == "url":
+        require_served_output_dir(payload)
     try:
-        sd = SDImg2Img(
-            images_b64=payload.images_b64,
-            prompt=payload.prompt,
-            negative_prompt=payload.negative_prompt,
-            steps=payload.steps,
-            cfg_scale=payload.cfg_scale,
-            denoising_strength=payload.denoising_strength,
-            sampler_name=payload.sampler_name,
-            output_dir=payload.output_dir
-        )
-
-        metadata = sd.generate_and_save()
+        metadata = await run_img2img(payload, include_base64=include_base64)
         elapsed = time.time() - start
 
-        return APIResponse(
-            status="success",
-            data={"images": metadata},
-            error=None,
-            elapsed_time=elapsed
+        if response_format != "json-base64":
+            for item in metadata:
+                if serves_output_dir(payload):
+                    item["url"] = str(request.url_for("get_result_file", filename=os.path.basename(item["path_file"])))
+
+        response = build_image_response(
+            response_format,
+            content=APIResponse(
+                status="success",
+                data={"images": metadata},
+                error=None,
+                elapsed_time=elapsed
+            ).dict(),
+            paths=[item["path_file"] for item in metadata],
         )
+        if storage_codec.enabled:
+            response.background = BackgroundTask(compress_outputs, metadata)
+        return response
 
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=504,
+            detail=APIResponse(status="error", data=None, error=str(e), elapsed_time=time.time() - start).dict(),
+        )
     except Exception as e:
         elapsed = time.time() - start
         logger.error(f"Img2Img error: {traceback.format_exc()}")
@@ -133,17 +317,205 @@ def img2img_endpoint(payload: Img2ImgRequest = Body(...)):
         )
 
 
+@app.post("/jobs", status_code=202)
+async def submit_job(payload: Img2ImgRequest = Body(...)):
+    """
+    Submit img2img sebagai job async. Return 429 + Retry-After kalau queue penuh.
+    """
+    require_served_output_dir(payload)
+    try:
+        job = job_queue.submit(payload)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content=APIResponse(status="error", data=None, error=str(e), elapsed_time=None).dict()
+        )
+    return APIResponse(status="queued", data=job.to_dict(job_queue.position(job)), error=None, elapsed_time=None)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, wait: float = Query(0, ge=0, le=60)):
+    """
+    Status job; `wait` = long-poll maksimal N detik sampai job selesai.
+    Gambar hasil dikembalikan sebagai url ke /result/{filename}.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await job_queue.wait(job, wait)
+    elapsed = (job.finished_at - job.created_at) if job.finished_at else None
+    data = job.to_dict(job_queue.position(job))
+    if data["result"]:
+        data["result"] = _result_view(request, data["result"])
+    return APIResponse(status=job.status, data=data, error=job.error, elapsed_time=elapsed)
+
+
+# -------------------------------------------------
+# Progress streaming
+# -------------------------------------------------
+def _result_view(request, result):
+    """Hasil job sebagai referensi gambar (url ke /result), tanpa base64."""
+    images = []
+    for item in result:
+        item = {k: v for k, v in item.items() if k != "img_base64"}
+        item["url"] = str(request.url_for("get_result_file", filename=os.path.basename(item["path_file"])))
+        images.append(item)
+    return images
+
+
+def _event_view(request, event):
+    """Event `done` dikirim sebagai referensi gambar (url), tanpa base64."""
+    if event["type"] != "done" or not event.get("result"):
+        return event
+    return {**event, "result": _result_view(request, event["result"])}
+
+
+def _sse_response(request, channel, preview: bool):
+    return StreamingResponse(
+        sse_stream(channel, preview=preview, view=lambda e: _event_view(request, e)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/img2img/stream")
+async def img2img_stream(
+    request: Request,
+    payload: Img2ImgRequest = Body(...),
+    preview: bool = Query(False, description="Sertakan preview low-res di event progress"),
+):
+    """
+    Submit img2img sebagai job lalu stream event SSE: queued, started, preprocessed,
+    generating, progress (step + preview opsional), done/error.
+    """
+    require_served_output_dir(payload)
+    try:
+        job = job_queue.submit(payload)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content=APIResponse(status="error", data=None, error=str(e), elapsed_time=None).dict()
+        )
+    return _sse_response(request, progress_hub.get(job.id), preview)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, preview: bool = Query(False)):
+    """
+    Stream event job sebagai SSE; event yang sudah lewat di-replay dulu.
+    """
+    channel = progress_hub.get(job_id)
+    if channel is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _sse_response(request, channel, preview)
+
+
+@app.websocket("/jobs/{job_id}/ws")
+async def job_events_ws(websocket: WebSocket, job_id: str, preview: bool = False):
+    channel = progress_hub.get(job_id)
+    if channel is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    try:
+        await websocket_stream(websocket, channel, preview=preview, view=lambda e: _event_view(websocket, e))
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/generations/{generation_id}")
+async def get_generation(generation_id: str):
+    """
+    Ambil satu record generation index berdasarkan id.
+    """
+    record = await asyncio.to_thread(SDImg2Img.index.get, generation_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return record
+
+
+@app.get("/generations")
+async def search_generations(
+    session_id: Optional[str] = Query(None),
+    prompt: Optional[str] = Query(None, description="Substring prompt"),
+    date_from: Optional[str] = Query(None, description="ISO date, inklusif"),
+    date_to: Optional[str] = Query(None, description="ISO date, eksklusif"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Cari generation img2img berdasarkan session, substring prompt, atau rentang tanggal.
+    """
+    try:
+        ts_from, ts_to = GenerationIndex.parse_date(date_from), GenerationIndex.parse_date(date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(
+        SDImg2Img.index.query,
+        kind="img2img", session_id=session_id, prompt=prompt,
+        date_from=ts_from, date_to=ts_to, limit=limit, offset=offset,
+    )
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Metric format teks Prometheus: histogram per stage, in-flight, queue depth,
+    health backend dan hit ratio cache.
+    """
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats/progress")
+def progress_stats():
+    return progress_hub.stats()
+
+
+@app.get("/stats/storage")
+def storage_stats():
+    return storage_codec.stats()
+
+
+@app.get("/stats/preprocess")
+def preprocess_stats():
+    return preprocessor.stats()
+
+
+@app.get("/stats/backends")
+def backend_stats():
+    return SDImg2Img.pool.stats()
+
+
+@app.get("/stats/tracing")
+def tracing_stats():
+    return tracer.stats()
+
+
 @app.get("/result/{filename}")
-def get_result_file(filename: str):
+async def get_result_file(
+    request: Request,
+    filename: str,
+    w: Optional[int] = Query(None, ge=16, le=2048, description="Lebar maksimal turunan"),
+    h: Optional[int] = Query(None, ge=16, le=2048, description="Tinggi maksimal turunan"),
+    format: Optional[Literal["webp", "jpeg", "png"]] = Query(None, description="Format turunan"),
+    q: int = Query(80, ge=1, le=100, description="Kualitas webp/jpeg"),
+):
     """
     Serve generated images from the default result folder.
-    Only allow png/jpg/jpeg extensions.
+    Mendukung ETag/Last-Modified (304), Range, dan turunan ?w=&h=&format=&q=.
     """
     safe_filename = os.path.basename(filename)
     file_path = os.path.join("result", safe_filename)
     if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+        # file mungkin sudah dikompres ulang ke ekstensi lain oleh storage codec
+        stem = os.path.splitext(file_path)[0]
+        candidates = [stem + c[0] for c in CODECS.values() if c and os.path.isfile(stem + c[0])]
+        if not candidates:
+            raise HTTPException(status_code=404, detail="File not found")
+        file_path = candidates[0]
+    return await serve_image(request, file_path, derivatives, w=w, h=h, format=format, q=q)
 
 # -------------------------------------------------
 # Run
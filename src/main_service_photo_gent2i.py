@@ -1,18 +1,18 @@
-from fastapi import FastAPI, HTTPException, Body, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Body, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from fastapi.exceptions import RequestValidationError, ResponseValidationError
 from loguru import logger
 import traceback
 import os
 import sys
+import re
+import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import  Any
-import multiprocessing
-import asyncio
-from typing import  Any
+from typing import  Any, List, Optional, Literal
+from configparser import ConfigParser
 
 
 path_this = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +21,22 @@ path_root = os.path.dirname(os.path.join(path_this, '../..'))
 sys.path.extend([path_this, path_project, path_root])
 
 from main_photo_generatort2i import ImageGenAgent
+from agents.llm_client_pool import llm_client_pool
+from tools.job_queue import JobQueue, QueueFullError
+from tools.generation_index import GenerationIndex
+from tools.image_response import RESPONSE_FORMATS, wants_base64, build_image_response, serve_image
+from tools.derivatives import DerivativeCache
+from tools.progress import progress_hub, sse_stream, websocket_stream
+from tools.metrics import (
+    metrics, CONTENT_TYPE, HTTP_IN_FLIGHT, InFlightMiddleware,
+    backend_pool_collector, job_queue_collector, cache_collector, hits_misses, circuit_breaker_collector,
+)
+from tools.tracing import tracer, TracingMiddleware
+from tools.deadline import DeadlineMiddleware, DeadlineExceeded
+
+# setting middleware dibaca saat import; sisanya lewat agent.config di startup
+config = ConfigParser()
+config.read(os.environ.get("PHOTO_AGENT_CONFIG", os.path.join(path_this, "config.ini")))
 
 app = FastAPI(
     title="Text2Image Generator Agent API",
@@ -34,6 +50,21 @@ PROFILE_EXAMPLE = {
 
 class PromptData(BaseModel):
     prompt: str = Field(..., example="buatkan saya poto profil pria, usia muda ganteng berpakaian formal")
+    seed: int = Field(-1, description="Seed SD, -1 untuk random. Seed tetap bisa dilayani dari cache")
+    num_variants: int = Field(1, ge=1, le=8, description="Jumlah varian dari satu ekspansi prompt, satu call batch ke SD")
+    variation_strength: float = Field(0.0, ge=0.0, le=1.0, description="0 = seed berbeda per varian, >0 = seed sama + variasi subseed")
+
+class BatchPromptData(BaseModel):
+    prompts: List[str] = Field(..., min_length=1, max_length=10000, description="Daftar prompt, satu foto per prompt")
+    seed: int = Field(-1, description="Seed SD untuk semua item, -1 untuk random")
+
+class DraftRequest(BaseModel):
+    prompt: str = Field(..., example="buatkan saya poto profil pria, usia muda ganteng berpakaian formal")
+    num_drafts: Optional[int] = Field(None, ge=1, le=8, description="Jumlah draft, default dari config")
+    seed: int = Field(-1, description="Seed draft pertama, draft berikutnya seed+1, seed+2, ...")
+
+class RefineRequest(BaseModel):
+    generation_id: str = Field(..., description="generation_id draft yang dipilih")
 
 
 # CORS Middleware
@@ -44,6 +75,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(InFlightMiddleware, gauge=HTTP_IN_FLIGHT.labels("txt2img"))
+app.add_middleware(TracingMiddleware, service="txt2img")
+app.add_middleware(
+    DeadlineMiddleware,
+    service="txt2img",
+    default=config.getfloat("default", "request_deadline_default", fallback=0.0),
+    max_seconds=config.getfloat("default", "request_deadline_max", fallback=600.0),
+)
 
 # Exception handlers
 @app.exception_handler(RequestValidationError)
@@ -66,6 +105,11 @@ async def response_validation_exception_handler(request: Request, exc: ResponseV
         },
     )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exception_handler(request: Request, exc: DeadlineExceeded):
+    logger.warning(f"{request.url.path}: {exc}")
+    return JSONResponse(status_code=504, content={"detail": str(exc), "stage": exc.stage, "status": "error"})
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}")
@@ -80,46 +124,162 @@ async def general_exception_handler(request: Request, exc: Exception):
     )
 
 agent = None
-executor = None
+job_queue = None
+derivatives = None
+
+async def _generate(input_data: PromptData, include_base64: bool = True):
+    if input_data.num_variants > 1:
+        return await agent.aprocess_generate_variants(
+            input_data.prompt, input_data.num_variants, seed=input_data.seed,
+            variation_strength=input_data.variation_strength, include_base64=include_base64,
+        )
+    return await agent.aprocess_generate_image(input_data.prompt, seed=input_data.seed, include_base64=include_base64)
+
+def _images(result):
+    """Metadata per gambar, baik hasil tunggal maupun multi-varian."""
+    return result["variants"] if "variants" in result else [result]
+
+async def _compress_all(result):
+    for item in _images(result):
+        await agent.acompress_output(item)
+
+async def _run_generate_job(input_data: PromptData):
+    # hasil job disimpan JobQueue sampai job_result_ttl, jadi cukup path; gambar diambil lewat url
+    result = await _generate(input_data, include_base64=False)
+    for item in _images(result):
+        agent.schedule_compression(item)
+    return result
 
 @app.on_event("startup")
 async def startup_event():
-    global agent, executor
+    global agent, job_queue, derivatives
     logger.info("Initializing ImageGenAgent...")
     agent = ImageGenAgent()
-    executor = ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    await agent.astart()
+    derivatives = DerivativeCache(
+        root=os.path.join(path_project, agent.config.get("default", "derivative_cache_path", fallback="cache/derivatives")),
+        max_bytes=agent.config.getint("default", "derivative_cache_max_bytes", fallback=1024 ** 3),
+        max_workers=agent.config.getint("default", "derivative_workers", fallback=2),
+    )
+    job_queue = JobQueue(
+        _run_generate_job,
+        max_size=agent.config.getint("default", "job_queue_size", fallback=64),
+        workers=agent.config.getint("default", "job_workers", fallback=4),
+        result_ttl=agent.config.getfloat("default", "job_result_ttl", fallback=3600.0),
+        name="txt2img",
+        progress=progress_hub,
+        max_finished=agent.config.getint("default", "job_max_finished", fallback=1000),
+    )
+    await job_queue.start()
+    _register_collectors()
     logger.info("Application startup complete")
 
+def _register_collectors():
+    """Gauge yang dibaca dari stats() komponen saat /metrics di-scrape."""
+    metrics.register_collector(backend_pool_collector(agent.backend_pool, "txt2img"))
+    metrics.register_collector(job_queue_collector(lambda: job_queue))
+    metrics.register_collector(circuit_breaker_collector([agent.llm_breaker]))
+    caches = {
+        "image_store": lambda: hits_misses(agent.image_store.stats()),
+        "derivatives": lambda: hits_misses(*derivatives.stats().values()),
+    }
+    if agent.prompt_cache is not None:
+        caches["prompt"] = lambda: hits_misses(agent.prompt_cache.stats())
+    metrics.register_collector(cache_collector(caches))
+
 @app.on_event("shutdown")
 async def shutdown_event():
-    global executor
-    if executor:
-        executor.shutdown()
+    if job_queue:
+        await job_queue.stop()
+    if derivatives:
+        derivatives.shutdown()
+    if agent:
+        await agent.aclose()
     logger.info("Application shutdown complete")
 
+@app.get("/metrics", summary="Prometheus Metrics")
+async def prometheus_metrics():
+    # collector prompt cache membaca SQLite, jadi render di thread
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type=CONTENT_TYPE)
+
+@app.get("/stats/llm-pool", summary="LLM Client Pool Stats")
+async def llm_pool_stats():
+    return llm_client_pool.stats()
+
+@app.get("/stats/llm-retry", summary="LLM Retry / Hedging Stats")
+async def llm_retry_stats():
+    return agent.agentpromptgenerator.retry_stats()
+
+@app.get("/stats/prompt-expansion", summary="Prompt Expansion Fallback / Circuit Breaker Stats")
+async def prompt_expansion_stats():
+    return agent.prompt_expansion_stats()
+
+@app.get("/stats/prompt-cache", summary="Prompt Expansion Cache Stats")
+async def prompt_cache_stats():
+    if agent is None or agent.prompt_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **agent.prompt_cache.stats()}
+
+@app.get("/stats/image-store", summary="Generated Image Store Stats")
+async def image_store_stats():
+    if agent is None:
+        return {}
+    return agent.image_store.stats()
+
+@app.get("/images/{filename}", summary="Get Generated Image")
+async def get_image(
+    request: Request,
+    filename: str,
+    w: Optional[int] = Query(None, ge=16, le=2048, description="Lebar maksimal turunan"),
+    h: Optional[int] = Query(None, ge=16, le=2048, description="Tinggi maksimal turunan"),
+    format: Optional[Literal["webp", "jpeg", "png"]] = Query(None, description="Format turunan"),
+    q: int = Query(80, ge=1, le=100, description="Kualitas webp/jpeg"),
+):
+    key, _ = os.path.splitext(os.path.basename(filename))
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        raise HTTPException(status_code=404, detail="File not found")
+    path = await asyncio.to_thread(agent.image_store.get, key)
+    if path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await serve_image(request, path, derivatives, w=w, h=h, format=format, q=q)
+
 @app.post("/generate-photo-profile/", summary="Generate Photo Profile")
-async def generate_photo_profile(request: PromptData):
+async def generate_photo_profile(
+    request: PromptData,
+    http_request: Request,
+    response_format: str = Query("json-base64", description=f"Salah satu dari: {', '.join(RESPONSE_FORMATS)}"),
+):
     input_data = request
+    include_base64 = wants_base64(response_format)
+    if response_format == "png" and input_data.num_variants > 1:
+        raise HTTPException(status_code=400, detail="response_format=png hanya untuk satu gambar, pakai multipart untuk num_variants > 1")
     try:
         logger.info(f"process generate from : {input_data}")
         
-        # Run the image generation in a thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        process_generate = await loop.run_in_executor(
-            executor, 
-            agent.process_generate_image, 
-            input_data
-        )
-        
-        return JSONResponse(
-            status_code=200,
+        # Pipeline async penuh, concurrency dibatasi oleh pool koneksi SD backend
+        process_generate = await _generate(input_data, include_base64=include_base64)
+        images = _images(process_generate)
+        if response_format != "json-base64":
+            for item in images:
+                item["url"] = str(http_request.url_for("get_image", filename=os.path.basename(item["path_file"])))
+
+        response = build_image_response(
+            response_format,
             content={
                 "status": "success",
                 "data": process_generate,
                 "message": "Photo generated successfully"
-            }
+            },
+            paths=[item["path_file"] for item in images],
         )
+        # kompresi penyimpanan jalan setelah response terkirim
+        response.background = BackgroundTask(_compress_all, process_generate)
+        return response
             
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating photo: {str(e)}")
         logger.error(traceback.format_exc())
@@ -133,6 +293,217 @@ async def generate_photo_profile(request: PromptData):
         
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-photo-profile/batch", summary="Generate Photo Profiles in Bulk (NDJSON)")
+async def generate_photo_profile_batch(request: BatchPromptData, http_request: Request):
+    """
+    Generate banyak foto profil dalam satu request. Tiap hasil dikirim sebagai satu
+    baris NDJSON begitu selesai (urutan sesuai waktu selesai, pakai `index`);
+    item yang gagal dikirim sebagai baris error tanpa menghentikan batch.
+    """
+    async def stream():
+        async for item in agent.aprocess_batch(request.prompts, seed=request.seed, include_base64=False):
+            if item["status"] == "success":
+                data = item["data"]
+                data["url"] = str(http_request.url_for("get_image", filename=os.path.basename(data["path_file"])))
+                agent.schedule_compression(data)
+            yield json.dumps(item, default=str) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/generate-photo-profile/drafts", summary="Generate Cheap Drafts")
+async def generate_drafts(
+    request: DraftRequest,
+    http_request: Request,
+    response_format: str = Query("json-base64", description=f"Salah satu dari: {', '.join(RESPONSE_FORMATS)}"),
+):
+    """
+    Fase 1 draft-then-refine: beberapa draft resolusi rendah/step sedikit dengan
+    seed tetap. Pilih satu lalu kirim generation_id-nya ke /generate-photo-profile/refine.
+    """
+    include_base64 = wants_base64(response_format)
+    result = await agent.aprocess_drafts(
+        request.prompt, num_drafts=request.num_drafts, seed=request.seed, include_base64=include_base64
+    )
+    if response_format != "json-base64":
+        for draft in result["drafts"]:
+            draft["url"] = str(http_request.url_for("get_image", filename=os.path.basename(draft["path_file"])))
+    return build_image_response(
+        response_format,
+        content={"status": "success", "data": result, "message": "Drafts generated successfully"},
+        paths=[draft["path_file"] for draft in result["drafts"]],
+    )
+
+@app.post("/generate-photo-profile/refine", summary="Refine Chosen Draft")
+async def refine_draft(
+    request: RefineRequest,
+    http_request: Request,
+    response_format: str = Query("json-base64", description=f"Salah satu dari: {', '.join(RESPONSE_FORMATS)}"),
+):
+    """Fase 2: refine draft terpilih ke kualitas penuh (hires-fix + restore_faces)."""
+    include_base64 = wants_base64(response_format)
+    try:
+        result = await agent.aprocess_refine(request.generation_id, include_base64=include_base64)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if response_format != "json-base64":
+        result["url"] = str(http_request.url_for("get_image", filename=os.path.basename(result["path_file"])))
+    response = build_image_response(
+        response_format,
+        content={"status": "success", "data": result, "message": "Photo refined successfully"},
+        paths=[result["path_file"]],
+    )
+    response.background = BackgroundTask(agent.acompress_output, result)
+    return response
+
+@app.get("/stats/progressive", summary="Draft-then-refine GPU Stats")
+async def progressive_stats():
+    return agent.progressive_stats()
+
+@app.get("/generations/{generation_id}", summary="Get Generation Record")
+async def get_generation(generation_id: str):
+    record = await asyncio.to_thread(agent.generation_index.get, generation_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return record
+
+@app.get("/generations", summary="Search Generation Records")
+async def search_generations(
+    session_id: str = Query(None),
+    prompt: str = Query(None, description="Substring prompt"),
+    date_from: str = Query(None, description="ISO date, inklusif"),
+    date_to: str = Query(None, description="ISO date, eksklusif"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    try:
+        ts_from, ts_to = GenerationIndex.parse_date(date_from), GenerationIndex.parse_date(date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(
+        agent.generation_index.query,
+        kind="txt2img", session_id=session_id, prompt=prompt,
+        date_from=ts_from, date_to=ts_to, limit=limit, offset=offset,
+    )
+
+@app.post("/jobs", status_code=202, summary="Submit Photo Profile Job")
+async def submit_job(request: PromptData):
+    try:
+        job = job_queue.submit(request)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"status": "error", "detail": str(e)},
+        )
+    return {"status": "queued", "data": job.to_dict(job_queue.position(job))}
+
+@app.get("/jobs/{job_id}", summary="Get Photo Profile Job")
+async def get_job(
+    job_id: str,
+    request: Request,
+    wait: float = Query(0, ge=0, le=60, description="Long-poll maksimal N detik"),
+):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await job_queue.wait(job, wait)
+    data = job.to_dict(job_queue.position(job))
+    if data["result"]:
+        data["result"] = _result_view(request, data["result"])
+    return {"status": job.status, "data": data}
+
+def _result_view(request, result):
+    """Hasil job sebagai referensi gambar (url ke /images), tanpa base64."""
+    images = []
+    for item in _images(result):
+        item = {k: v for k, v in item.items() if k != "base64"}
+        item["url"] = str(request.url_for("get_image", filename=os.path.basename(item["path_file"])))
+        images.append(item)
+    return {**result, "variants": images} if "variants" in result else images[0]
+
+def _event_view(request, event):
+    """Event `done` dikirim sebagai referensi gambar (url), tanpa base64."""
+    if event["type"] != "done" or not event.get("result"):
+        return event
+    return {**event, "result": _result_view(request, event["result"])}
+
+def _sse_response(request, channel, preview: bool):
+    return StreamingResponse(
+        sse_stream(channel, preview=preview, view=lambda e: _event_view(request, e)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/generate-photo-profile/stream", summary="Generate Photo Profile (SSE)")
+async def generate_photo_profile_stream(
+    request: PromptData,
+    http_request: Request,
+    preview: bool = Query(False, description="Sertakan preview low-res di event progress"),
+):
+    """
+    Submit sebagai job lalu stream event: queued, started, prompt_expanded,
+    generating, progress (step + preview opsional), done/error.
+    """
+    try:
+        job = job_queue.submit(request)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"status": "error", "detail": str(e)},
+        )
+    return _sse_response(http_request, progress_hub.get(job.id), preview)
+
+@app.get("/jobs/{job_id}/events", summary="Stream Photo Profile Job Events (SSE)")
+async def job_events(job_id: str, request: Request, preview: bool = Query(False)):
+    channel = progress_hub.get(job_id)
+    if channel is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _sse_response(request, channel, preview)
+
+@app.websocket("/jobs/{job_id}/ws")
+async def job_events_ws(websocket: WebSocket, job_id: str, preview: bool = False):
+    channel = progress_hub.get(job_id)
+    if channel is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    try:
+        await websocket_stream(websocket, channel, preview=preview, view=lambda e: _event_view(websocket, e))
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/stats/progress", summary="Progress Streaming Stats")
+async def progress_stats():
+    return progress_hub.stats()
+
+@app.get("/stats/storage", summary="Storage Codec Stats")
+async def storage_stats():
+    return agent.storage_codec.stats()
+
+@app.get("/stats/derivatives", summary="Image Derivative Cache Stats")
+async def derivative_stats():
+    return derivatives.stats()
+
+@app.get("/stats/backends", summary="SD Backend Pool Stats")
+async def backend_stats():
+    return agent.backend_pool.stats()
+
+@app.get("/stats/batching", summary="txt2img Micro-batching Stats")
+async def batching_stats():
+    dispatcher = agent.agent_text2img.dispatcher
+    if dispatcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **dispatcher.stats()}
+
+@app.get("/stats/jobs", summary="Job Queue Stats")
+async def job_stats():
+    return job_queue.stats()
+
+@app.get("/stats/tracing", summary="Span Exporter Stats")
+async def tracing_stats():
+    return tracer.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=7020)
\ No newline at end of file
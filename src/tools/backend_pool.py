@@ -0,0 +1,374 @@
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+from tools.metrics import stage
+from tools.tracing import tracer
+
+_BACKEND_WAIT = stage("backend_wait")
+
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int = 2):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.ejected_at: Optional[float] = None
+        self.last_probe_at: Optional[float] = None
+        # checkpoint yang sedang resident di backend (None = belum diketahui)
+        self.checkpoint: Optional[str] = None
+        self.swapping = False
+        self.swaps = 0
+        self.swap_seconds = 0.0
+        # request yang dibatalkan (deadline/client putus) saat sedang di backend
+        self.abandoned = 0
+        self.interrupts = 0
+        self.wasted_gpu_seconds = 0.0
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.outstanding < self.max_concurrency
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "ejected_at": self.ejected_at,
+            "last_probe_at": self.last_probe_at,
+            "checkpoint": self.checkpoint,
+            "swapping": self.swapping,
+            "swaps": self.swaps,
+            "swap_seconds": round(self.swap_seconds, 3),
+            "abandoned": self.abandoned,
+            "interrupts": self.interrupts,
+            "wasted_gpu_seconds": round(self.wasted_gpu_seconds, 3),
+        }
+
+
+class BackendPool:
+    """
+    Pool backend AUTOMATIC1111 dengan scheduling least-outstanding-requests.
+    Backend yang gagal `failure_threshold` kali berturut-turut dikeluarkan dari
+    rotasi, lalu dimasukkan lagi begitu probe `probe_path` berhasil.
+
+    Residency checkpoint: pool mencatat checkpoint yang sedang dimuat tiap backend.
+    Request dengan checkpoint diarahkan ke backend yang sudah memuatnya; swap
+    (POST `/sdapi/v1/options`) hanya dilakukan di backend idle yang checkpoint-nya
+    tidak sedang ditunggu request lain, kecuali request sudah menunggu lebih dari
+    `swap_max_wait` detik.
+    """
+
+    OPTIONS_PATH = "/sdapi/v1/options"
+    INTERRUPT_PATH = "/sdapi/v1/interrupt"
+
+    def __init__(
+        self,
+        urls: List[str],
+        max_concurrency: int = 2,
+        probe_interval: float = 10.0,
+        probe_path: str = "/internal/ping",
+        probe_timeout: float = 3.0,
+        failure_threshold: int = 3,
+        swap_max_wait: float = 30.0,
+        swap_timeout: float = 180.0,
+    ):
+        urls = [u.strip() for u in urls if u and u.strip()]
+        if not urls:
+            raise ValueError("BackendPool butuh minimal satu URL backend")
+        self.backends = [Backend(u, max_concurrency) for u in urls]
+        self.probe_interval = probe_interval
+        self.probe_path = probe_path
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.swap_max_wait = swap_max_wait
+        self.swap_timeout = swap_timeout
+
+        self._waiting: Counter = Counter()
+        self._cond: Optional[asyncio.Condition] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._probe_client: Optional[httpx.AsyncClient] = None
+        self._background: set = set()
+
+    @classmethod
+    def from_config(cls, config, section: str = "default", fallback_urls: str = "") -> "BackendPool":
+        """Bangun pool dari config.ini: `sd_backends` = daftar URL dipisah koma."""
+        urls = config.get(section, "sd_backends", fallback=fallback_urls) or fallback_urls
+        return cls(
+            urls=urls.split(","),
+            max_concurrency=config.getint(section, "sd_backend_max_concurrency", fallback=2),
+            probe_interval=config.getfloat(section, "sd_probe_interval", fallback=10.0),
+            probe_path=config.get(section, "sd_probe_path", fallback="/internal/ping"),
+            failure_threshold=config.getint(section, "sd_failure_threshold", fallback=3),
+            swap_max_wait=config.getfloat(section, "sd_swap_max_wait", fallback=30.0),
+            swap_timeout=config.getfloat(section, "sd_swap_timeout", fallback=180.0),
+        )
+
+    @property
+    def total_capacity(self) -> int:
+        return sum(b.max_concurrency for b in self.backends)
+
+    # ---------- scheduling ----------
+    def _candidates(self) -> List[Backend]:
+        healthy = [b for b in self.backends if b.healthy]
+        if not healthy:
+            # fail-open: kalau semua ter-eject, tetap coba daripada menolak semua request
+            logger.warning("Semua SD backend unhealthy, fallback ke seluruh pool")
+            healthy = self.backends
+        return healthy
+
+    @staticmethod
+    def normalize_checkpoint(title: Optional[str]) -> Optional[str]:
+        """`model.safetensors [abc123]` (title dari /options) -> `model.safetensors`."""
+        if not title:
+            return None
+        return title.split(" [", 1)[0].strip()
+
+    def choose(self, checkpoint: Optional[str] = None) -> Backend:
+        """Pilih backend tanpa menunggu slot (dipakai path sync/CLI), utamakan yang checkpoint-nya resident."""
+        candidates = self._candidates()
+        resident = [b for b in candidates if checkpoint and b.checkpoint == checkpoint]
+        return min(resident or candidates, key=lambda b: b.outstanding / b.max_concurrency)
+
+    def note_checkpoint(self, backend: Backend, checkpoint: Optional[str], seconds: float = 0.0):
+        """Catat checkpoint yang sekarang dimuat backend (mis. setelah request sync dengan override)."""
+        if checkpoint is None or backend.checkpoint == checkpoint:
+            return
+        if backend.checkpoint is not None:
+            backend.swaps += 1
+            backend.swap_seconds += seconds
+        backend.checkpoint = checkpoint
+
+    def _pick(self, checkpoint: Optional[str], waited: float) -> Optional[Backend]:
+        available = [b for b in self._candidates() if b.has_capacity]
+        if checkpoint is None:
+            return min(available, key=lambda b: b.outstanding / b.max_concurrency) if available else None
+
+        resident = [b for b in available if b.checkpoint == checkpoint]
+        if resident:
+            return min(resident, key=lambda b: b.outstanding / b.max_concurrency)
+
+        # swap hanya di backend idle, dan jangan ambil checkpoint yang masih ditunggu request lain
+        swappable = [
+            b for b in available
+            if b.outstanding == 0 and not b.swapping
+            and (b.checkpoint is None or not self._waiting[b.checkpoint] or waited >= self.swap_max_wait)
+        ]
+        if swappable:
+            # backend yang checkpoint-nya belum diketahui dulu, load awal bukan swap
+            return min(swappable, key=lambda b: (b.checkpoint is not None, b.total_requests))
+        return None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    @asynccontextmanager
+    async def acquire(self, checkpoint: Optional[str] = None):
+        """
+        Ambil slot di backend dengan rasio outstanding/kapasitas terkecil,
+        menunggu kalau semua backend sedang penuh. Kalau `checkpoint` diisi,
+        hanya backend yang sudah memuatnya atau backend idle yang boleh di-swap.
+        """
+        cond = self._condition()
+        start = time.time()
+        async with cond:
+            self._waiting[checkpoint] += 1
+            try:
+                while True:
+                    backend = self._pick(checkpoint, time.time() - start)
+                    if backend is not None:
+                        break
+                    try:
+                        # timeout supaya request yang menunggu swap dievaluasi ulang setelah swap_max_wait
+                        await asyncio.wait_for(cond.wait(), timeout=self.swap_max_wait or None)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting[checkpoint] -= 1
+                if self._waiting[checkpoint] <= 0:
+                    del self._waiting[checkpoint]
+            now = time.time()
+            _BACKEND_WAIT.observe(now - start)
+            tracer.record("sd.acquire", start, now, backend=backend.url, checkpoint=checkpoint)
+            backend.outstanding += 1
+            backend.total_requests += 1
+            needs_load = checkpoint is not None and backend.checkpoint != checkpoint
+            if needs_load:
+                previous, backend.checkpoint, backend.swapping = backend.checkpoint, checkpoint, True
+        try:
+            if needs_load:
+                await self._load_checkpoint(backend, previous, checkpoint)
+            yield backend
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500:
+                self.report_failure(backend)
+            raise
+        else:
+            self.report_success(backend)
+        finally:
+            async with cond:
+                backend.outstanding -= 1
+                # semua waiter dievaluasi ulang: slot ini mungkin hanya cocok untuk checkpoint tertentu
+                cond.notify_all()
+
+    # ---------- cancel ----------
+    @asynccontextmanager
+    async def interruptible(self, backend: Backend):
+        """
+        Bungkus call generate yang memegang slot `backend`. Kalau call di-cancel
+        (deadline habis, client putus) atau timeout, GPU-seconds yang sudah
+        terpakai dicatat sebagai terbuang dan backend di-interrupt.
+        """
+        start = time.time()
+        try:
+            yield
+        except (asyncio.CancelledError, httpx.TimeoutException):
+            self.abandon(backend, time.time() - start)
+            raise
+
+    def abandon(self, backend: Backend, seconds: float):
+        backend.abandoned += 1
+        backend.wasted_gpu_seconds += seconds
+        # interrupt A1111 menghentikan job yang sedang jalan, yang bisa saja milik
+        # request lain kalau backend memegang lebih dari satu request
+        if backend.outstanding > 1:
+            logger.info(f"SD request di {backend.url} dibatalkan setelah {seconds:.1f}s, skip interrupt (backend dipakai request lain)")
+            return
+        logger.info(f"SD request di {backend.url} dibatalkan setelah {seconds:.1f}s, interrupt backend")
+        # dijalankan sebagai task terpisah karena pemanggil sedang di-cancel
+        task = asyncio.get_running_loop().create_task(self._interrupt(backend))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _interrupt(self, backend: Backend):
+        try:
+            r = await self._http().post(f"{backend.url}{self.INTERRUPT_PATH}", timeout=self.probe_timeout)
+            r.raise_for_status()
+            backend.interrupts += 1
+        except httpx.HTTPError as e:
+            logger.warning(f"Interrupt SD backend {backend.url} gagal: {e}")
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._probe_client is None:
+            self._probe_client = httpx.AsyncClient()
+        return self._probe_client
+
+    async def _load_checkpoint(self, backend: Backend, previous: Optional[str], checkpoint: str):
+        """Muat checkpoint di backend idle; dipanggil dengan slot backend sudah dipegang."""
+        start = time.time()
+        try:
+            with tracer.span("sd.checkpoint_swap", backend=backend.url, previous=previous, checkpoint=checkpoint):
+                r = await self._http().post(
+                    f"{backend.url}{self.OPTIONS_PATH}",
+                    json={"sd_model_checkpoint": checkpoint},
+                    timeout=self.swap_timeout,
+                )
+                r.raise_for_status()
+        except Exception:
+            backend.checkpoint = None
+            raise
+        finally:
+            backend.swapping = False
+        elapsed = time.time() - start
+        if previous is not None:
+            backend.swaps += 1
+            backend.swap_seconds += elapsed
+            logger.info(f"SD backend {backend.url} swap {previous} -> {checkpoint} ({elapsed:.1f}s)")
+        else:
+            logger.info(f"SD backend {backend.url} load {checkpoint} ({elapsed:.1f}s)")
+
+    async def refresh_checkpoint(self, backend: Backend):
+        """Baca checkpoint yang sedang dimuat dari /sdapi/v1/options."""
+        r = await self._http().get(f"{backend.url}{self.OPTIONS_PATH}", timeout=self.probe_timeout)
+        r.raise_for_status()
+        if not backend.swapping:
+            backend.checkpoint = self.normalize_checkpoint(r.json().get("sd_model_checkpoint"))
+
+    def report_success(self, backend: Backend):
+        backend.consecutive_failures = 0
+
+    def report_failure(self, backend: Backend):
+        backend.consecutive_failures += 1
+        backend.total_failures += 1
+        if backend.healthy and backend.consecutive_failures >= self.failure_threshold:
+            backend.healthy = False
+            backend.ejected_at = time.time()
+            logger.warning(f"SD backend {backend.url} ejected setelah {backend.consecutive_failures} kegagalan")
+
+    # ---------- health probe ----------
+    async def probe(self, backend: Backend) -> bool:
+        backend.last_probe_at = time.time()
+        try:
+            r = await self._http().get(f"{backend.url}{self.probe_path}", timeout=self.probe_timeout)
+            ok = r.is_success
+        except httpx.HTTPError:
+            ok = False
+
+        if ok and backend.checkpoint is None and not backend.swapping:
+            try:
+                await self.refresh_checkpoint(backend)
+            except (httpx.HTTPError, ValueError):
+                pass
+
+        if ok:
+            backend.consecutive_failures = 0
+            if not backend.healthy:
+                backend.healthy = True
+                backend.ejected_at = None
+                logger.info(f"SD backend {backend.url} re-admitted")
+                async with self._condition():
+                    self._condition().notify_all()
+        else:
+            self.report_failure(backend)
+        return ok
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self.probe(b) for b in self.backends), return_exceptions=True)
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        if self._probe_task is None and self.probe_interval > 0:
+            self._http()
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._probe_client is not None:
+            await self._probe_client.aclose()
+            self._probe_client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": sum(1 for b in self.backends if b.healthy),
+            "total": len(self.backends),
+            "swaps": sum(b.swaps for b in self.backends),
+            "swap_seconds": round(sum(b.swap_seconds for b in self.backends), 3),
+            "interrupts": sum(b.interrupts for b in self.backends),
+            "wasted_gpu_seconds": round(sum(b.wasted_gpu_seconds for b in self.backends), 3),
+            "waiting": {str(k): v for k, v in self._waiting.items()},
+            "backends": [b.to_dict() for b in self.backends],
+        }
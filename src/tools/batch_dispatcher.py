@@ -0,0 +1,150 @@
+import asyncio
+import json
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from loguru import logger
+
+from tools.metrics import SD_BATCH_FILL, SD_BATCH_SIZE
+from tools.progress import ProgressChannel, progress_hub
+from tools import deadline
+
+
+class BatchDispatcher:
+    """
+    Kumpulkan request txt2img yang kompatibel selama `window` detik lalu kirim
+    sebagai satu call A1111 dengan `batch_size` = jumlah request, kemudian
+    hasilnya dibagikan kembali ke masing-masing pemanggil.
+
+    A1111 hanya membatch di GPU untuk satu prompt yang sama, jadi request dianggap
+    kompatibel kalau seluruh payload identik (prompt, checkpoint, sampler, steps,
+    ukuran, cfg) dan seed-nya random (-1). Request lain langsung dikirim sendiri.
+    Batch dibatalkan (dan A1111 di-interrupt lewat pool) kalau semua pemanggilnya
+    sudah cancel; kalau batch-nya sendiri yang di-cancel, semua pemanggil ikut di-cancel.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        window: float = 0.05,
+        max_batch_size: int = 4,
+    ):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._groups: Dict[str, List[Tuple[Dict[str, Any], asyncio.Future, Tuple[ProgressChannel, ...]]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._batch_sizes: Counter = Counter()
+        self._abandoned = 0
+
+    @staticmethod
+    def batch_key(payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, sort_keys=True, default=str)
+
+    def can_batch(self, payload: Dict[str, Any]) -> bool:
+        return (
+            self.max_batch_size > 1
+            and payload.get("seed", -1) == -1
+            and payload.get("batch_size", 1) == 1
+            and payload.get("n_iter", 1) == 1
+        )
+
+    async def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Return response A1111 untuk satu gambar: {"images": [b64], "info": json}."""
+        if not self.can_batch(payload):
+            return await self.run_batch(payload)
+
+        loop = asyncio.get_running_loop()
+        key = self.batch_key(payload)
+        future = loop.create_future()
+        group = self._groups.setdefault(key, [])
+        # channel progress ikut disimpan, batch jalan di task lain
+        group.append((payload, future, progress_hub.current()))
+
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._groups.pop(key, None)
+        if not group:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        for _, future, _ in group:
+            future.add_done_callback(lambda _, group=group, task=task: self._abandon(group, task))
+
+    def _abandon(self, group: List[Tuple[Dict[str, Any], asyncio.Future, Tuple[ProgressChannel, ...]]], task: asyncio.Task):
+        # semua pemanggil sudah pergi (disconnect/deadline), GPU tidak perlu menyelesaikan batch ini
+        if not task.done() and all(future.cancelled() for _, future, _ in group):
+            self._abandoned += 1
+            task.cancel()
+
+    async def _run(self, group: List[Tuple[Dict[str, Any], asyncio.Future, Tuple[ProgressChannel, ...]]]):
+        size = len(group)
+        self._batch_sizes[size] += 1
+        SD_BATCH_SIZE.observe(size)
+        SD_BATCH_FILL.observe(size / self.max_batch_size)
+        batch_payload = {**group[0][0], "batch_size": size, "n_iter": 1, "do_not_save_grid": True}
+        channels = [c for _, _, chans in group for c in chans]
+        try:
+            # task ini mewarisi context request pertama; deadline-nya tidak boleh membatalkan
+            # batch milik request lain (tiap request dibatasi deadline-nya sendiri saat menunggu)
+            with progress_hub.bind(*channels), deadline.scope(None):
+                data = await self.run_batch(batch_payload)
+        except Exception as e:
+            for _, future, _ in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # batch di-cancel (shutdown/interrupt): pemanggil tidak boleh menunggu selamanya
+            for _, future, _ in group:
+                future.cancel()
+            raise
+
+        images = data.get("images", [])
+        # beberapa versi A1111 tetap menyisipkan grid di index 0
+        if len(images) == size + 1:
+            images = images[1:]
+        try:
+            info = json.loads(data.get("info") or "{}")
+        except ValueError:
+            info = {}
+        seeds = info.get("all_seeds") or []
+        gpu_share = data.get("gpu_seconds", 0.0) / size
+        if size > 1:
+            logger.debug(f"Batched {size} txt2img requests into one call")
+
+        for idx, (_, future, _) in enumerate(group):
+            if future.done():
+                continue
+            if idx >= len(images):
+                future.set_exception(RuntimeError(f"Backend mengembalikan {len(images)} gambar untuk batch {size}"))
+                continue
+            seed = seeds[idx] if idx < len(seeds) else info.get("seed", -1)
+            future.set_result({"images": [images[idx]], "info": json.dumps({"seed": seed}), "gpu_seconds": gpu_share})
+
+    def stats(self) -> Dict[str, Any]:
+        batches = sum(self._batch_sizes.values())
+        requests = sum(size * count for size, count in self._batch_sizes.items())
+        return {
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+            "batches": batches,
+            "batched_requests": requests,
+            "avg_batch_size": requests / batches if batches else 0.0,
+            "fill_rate": requests / (batches * self.max_batch_size) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            "pending_groups": len(self._groups),
+            "running_batches": len(self._tasks),
+            "abandoned_batches": self._abandoned,
+        }
@@ -0,0 +1,261 @@
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional, Sequence
+
+from tools.metrics import metrics
+
+DEADLINE_HEADER = b"x-request-timeout"
+DEADLINE_PARAM = "timeout"
+
+_DEADLINE_EXCEEDED = metrics.counter("photo_deadline_exceeded_total", "Request yang kehabisan deadline per stage", ("stage",))
+_CANCELLED = metrics.counter("photo_requests_cancelled_total", "Request HTTP yang di-cancel, reason = disconnect/deadline", ("service", "reason"))
+
+_current: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Budget waktu request habis di `stage`; service menjawab 504."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline request habis di stage {stage}")
+        self.stage = stage
+        _DEADLINE_EXCEEDED.labels(stage).inc()
+
+
+class Deadline:
+    """Batas waktu absolut (monotonic) satu request, dibawa lewat contextvars ke semua stage."""
+
+    __slots__ = ("expires_at", "seconds")
+
+    def __init__(self, seconds: float):
+        self.seconds = max(0.0, seconds)
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, default: Optional[float]) -> float:
+        """Timeout untuk satu call I/O: `default` dipotong sisa deadline."""
+        remaining = self.remaining()
+        return remaining if default is None else min(default, remaining)
+
+    def share(self, fraction: float) -> "Deadline":
+        """Sub-deadline untuk satu stage: `fraction` dari sisa budget."""
+        return Deadline(self.remaining() * fraction)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def timeout(default: Optional[float]) -> Optional[float]:
+    """Timeout I/O yang menghormati deadline aktif; `default` kalau tidak ada deadline."""
+    deadline = _current.get()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def check(stage: str):
+    deadline = _current.get()
+    if deadline is not None and deadline.expired:
+        raise DeadlineExceeded(stage)
+
+
+@contextmanager
+def scope(deadline: Optional[Deadline]):
+    """Pasang `deadline` sebagai deadline aktif selama blok (None = tanpa deadline)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage_share(fraction: float):
+    """
+    Batasi satu stage ke `fraction` dari sisa deadline, sisanya untuk stage
+    berikutnya. Tanpa deadline aktif blok jalan apa adanya (yield None).
+    """
+    deadline = _current.get()
+    if deadline is None or fraction >= 1.0:
+        yield deadline
+        return
+    with scope(deadline.share(fraction)) as sub:
+        yield sub
+
+
+@asynccontextmanager
+async def cancel_after(seconds: Optional[float]):
+    """
+    Cancel blok setelah `seconds` detik lalu raise asyncio.TimeoutError (None =
+    tanpa batas). Pengganti asyncio.timeout (baru ada di Python 3.11): callback
+    hanya meng-cancel task selama blok masih jalan, jadi CancelledError selalu
+    jatuh di await di dalam blok.
+    """
+    if seconds is None:
+        yield
+        return
+    task = asyncio.current_task()
+    state = {"active": True, "fired": False}
+    # 3.11+: cancel milik kita dikembalikan lewat uncancel() seperti asyncio.timeout,
+    # supaya cancelling() task tidak tertinggal 1 untuk TaskGroup/timeout berikutnya
+    cancelling = task.cancelling() if hasattr(task, "cancelling") else 0
+
+    def fire():
+        if state["active"]:
+            state["fired"] = True
+            task.cancel()
+
+    def uncancel() -> int:
+        state["fired"] = False
+        return task.uncancel() if hasattr(task, "uncancel") else cancelling
+
+    handle = asyncio.get_running_loop().call_later(max(0.0, seconds), fire)
+    try:
+        yield
+    except asyncio.CancelledError:
+        # cancel dari luar yang datang bersamaan tetap diteruskan sebagai CancelledError
+        if state["fired"] and uncancel() <= cancelling:
+            raise asyncio.TimeoutError() from None
+        raise
+    finally:
+        state["active"] = False
+        handle.cancel()
+        if state["fired"]:
+            # blok menelan CancelledError-nya sendiri
+            uncancel()
+
+
+@asynccontextmanager
+async def bounded(stage: str):
+    """Cancel blok saat deadline aktif habis, lalu raise DeadlineExceeded(stage)."""
+    deadline = _current.get()
+    if deadline is None:
+        yield
+        return
+    if deadline.expired:
+        raise DeadlineExceeded(stage)
+    try:
+        async with cancel_after(deadline.remaining()):
+            yield
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
+
+
+# ---------- ASGI ----------
+class _Receiver:
+    """
+    Satu-satunya pembaca `receive` ASGI: pesan body diteruskan ke app lewat
+    queue, sementara `http.disconnect` langsung terlihat walaupun app sedang
+    menunggu LLM/GPU dan tidak memanggil receive.
+    """
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+
+    async def pump(self):
+        while True:
+            message = await self._receive()
+            await self._queue.put(message)
+            if message["type"] == "http.disconnect":
+                self.disconnected.set()
+                return
+
+    async def __call__(self):
+        if self.disconnected.is_set() and self._queue.empty():
+            return {"type": "http.disconnect"}
+        return await self._queue.get()
+
+
+class DeadlineMiddleware:
+    """
+    Deadline per request dari header `X-Request-Timeout` atau query `?timeout=`
+    (detik), fallback `default` (0 = tanpa deadline). Handler di-cancel kalau
+    deadline habis atau client putus sebelum response selesai; cancel ini
+    turun sampai ke call LLM/SD (yang memanggil interrupt A1111). Kalau
+    response belum mulai terkirim saat deadline habis, client dapat 504.
+    BackgroundTask setelah response selesai tidak ikut di-cancel.
+    """
+
+    def __init__(self, app, service: str, default: float = 0.0, max_seconds: float = 600.0,
+                 exclude: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.service = service
+        self.default = default
+        self.max_seconds = max_seconds
+        self.exclude = tuple(exclude)
+
+    def _seconds(self, scope) -> float:
+        value = dict(scope.get("headers") or ()).get(DEADLINE_HEADER, b"").decode("latin-1")
+        if not value:
+            for pair in scope.get("query_string", b"").decode("latin-1").split("&"):
+                key, _, val = pair.partition("=")
+                if key == DEADLINE_PARAM:
+                    value = val
+        try:
+            seconds = float(value) if value else self.default
+        except ValueError:
+            seconds = self.default
+        return min(seconds, self.max_seconds) if seconds > 0 else 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        seconds = self._seconds(scope)
+        deadline = Deadline(seconds) if seconds > 0 else None
+        state = {"started": False, "complete": False}
+
+        async def tracked_send(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        receiver = _Receiver(receive)
+        pump = asyncio.ensure_future(receiver.pump())
+        disconnect = asyncio.ensure_future(receiver.disconnected.wait())
+        # task baru menyalin context saat dibuat, jadi deadline cukup dipasang di sekitar ensure_future
+        token = _current.set(deadline)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, receiver, tracked_send))
+        finally:
+            _current.reset(token)
+        try:
+            pending = {app_task, disconnect}
+            while app_task in pending:
+                limit = deadline.remaining() if deadline is not None and not state["complete"] else None
+                done, pending = await asyncio.wait(pending, timeout=limit, return_when=asyncio.FIRST_COMPLETED)
+                if app_task in done or state["complete"]:
+                    continue
+                if disconnect in done or deadline is None or deadline.expired:
+                    break
+            if app_task.done() or state["complete"]:
+                await app_task
+                return
+
+            reason = "disconnect" if receiver.disconnected.is_set() else "deadline"
+            _CANCELLED.labels(self.service, reason).inc()
+            app_task.cancel()
+            try:
+                await app_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            if reason == "deadline" and not state["started"]:
+                await send({"type": "http.response.start", "status": 504,
+                            "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body",
+                            "body": b'{"detail":"Deadline request habis","status":"error"}'})
+        finally:
+            for task in (pump, disconnect, app_task):
+                if not task.done():
+                    task.cancel()
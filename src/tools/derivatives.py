@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from tools.image_store import ImageStore
+
+FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+
+def render_derivative(source_path: str, width: Optional[int], height: Optional[int], fmt: str, quality: int) -> bytes:
+    """Resize (fit di dalam w x h, tanpa upscale) lalu encode ke format tujuan."""
+    pil_format = FORMATS[fmt][0]
+    with Image.open(source_path) as img:
+        img.load()
+        if width or height:
+            w, h = img.size
+            box = (width or w, height or h)
+            # reducing_gap: reduce() integer dulu sebelum resize, jauh lebih cepat untuk thumbnail kecil
+            img.thumbnail(box, Image.LANCZOS, reducing_gap=2.0)
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buf = BytesIO()
+        if pil_format == "PNG":
+            img.save(buf, format="PNG", optimize=True)
+        elif pil_format == "WEBP":
+            img.save(buf, format="WEBP", quality=quality, method=4)
+        else:
+            img.save(buf, format="JPEG", quality=quality, optimize=True)
+        return buf.getvalue()
+
+
+class DerivativeCache:
+    """
+    Turunan gambar (thumbnail / transcode) yang dibuat lazily di worker pool lalu
+    disimpan di disk. Satu ImageStore per format, masing-masing dengan budget byte
+    sendiri dan eviction LRU. Request paralel untuk turunan yang sama digabung.
+    """
+
+    def __init__(self, root: str = "cache/derivatives", max_bytes: int = 1024 ** 3, max_workers: int = 2):
+        per_format = max_bytes // len(FORMATS)
+        self.stores = {
+            fmt: ImageStore(f"{root}/{fmt}", max_bytes=per_format, suffix=suffix)
+            for fmt, (_, suffix, _) in FORMATS.items()
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="derivative")
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def media_type(fmt: str) -> str:
+        return FORMATS[fmt][2]
+
+    @staticmethod
+    def make_key(source_path: str, mtime_ns: int, size: int, width: Optional[int], height: Optional[int], quality: int) -> str:
+        raw = f"{source_path}:{mtime_ns}:{size}:{width}:{height}:{quality}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, source_path: str, mtime_ns: int, size: int, width: Optional[int], height: Optional[int], fmt: str, quality: int) -> str:
+        store = self.stores[fmt]
+        key = self.make_key(source_path, mtime_ns, size, width, height, quality)
+        path = await asyncio.to_thread(store.get, key)
+        if path is not None:
+            return path
+
+        inflight_key = f"{fmt}:{key}"
+        future = self._inflight.get(inflight_key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(store, key, source_path, width, height, fmt, quality))
+            self._inflight[inflight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        return await asyncio.shield(future)
+
+    async def _render(self, store: ImageStore, key: str, source_path: str, width, height, fmt: str, quality: int) -> str:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self._executor, render_derivative, source_path, width, height, fmt, quality)
+        return await asyncio.to_thread(store.put, key, data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {fmt: store.stats() for fmt, store in self.stores.items()}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class GenerationIndex:
+    """
+    Log generate append-only di SQLite (WAL). Hanya menyimpan path, hash,
+    parameter, timing dan session id - bukan base64 - sehingga tiap insert
+    O(1) berapapun besar histori-nya.
+    """
+
+    COLUMNS = (
+        "id", "session_id", "kind", "created_at", "prompt", "negative_prompt",
+        "path", "sha256", "bytes", "params", "timings",
+    )
+
+    def __init__(self, path: str = "index/generations.sqlite3"):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " id TEXT PRIMARY KEY,"
+            " session_id TEXT,"
+            " kind TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " prompt TEXT,"
+            " negative_prompt TEXT,"
+            " path TEXT NOT NULL,"
+            " sha256 TEXT,"
+            " bytes INTEGER,"
+            " params TEXT,"
+            " timings TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_created ON generations(created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_session ON generations(session_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_path ON generations(path)")
+
+    @staticmethod
+    def parse_date(value: Optional[str]) -> Optional[float]:
+        """ISO date/datetime (mis. 2025-09-08 atau 2025-09-08T15:04:11) -> epoch seconds."""
+        if not value:
+            return None
+        return datetime.fromisoformat(value).timestamp()
+
+    @staticmethod
+    def new_id() -> str:
+        return f"gen_{uuid.uuid4().hex}"
+
+    def record(
+        self,
+        kind: str,
+        path: str,
+        *,
+        id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        prompt: str = "",
+        negative_prompt: str = "",
+        sha256: Optional[str] = None,
+        bytes: Optional[int] = None,
+        params: Optional[Dict[str, Any]] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> str:
+        gen_id = id or self.new_id()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO generations ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                (
+                    gen_id, session_id, kind, time.time(), prompt, negative_prompt,
+                    path, sha256, bytes,
+                    json.dumps(params or {}, default=str),
+                    json.dumps(timings or {}),
+                ),
+            )
+        return gen_id
+
+    def update_storage(self, gen_id: str, storage: Dict[str, Any]):
+        """
+        Catat hasil storage codec: path/ukuran/hash baru, dan infotext A1111
+        (yang dibuang dari chunk PNG) dipindah ke params. Satu UPDATE by primary key.
+        """
+        storage = dict(storage)
+        infotext = storage.pop("infotext", "")
+        with self._lock:
+            self._conn.execute(
+                "UPDATE generations SET path = ?, bytes = ?, sha256 = COALESCE(?, sha256),"
+                " params = json_set(COALESCE(params, '{}'), '$.storage', json(?), '$.infotext', ?)"
+                " WHERE id = ?",
+                (storage["path"], storage["stored_bytes"], storage.get("sha256"), json.dumps(storage), infotext, gen_id),
+            )
+
+    def relink(self, old_path: str, new_path: Optional[str] = None):
+        """
+        Ikuti perubahan file di ImageStore: semua row dengan `old_path` dipindah ke
+        `new_path`, atau ditandai evicted (path dikosongkan) kalau new_path None.
+        """
+        with self._lock:
+            if new_path is None:
+                self._conn.execute(
+                    "UPDATE generations SET path = '',"
+                    " params = json_set(COALESCE(params, '{}'), '$.evicted_at', ?)"
+                    " WHERE path = ?",
+                    (time.time(), old_path),
+                )
+            else:
+                self._conn.execute("UPDATE generations SET path = ? WHERE path = ?", (new_path, old_path))
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        data["path"] = data["path"] or None
+        data["params"] = json.loads(data["params"] or "{}")
+        data["timings"] = json.loads(data["timings"] or "{}")
+        return data
+
+    def get(self, gen_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM generations WHERE id = ?", (gen_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def query(
+        self,
+        *,
+        kind: Optional[str] = None,
+        session_id: Optional[str] = None,
+        prompt: Optional[str] = None,
+        date_from: Optional[float] = None,
+        date_to: Optional[float] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        clauses, args = [], []
+        if kind:
+            clauses.append("kind = ?")
+            args.append(kind)
+        if session_id:
+            clauses.append("session_id = ?")
+            args.append(session_id)
+        if prompt:
+            clauses.append("prompt LIKE ?")
+            args.append(f"%{prompt}%")
+        if date_from is not None:
+            clauses.append("created_at >= ?")
+            args.append(date_from)
+        if date_to is not None:
+            clauses.append("created_at < ?")
+            args.append(date_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM generations {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (*args, limit, offset),
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
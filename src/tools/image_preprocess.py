@@ -0,0 +1,154 @@
+import asyncio
+import base64
+import binascii
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from tools.tracing import tracer
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# IHDR color type: 2 = RGB, 6 = RGBA (bit depth 8)
+PNG_OK_COLOR_TYPES = (2, 6)
+
+
+def snap64(value: int) -> int:
+    return max(64, (int(value) // 64) * 64)
+
+
+def png_header(data: bytes) -> Optional[Tuple[int, int, int, int]]:
+    """(width, height, bit_depth, color_type) dari chunk IHDR tanpa decode piksel."""
+    if len(data) < 26 or not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+        return None
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", data[16:26])
+    return width, height, bit_depth, color_type
+
+
+def is_conformant_png(data: bytes, width: int, height: int) -> bool:
+    """PNG RGB/RGBA 8-bit dengan ukuran persis target dan tanpa EXIF -> boleh dikirim apa adanya."""
+    header = png_header(data)
+    if header is None:
+        return False
+    w, h, bit_depth, color_type = header
+    return (w, h) == (width, height) and bit_depth == 8 and color_type in PNG_OK_COLOR_TYPES and b"eXIf" not in data
+
+
+def _fit(img: Image.Image, width: int, height: int) -> Image.Image:
+    """Downscale (tanpa upscale) lalu center-crop ke rasio target, ukuran kelipatan 64."""
+    w, h = img.size
+    scale = max(width / w, height / h)
+    if scale < 1:
+        # reduce() = box filter integer di C, jauh lebih murah dari resize penuh untuk faktor besar
+        factor = int(1 / scale)
+        if factor >= 2:
+            img = img.reduce(factor)
+            w, h = img.size
+            scale = max(width / w, height / h)
+        if scale < 1:
+            img = img.resize((max(width, round(w * scale)), max(height, round(h * scale))), Image.LANCZOS)
+        out_w, out_h = width, height
+    else:
+        # gambar lebih kecil dari target: crop ke rasio target, snap ke bawah kelipatan 64
+        ratio = min(w / width, h / height)
+        out_w, out_h = snap64(width * ratio), snap64(height * ratio)
+
+    w, h = img.size
+    left, top = (w - out_w) // 2, (h - out_h) // 2
+    return img.crop((left, top, left + out_w, top + out_h))
+
+
+def preprocess_bytes(data: bytes, width: int, height: int) -> Tuple[bytes, Dict[str, Any]]:
+    """Decode + EXIF transpose + fit + encode PNG. Module-level supaya bisa dipanggil di process pool."""
+    with Image.open(BytesIO(data)) as img:
+        original_size = img.size
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA") if img.mode == "RGBA" else img.convert("RGB")
+        img = _fit(img, width, height)
+        buf = BytesIO()
+        img.save(buf, format="PNG", compress_level=3)
+    out = buf.getvalue()
+    return out, {"original_size": original_size, "size": img.size, "input_bytes": len(data), "output_bytes": len(out)}
+
+
+class ImagePreprocessor:
+    """
+    Tahap preprocessing init image img2img sebelum dikirim ke A1111:
+    - PNG yang sudah sesuai target di-pass-through tanpa decode/re-encode
+    - selain itu: koreksi orientasi EXIF, downscale + center-crop ke target (kelipatan 64)
+    - upload besar didecode di process pool supaya tidak menahan event loop / GIL
+    """
+
+    def __init__(
+        self,
+        width: int = 512,
+        height: int = 512,
+        max_workers: int = 2,
+        process_threshold_bytes: int = 2 * 1024 * 1024,
+    ):
+        self.width = snap64(width)
+        self.height = snap64(height)
+        self.max_workers = max_workers
+        self.process_threshold_bytes = process_threshold_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._counters = {"passthrough": 0, "processed": 0, "process_pool": 0, "bytes_in": 0, "bytes_out": 0}
+
+    snap = staticmethod(snap64)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def decode_b64(image_b64: str) -> bytes:
+        # terima juga data URL "data:image/png;base64,...."
+        if image_b64.startswith("data:") and "," in image_b64:
+            image_b64 = image_b64.split(",", 1)[1]
+        try:
+            return base64.b64decode(image_b64, validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"init image bukan base64 valid: {e}")
+
+    def process_bytes(self, data: bytes, width: Optional[int] = None, height: Optional[int] = None) -> Tuple[bytes, Dict[str, Any]]:
+        width, height = snap64(width or self.width), snap64(height or self.height)
+        if is_conformant_png(data, width, height):
+            return data, {"passthrough": True, "size": (width, height), "input_bytes": len(data), "output_bytes": len(data)}
+        out, info = preprocess_bytes(data, width, height)
+        return out, {"passthrough": False, **info}
+
+    async def aprocess_b64(self, image_b64: str, width: Optional[int] = None, height: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+        width, height = snap64(width or self.width), snap64(height or self.height)
+        data = self.decode_b64(image_b64)
+        self._counters["bytes_in"] += len(data)
+
+        if is_conformant_png(data, width, height):
+            # zero-copy: string base64 asli dipakai ulang
+            self._counters["passthrough"] += 1
+            self._counters["bytes_out"] += len(data)
+            return image_b64, {"passthrough": True, "size": (width, height), "input_bytes": len(data), "output_bytes": len(data)}
+
+        if len(data) >= self.process_threshold_bytes and self.max_workers > 0:
+            self._counters["process_pool"] += 1
+            loop = asyncio.get_running_loop()
+            out, info = await loop.run_in_executor(self._pool(), preprocess_bytes, data, width, height)
+        else:
+            out, info = await asyncio.to_thread(preprocess_bytes, data, width, height)
+        self._counters["processed"] += 1
+        self._counters["bytes_out"] += len(out)
+        return base64.b64encode(out).decode("utf-8"), {"passthrough": False, **info}
+
+    async def aprocess_many(self, images_b64: List[str], width: Optional[int] = None, height: Optional[int] = None) -> Tuple[List[str], List[Dict[str, Any]]]:
+        with tracer.span("preprocess", images=len(images_b64)):
+            results = await asyncio.gather(*(self.aprocess_b64(b, width, height) for b in images_b64))
+        return [r[0] for r in results], [r[1] for r in results]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._counters)
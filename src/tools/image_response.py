@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+from tools.storage_codec import MEDIA_TYPES
+from tools.metrics import stage
+from tools.tracing import tracer
+
+RESPONSE_FORMATS = ("json-base64", "url", "png", "multipart")
+CHUNK_SIZE = 64 * 1024
+
+_SERIALIZE_SECONDS = stage("response_serialization")
+
+
+def wants_base64(response_format: str) -> bool:
+    """Base64 hanya dibangun kalau memang diminta, mode lain stream file dari disk."""
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"response_format harus salah satu dari {', '.join(RESPONSE_FORMATS)}",
+        )
+    return response_format == "json-base64"
+
+
+async def _multipart_stream(boundary: str, metadata: Dict[str, Any], paths: List[str]) -> AsyncIterator[bytes]:
+    yield (
+        f"--{boundary}\r\n"
+        "Content-Type: application/json\r\n"
+        'Content-Disposition: form-data; name="metadata"\r\n\r\n'
+    ).encode()
+    yield json.dumps(metadata).encode("utf-8") + b"\r\n"
+
+    for idx, path in enumerate(paths):
+        filename = os.path.basename(path)
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), 'image/png')}\r\n"
+            f'Content-Disposition: form-data; name="image_{idx}"; filename="{filename}"\r\n'
+            f"Content-Length: {os.path.getsize(path)}\r\n\r\n"
+        ).encode()
+        async with await anyio.open_file(path, "rb") as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def build_image_response(
+    response_format: str,
+    content: Dict[str, Any],
+    paths: List[str],
+    status_code: int = 200,
+):
+    """
+    Bangun response sesuai `response_format`:
+    - json-base64 / url : `content` dikirim sebagai JSON apa adanya
+    - png              : raw bytes satu gambar, di-stream langsung dari disk
+    - multipart        : part JSON metadata + satu part per gambar (multipart/form-data)
+    """
+    if response_format == "png":
+        if len(paths) != 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"response_format=png hanya untuk satu gambar ({len(paths)} dihasilkan), pakai multipart",
+            )
+        media_type = MEDIA_TYPES.get(os.path.splitext(paths[0])[1].lower(), "image/png")
+        return FileResponse(paths[0], media_type=media_type, status_code=status_code)
+
+    if response_format == "multipart":
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(
+            _multipart_stream(boundary, content, paths),
+            status_code=status_code,
+            media_type=f"multipart/form-data; boundary={boundary}",
+        )
+
+    # JSONResponse merender body di konstruktor, jadi ini waktu serialisasi (termasuk base64 besar)
+    start = time.perf_counter()
+    with tracer.span("response.serialize"):
+        response = JSONResponse(status_code=status_code, content=content)
+    _SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+    return response
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _cache_headers(path: str, stat: os.stat_result, variant: str, max_age: int) -> Dict[str, str]:
+    # file output tidak pernah ditulis ulang di tempat, jadi (path, mtime, size, variant) cukup
+    digest = hashlib.sha1(f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{variant}".encode()).hexdigest()
+    return {
+        "ETag": f'"{digest}"',
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}",
+        "Accept-Ranges": "bytes",
+    }
+
+
+async def serve_image(
+    request: Request,
+    path: str,
+    derivatives,
+    w: Optional[int] = None,
+    h: Optional[int] = None,
+    format: Optional[str] = None,
+    q: int = 80,
+    max_age: int = 86400,
+):
+    """
+    Serve gambar hasil generate dengan ETag kuat + Last-Modified.
+    If-None-Match / If-Modified-Since dijawab 304 tanpa membaca file, Range ditangani FileResponse.
+    Kalau ada ?w=&h=&format=&q= turunannya dibuat lazily lewat DerivativeCache.
+    """
+    stat = await anyio.to_thread.run_sync(os.stat, path)
+    variant = f"{w}x{h}.{format}.q{q}" if (w or h or format) else ""
+    # ETag dihitung dari file sumber, jadi 304 dijawab sebelum turunan dibuat/dibaca
+    headers = _cache_headers(path, stat, variant, max_age)
+    if _not_modified(request, headers["ETag"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if not variant:
+        media_type = MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+    fmt = format or "png"
+    derived = await derivatives.get(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, w, h, fmt, q)
+    return FileResponse(derived, media_type=derivatives.media_type(fmt), headers=headers)
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from loguru import logger
+
+
+class ImageStore:
+    """
+    Store hasil generate berbasis content-address.
+    Key = sha256 dari payload txt2img yang sudah dinormalisasi, sehingga nama file
+    stabil antar restart dan request identik (seed tetap) bisa dilayani dari disk.
+    Total ukuran dibatasi `max_bytes`, file paling lama tidak dipakai dievict duluan.
+    `on_change(old_path, new_path)` dipanggil (di luar lock) tiap file pindah path,
+    dengan new_path None kalau file dievict/hilang, supaya index luar ikut update.
+    """
+
+    # field payload yang mempengaruhi piksel hasil generate
+    KEY_FIELDS = (
+        "prompt", "negative_prompt", "seed", "subseed", "subseed_strength",
+        "sampler_name", "scheduler", "steps", "cfg_scale", "width", "height",
+        "restore_faces", "tiling", "eta", "denoising_strength",
+        "enable_hr", "hr_scale", "hr_upscaler", "hr_second_pass_steps",
+        "firstphase_width", "firstphase_height", "styles", "alwayson_scripts",
+    )
+
+    def __init__(
+        self,
+        root: str = "output",
+        max_bytes: int = 5 * 1024 ** 3,
+        suffix: str = ".png",
+        alt_suffixes: Tuple[str, ...] = (),
+        on_change: Optional[Callable[[str, Optional[str]], None]] = None,
+    ):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # suffix lain yang mungkin dipakai setelah file dikompres ulang (mis. .webp)
+        self.alt_suffixes = tuple(s for s in alt_suffixes if s != suffix)
+        self.on_change = on_change
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._suffixes: Dict[str, str] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "evicted_bytes": 0}
+        self._load()
+
+    # ---------- key ----------
+    @classmethod
+    def make_key(cls, payload: Dict[str, Any]) -> str:
+        normalized = {k: payload.get(k) for k in cls.KEY_FIELDS}
+        normalized["prompt"] = " ".join(str(normalized["prompt"] or "").split())
+        normalized["negative_prompt"] = " ".join(str(normalized["negative_prompt"] or "").split())
+        normalized["checkpoint"] = (payload.get("override_settings") or {}).get("sd_model_checkpoint", "")
+        raw = json.dumps(normalized, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / f"{key}{self._suffixes.get(key, self.suffix)}"
+
+    # ---------- index ----------
+    def _load(self):
+        """Bangun ulang index LRU dari disk, urut berdasarkan waktu akses terakhir."""
+        files = []
+        for suffix in (self.suffix, *self.alt_suffixes):
+            for path in self.root.glob(f"??/*{suffix}"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((max(st.st_atime, st.st_mtime), path.stem, st.st_size, suffix))
+        for _, key, size, suffix in sorted(files):
+            if key in self._entries:
+                # sisa relokasi storage codec yang belum sempat dihapus:
+                # file hasil codec (suffix alternatif) yang dipakai, file asli dibuang
+                (self.root / key[:2] / f"{key}{self.suffix}").unlink(missing_ok=True)
+                if suffix == self.suffix:
+                    continue
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._total_bytes += size
+            if suffix != self.suffix:
+                self._suffixes[key] = suffix
+        logger.info(f"ImageStore loaded {len(self._entries)} files ({self._total_bytes} bytes) from {self.root}")
+
+    # ---------- get / put ----------
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                self._counters["misses"] += 1
+                return None
+            path = self.path_for(key)
+            if not path.is_file():
+                self._total_bytes -= self._entries.pop(key)
+                self._suffixes.pop(key, None)
+                self._counters["misses"] += 1
+                missing = str(path.resolve())
+            else:
+                missing = None
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+        if missing is not None:
+            self._notify([(missing, None)])
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return str(path.resolve())
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self.root / key[:2] / f"{key}{self.suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        changes = []
+        with self._lock:
+            old_suffix = self._suffixes.pop(key, None)
+            if old_suffix is not None:
+                old_path = path.with_suffix(old_suffix)
+                old_path.unlink(missing_ok=True)
+                changes.append((str(old_path.resolve()), str(path.resolve())))
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+            self._total_bytes += len(data)
+            self._counters["writes"] += 1
+            changes.extend(self._evict_locked())
+        self._notify(changes)
+        return str(path.resolve())
+
+    def relocate(self, key: str, path: str, size: int):
+        """Catat ulang entry setelah file-nya ditulis ulang di luar store (mis. oleh storage codec)."""
+        suffix = pathlib.Path(path).suffix
+        with self._lock:
+            if key not in self._entries:
+                return
+            old_path = str(self.path_for(key).resolve())
+            self._total_bytes += size - self._entries[key]
+            self._entries[key] = size
+            if suffix == self.suffix:
+                self._suffixes.pop(key, None)
+            else:
+                self._suffixes[key] = suffix
+            new_path = str(self.path_for(key).resolve())
+        if new_path != old_path:
+            self._notify([(old_path, new_path)])
+
+    def _evict_locked(self) -> List[Tuple[str, Optional[str]]]:
+        removed = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._counters["evictions"] += 1
+            self._counters["evicted_bytes"] += size
+            path = self.path_for(key)
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self._suffixes.pop(key, None)
+            removed.append((str(path.resolve()), None))
+        return removed
+
+    def _notify(self, changes: List[Tuple[str, Optional[str]]]):
+        if self.on_change is None:
+            return
+        for old_path, new_path in changes:
+            try:
+                self.on_change(old_path, new_path)
+            except Exception as e:
+                logger.warning(f"ImageStore on_change failed for {old_path}: {e}")
+
+    # ---------- compaction ----------
+    def compact(self):
+        """Hapus file tmp yatim, entry yang filenya hilang, dan tegakkan budget."""
+        for tmp in self.root.glob("??/*.tmp"):
+            try:
+                if time.time() - tmp.stat().st_mtime > 60:
+                    tmp.unlink()
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            missing = [key for key in self._entries if not self.path_for(key).is_file()]
+            changes = [(str(self.path_for(key).resolve()), None) for key in missing]
+            for key in missing:
+                self._total_bytes -= self._entries.pop(key)
+                self._suffixes.pop(key, None)
+            changes.extend(self._evict_locked())
+        self._notify(changes)
+        for subdir in self.root.glob("??"):
+            if subdir.is_dir() and not any(subdir.iterdir()):
+                subdir.rmdir()
+
+    async def _compaction_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.warning(f"ImageStore compaction failed: {e}")
+
+    def start_compaction(self, interval: float = 300.0):
+        if self._compaction_task is None:
+            self._compaction_task = asyncio.create_task(self._compaction_loop(interval))
+
+    async def stop_compaction(self):
+        if self._compaction_task is not None:
+            self._compaction_task.cancel()
+            try:
+                await self._compaction_task
+            except asyncio.CancelledError:
+                pass
+            self._compaction_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "files": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
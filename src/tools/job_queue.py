@@ -0,0 +1,238 @@
+import asyncio
+import time
+import uuid
+import traceback
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+from tools.metrics import stage
+from tools.progress import ProgressHub
+from tools.tracing import tracer, log_context
+from tools import deadline
+
+_QUEUE_WAIT = stage("queue_wait")
+
+
+class QueueFullError(Exception):
+    """Queue penuh; `retry_after` = estimasi detik sampai ada slot kosong."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue penuh, coba lagi dalam {retry_after} detik")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, payload: Any):
+        self.id = f"job_{uuid.uuid4().hex}"
+        self.payload = payload
+        self.status = "queued"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        # span request yang men-submit; worker jalan di context lain jadi parent di-pass manual
+        self.trace_parent = tracer.current()
+        self.deadline = deadline.current()
+
+    def to_dict(self, position: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+        if position is not None:
+            data["queue_position"] = position
+        return data
+
+
+class JobQueue:
+    """
+    Queue job in-process dengan kapasitas terbatas dan sejumlah worker tetap.
+    State job disimpan terpisah dari koneksi HTTP, jadi client boleh putus
+    lalu polling lagi; hasil disimpan selama `result_ttl` detik, maksimal
+    `max_finished` job selesai (yang paling lama tidak dibaca dibuang duluan).
+    Hasil job sebaiknya hanya referensi (path/url/generation_id), bukan base64.
+    Kalau `progress` diisi, tiap job punya ProgressChannel untuk streaming event.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        max_size: int = 64,
+        workers: int = 4,
+        result_ttl: float = 3600.0,
+        name: str = "jobs",
+        progress: Optional[ProgressHub] = None,
+        max_finished: int = 1000,
+    ):
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.name = name
+        self.progress = progress
+        self.max_finished = max(1, max_finished)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._jobs: Dict[str, Job] = {}
+        # job selesai urut LRU (get() memindah ke belakang), untuk batas max_finished
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self.evicted = 0
+        self._pending: "deque[str]" = deque()
+        self._tasks = []
+        self._durations: "deque[float]" = deque(maxlen=50)
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info(f"JobQueue '{self.name}' started: {self.workers} workers, max {self.max_size} queued")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- submit / lookup ----------
+    def estimate_wait(self) -> int:
+        avg = sum(self._durations) / len(self._durations) if self._durations else 30.0
+        return max(1, int(avg * (self._queue.qsize() + 1) / max(self.workers, 1)))
+
+    def submit(self, payload: Any) -> Job:
+        job = Job(payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(self.estimate_wait())
+        self._jobs[job.id] = job
+        self._pending.append(job.id)
+        if self.progress is not None:
+            self.progress.open(job.id)
+            self.progress.publish(job.id, "queued", position=len(self._pending) - 1)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        if job_id in self._finished:
+            self._finished.move_to_end(job_id)
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        if job.status != "queued":
+            return None
+        try:
+            return self._pending.index(job.id)
+        except ValueError:
+            return None
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Long-poll: tunggu job selesai maksimal `timeout` detik, job tetap jalan kalau client putus."""
+        if timeout > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "jobs": counts,
+            "max_finished": self.max_finished,
+            "evicted": self.evicted,
+        }
+
+    # ---------- workers ----------
+    async def _worker(self, idx: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                self._pending.remove(job.id)
+            except ValueError:
+                pass
+            job.status = "running"
+            job.started_at = time.time()
+            _QUEUE_WAIT.observe(job.started_at - job.created_at)
+            tracer.record("job.queue_wait", job.created_at, job.started_at, parent=job.trace_parent, queue=self.name)
+            channel = self._start_progress(job)
+            try:
+                # job yang deadline-nya sudah habis selama antre tidak perlu memakai GPU
+                if job.deadline is not None and job.deadline.expired:
+                    raise deadline.DeadlineExceeded("queue_wait")
+                # worker tidak mewarisi context request; trace id di-bind ulang untuk log (juga trace yang tidak di-sample)
+                job_log = log_context(trace_id=job.trace_parent.trace_id if job.trace_parent is not None else None)
+                with tracer.span("job.run", parent=job.trace_parent, job_id=job.id), job_log, deadline.scope(job.deadline):
+                    if channel is not None:
+                        with self.progress.bind(channel):
+                            job.result = await self.handler(job.payload)
+                    else:
+                        job.result = await self.handler(job.payload)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "error"
+                job.error = "cancelled"
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {traceback.format_exc()}")
+                job.status = "error"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                # payload (mis. init image base64 img2img) tidak dibutuhkan lagi setelah job selesai
+                job.payload = None
+                self._durations.append(job.finished_at - job.started_at)
+                self._mark_finished(job.id)
+                job.done.set()
+                self._queue.task_done()
+                if channel is not None:
+                    if job.status == "done":
+                        self.progress.publish(job.id, "done", result=job.result)
+                    else:
+                        self.progress.publish(job.id, "error", error=job.error)
+
+    def _mark_finished(self, job_id: str):
+        self._finished[job_id] = None
+        while len(self._finished) > self.max_finished:
+            oldest, _ = self._finished.popitem(last=False)
+            self.evicted += 1
+            self._discard(oldest)
+
+    def _discard(self, job_id: str):
+        self._jobs.pop(job_id, None)
+        self._finished.pop(job_id, None)
+        if self.progress is not None:
+            self.progress.discard(job_id)
+
+    def _start_progress(self, job: Job):
+        """Kirim event started untuk job ini dan posisi baru untuk job yang masih antri."""
+        if self.progress is None:
+            return None
+        self.progress.publish(job.id, "started")
+        for position, job_id in enumerate(self._pending):
+            self.progress.publish(job_id, "queued", position=position)
+        return self.progress.get(job.id)
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(min(self.result_ttl, 60.0))
+            now = time.time()
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.result_ttl
+            ]
+            for job_id in expired:
+                self._discard(job_id)
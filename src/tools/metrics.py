@@ -0,0 +1,299 @@
+import math
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# detik; cukup lebar untuk decode base64 (ms) sampai generate SD (puluhan detik)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (nama, tipe, help, [(labels, value), ...]) dari collector yang dibaca saat scrape
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+
+class Histogram:
+    """
+    Histogram dengan bucket tetap. Array count dialokasikan sekali saat dibuat,
+    observe() hanya bisect + increment (tanpa alokasi di hot path); count
+    disimpan per bucket dan baru dijumlah kumulatif saat render.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        idx = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class MetricFamily:
+    """Satu metric + semua kombinasi label-nya. Child dibuat sekali lalu di-cache."""
+
+    _TYPES = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+    def __init__(self, name: str, kind: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        return Histogram(self.buckets) if self.kind == "histogram" else self._TYPES[self.kind]()
+
+    def labels(self, *values: str):
+        """Child untuk kombinasi label ini. Simpan hasilnya di call site supaya hot path tidak lookup ulang."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} butuh label {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new())
+        return child
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            if self.kind != "histogram":
+                yield f"{self.name}{_format_labels(labels)} {_format_value(child.value)}"
+                continue
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip((*child.bounds, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Registry metric process-wide, dirender dalam format teks Prometheus di /metrics.
+    Metric yang dicatat di hot path (histogram stage, counter token) di-update
+    langsung; angka yang sudah ada di stats() komponen lain (queue depth, health
+    backend, hit ratio cache) dibaca lewat collector hanya saat scrape.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _family(self, name: str, kind: str, help: str, labelnames: Sequence[str], **kwargs) -> MetricFamily:
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(name, kind, help, labelnames, **kwargs)
+            elif family.kind != kind or family.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} sudah terdaftar dengan tipe/label berbeda")
+        return family
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, "counter", help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, "gauge", help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._family(name, "histogram", help, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in list(self._families.values()):
+            lines.extend(family.render())
+        for collector in list(self._collectors):
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# ---------- metric bersama ----------
+STAGE_SECONDS = metrics.histogram(
+    "photo_stage_duration_seconds",
+    "Durasi tiap stage pipeline (llm_expansion, queue_wait, backend_wait, sd_generation, base64_decode, disk_write, response_serialization)",
+    ("stage",),
+)
+LLM_REQUESTS = metrics.counter("photo_llm_requests_total", "Call chat completion per model dan status", ("model", "status"))
+LLM_TOKENS = metrics.counter("photo_llm_tokens_total", "Token LLM per model, kind = input/output", ("model", "kind"))
+LLM_IN_FLIGHT = metrics.gauge("photo_llm_requests_in_flight", "Call LLM yang sedang berjalan").labels()
+LLM_RETRIES = metrics.counter("photo_llm_retries_total", "Retry call LLM per model dan alasan", ("model", "reason"))
+LLM_HEDGES = metrics.counter("photo_llm_hedges_total", "Hedged request LLM, outcome = fired/won", ("model", "outcome"))
+HTTP_IN_FLIGHT = metrics.gauge("photo_http_requests_in_flight", "Request HTTP yang sedang diproses", ("service",))
+SD_BATCH_SIZE = metrics.histogram(
+    "photo_sd_batch_size", "Jumlah request txt2img per call A1111 dari BatchDispatcher", buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+).labels()
+SD_BATCH_FILL = metrics.histogram(
+    "photo_sd_batch_fill_ratio", "Ukuran batch / max_batch_size per flush BatchDispatcher",
+    buckets=(0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0),
+).labels()
+
+
+def stage(name: str) -> Histogram:
+    """Histogram satu stage; panggil sekali di level modul lalu observe() di hot path."""
+    return STAGE_SECONDS.labels(name)
+
+
+# ---------- ASGI ----------
+class InFlightMiddleware:
+    """
+    Gauge request HTTP yang sedang diproses, termasuk selama body streaming
+    dikirim dan BackgroundTask response berjalan. Path scrape tidak dihitung.
+    """
+
+    def __init__(self, app, gauge: Gauge, exclude: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.gauge = gauge
+        self.exclude = tuple(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        self.gauge.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.gauge.dec()
+
+
+# ---------- collector ----------
+def backend_pool_collector(pool, service: str) -> Callable[[], Iterable[Family]]:
+    def collect():
+        labels = [{"service": service, "backend": b.url} for b in pool.backends]
+        yield ("photo_sd_backend_up", "gauge", "1 kalau backend SD sehat",
+               [(l, 1.0 if b.healthy else 0.0) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_requests_in_flight", "gauge", "Request SD yang sedang dipegang backend",
+               [(l, b.outstanding) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_backend_failures_total", "counter", "Request SD yang gagal per backend",
+               [(l, b.total_failures) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_checkpoint_swaps_total", "counter", "Ganti checkpoint per backend",
+               [(l, b.swaps) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_checkpoint_swap_seconds_total", "counter", "Total detik ganti checkpoint per backend",
+               [(l, b.swap_seconds) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_interrupts_total", "counter", "Interrupt A1111 untuk request yang dibatalkan",
+               [(l, b.interrupts) for l, b in zip(labels, pool.backends)])
+        yield ("photo_sd_wasted_gpu_seconds_total", "counter", "GPU-seconds request yang dibatalkan sebelum selesai",
+               [(l, b.wasted_gpu_seconds) for l, b in zip(labels, pool.backends)])
+    return collect
+
+
+def job_queue_collector(get_queue: Callable[[], Any]) -> Callable[[], Iterable[Family]]:
+    """`get_queue` dipanggil saat scrape karena JobQueue baru dibuat di startup."""
+    def collect():
+        queue = get_queue()
+        if queue is None:
+            return
+        stats = queue.stats()
+        yield ("photo_job_queue_depth", "gauge", "Job yang menunggu worker",
+               [({"queue": queue.name}, stats["queue_depth"])])
+        yield ("photo_job_queue_jobs", "gauge", "Job yang masih disimpan per status",
+               [({"queue": queue.name, "status": status}, count) for status, count in stats["jobs"].items()])
+    return collect
+
+
+def circuit_breaker_collector(breakers: Sequence[Any]) -> Callable[[], Iterable[Family]]:
+    """State dan penolakan per CircuitBreaker (0 = closed, 1 = half_open, 2 = open)."""
+    def collect():
+        stats = [b.stats() for b in breakers]
+        yield ("photo_circuit_breaker_state", "gauge", "State circuit breaker: 0 closed, 1 half_open, 2 open",
+               [({"breaker": s["name"]}, s["state_value"]) for s in stats])
+        yield ("photo_circuit_breaker_rejected_total", "counter", "Call yang ditolak karena breaker open",
+               [({"breaker": s["name"]}, s["rejected"]) for s in stats])
+        yield ("photo_circuit_breaker_opened_total", "counter", "Berapa kali breaker berpindah ke open",
+               [({"breaker": s["name"]}, s["opened"]) for s in stats])
+    return collect
+
+
+def hits_misses(*stats: Dict[str, Any]) -> Tuple[float, float]:
+    """Total (hits, misses) dari satu atau beberapa dict stats() cache (ImageStore, PromptCache)."""
+    hits = sum(s.get("hits", s.get("memory_hits", 0) + s.get("disk_hits", 0)) for s in stats)
+    return hits, sum(s.get("misses", 0) for s in stats)
+
+
+def cache_collector(caches: Dict[str, Callable[[], Optional[Tuple[float, float]]]]) -> Callable[[], Iterable[Family]]:
+    """`caches` = nama -> fungsi yang mengembalikan (hits, misses) atau None kalau cache mati."""
+    def collect():
+        values = [(name, fn()) for name, fn in caches.items()]
+        values = [(name, v) for name, v in values if v is not None]
+        yield ("photo_cache_hits_total", "counter", "Cache hit", [({"cache": n}, h) for n, (h, _) in values])
+        yield ("photo_cache_misses_total", "counter", "Cache miss", [({"cache": n}, m) for n, (_, m) in values])
+        yield ("photo_cache_hit_ratio", "gauge", "hits / (hits + misses) sejak start",
+               [({"cache": n}, h / (h + m) if h + m else 0.0) for n, (h, m) in values])
+    return collect
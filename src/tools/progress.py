@@ -0,0 +1,289 @@
+import asyncio
+import base64
+import contextvars
+import json
+import time
+from contextlib import asynccontextmanager, contextmanager
+from io import BytesIO
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from loguru import logger
+from PIL import Image
+
+PROGRESS_PATH = "/sdapi/v1/progress"
+TERMINAL_EVENTS = ("done", "error")
+
+# channel job yang sedang dikerjakan task ini (lebih dari satu kalau request di-batch)
+_current_channels: contextvars.ContextVar[Tuple["ProgressChannel", ...]] = contextvars.ContextVar(
+    "progress_channels", default=()
+)
+
+
+def render_preview(image_b64: str, size: int) -> str:
+    """Downscale live preview A1111 ke thumbnail JPEG kecil (base64)."""
+    if "," in image_b64[:64]:
+        image_b64 = image_b64.split(",", 1)[1]
+    with Image.open(BytesIO(base64.b64decode(image_b64))) as img:
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.BILINEAR)
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=70)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+class ProgressChannel:
+    """
+    Event satu job. Event stage (queued, prompt_expanded, done, ...) disimpan
+    sebagai history, sedangkan event progress hanya disimpan yang terakhir,
+    sehingga subscriber yang datang belakangan tetap dapat state lengkap.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.history: List[Dict[str, Any]] = []
+        self.last_progress: Optional[Dict[str, Any]] = None
+        self.closed_at: Optional[float] = None
+        self._subscribers: Dict[asyncio.Queue, bool] = {}
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_at is not None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def wants_preview(self) -> bool:
+        return any(self._subscribers.values())
+
+    def publish(self, event: Dict[str, Any]):
+        if self.closed:
+            return
+        event = {"type": event["type"], "job_id": self.job_id, "ts": time.time(), **event}
+        if event["type"] == "progress":
+            self.last_progress = event
+        else:
+            self.history.append(event)
+        if event["type"] in TERMINAL_EVENTS:
+            self.closed_at = event["ts"]
+        for queue in self._subscribers:
+            # subscriber lambat cukup dapat progress terbaru, event stage tidak pernah dibuang
+            if event["type"] == "progress" and queue.qsize() > 8:
+                continue
+            queue.put_nowait(event)
+
+    async def subscribe(self, preview: bool = False, heartbeat: float = 15.0) -> AsyncIterator[Dict[str, Any]]:
+        """Replay history + progress terakhir, lalu event live sampai job selesai."""
+        queue: asyncio.Queue = asyncio.Queue()
+        backlog = list(self.history)
+        if self.last_progress is not None and not self.closed:
+            backlog.append(self.last_progress)
+        if not self.closed:
+            self._subscribers[queue] = preview
+        try:
+            for event in backlog:
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield {"type": "ping", "job_id": self.job_id, "ts": time.time()}
+                    continue
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            self._subscribers.pop(queue, None)
+
+
+class ProgressHub:
+    """
+    Registry ProgressChannel per job + poller `/sdapi/v1/progress`.
+
+    A1111 melaporkan progress per backend, jadi poller dibuat satu per backend
+    dan hasil tiap poll dibagikan ke semua job yang sedang jalan di backend itu.
+    Poll hanya dilakukan kalau ada subscriber, dan preview hanya diminta
+    (lalu di-downscale sekali) kalau ada subscriber yang memintanya.
+    """
+
+    def __init__(self, poll_interval: float = 1.0, preview_size: int = 128, timeout: float = 5.0):
+        self.configure(poll_interval=poll_interval, preview_size=preview_size, timeout=timeout)
+        self.channels: Dict[str, ProgressChannel] = {}
+        self._watchers: Dict[str, Set[ProgressChannel]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._counters = {"polls": 0, "poll_errors": 0, "previews": 0, "events": 0}
+
+    def configure(
+        self,
+        poll_interval: Optional[float] = None,
+        preview_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+        if preview_size is not None:
+            self.preview_size = preview_size
+        if timeout is not None:
+            self.timeout = timeout
+
+    # ---------- channel ----------
+    def open(self, job_id: str) -> ProgressChannel:
+        channel = self.channels.get(job_id)
+        if channel is None:
+            channel = self.channels[job_id] = ProgressChannel(job_id)
+        return channel
+
+    def get(self, job_id: str) -> Optional[ProgressChannel]:
+        return self.channels.get(job_id)
+
+    def discard(self, job_id: str):
+        self.channels.pop(job_id, None)
+
+    def publish(self, job_id: str, event_type: str, **data):
+        channel = self.channels.get(job_id)
+        if channel is not None:
+            self._counters["events"] += 1
+            channel.publish({"type": event_type, **data})
+
+    # ---------- context ----------
+    @staticmethod
+    def current() -> Tuple[ProgressChannel, ...]:
+        return _current_channels.get()
+
+    @contextmanager
+    def bind(self, *channels: ProgressChannel):
+        """Tandai channel job yang sedang dikerjakan task ini (dibaca emit/track)."""
+        token = _current_channels.set(tuple(c for c in channels if c is not None))
+        try:
+            yield
+        finally:
+            _current_channels.reset(token)
+
+    def emit(self, event_type: str, **data):
+        """Publish event stage ke job yang sedang dikerjakan; no-op di luar job."""
+        for channel in _current_channels.get():
+            self._counters["events"] += 1
+            channel.publish({"type": event_type, **data})
+
+    # ---------- polling ----------
+    @asynccontextmanager
+    async def track(self, backend_url: str):
+        """Selama blok ini jalan, progress backend diteruskan ke job yang sedang aktif."""
+        channels = _current_channels.get()
+        if not channels:
+            yield
+            return
+        watchers = self._watchers.setdefault(backend_url, set())
+        watchers.update(channels)
+        self.emit("generating", backend=backend_url)
+        if backend_url not in self._pollers:
+            self._pollers[backend_url] = asyncio.create_task(self._poll_loop(backend_url))
+        try:
+            yield
+        finally:
+            watchers.difference_update(channels)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def _poll_loop(self, backend_url: str):
+        last_preview = None
+        try:
+            while self._watchers.get(backend_url):
+                watchers = [c for c in self._watchers[backend_url] if c.subscribers]
+                if watchers:
+                    preview = any(c.wants_preview for c in watchers)
+                    event = await self._poll(backend_url, preview, last_preview)
+                    if event is not None:
+                        last_preview = event.pop("_raw_preview", last_preview)
+                        for channel in watchers:
+                            channel.publish(event)
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            self._pollers.pop(backend_url, None)
+            self._watchers.pop(backend_url, None)
+
+    async def _poll(self, backend_url: str, preview: bool, last_preview: Optional[str]) -> Optional[Dict[str, Any]]:
+        self._counters["polls"] += 1
+        try:
+            r = await self._http().get(
+                f"{backend_url}{PROGRESS_PATH}",
+                params={"skip_current_image": "false" if preview else "true"},
+            )
+            r.raise_for_status()
+            data = r.json()
+        except (httpx.HTTPError, ValueError) as e:
+            self._counters["poll_errors"] += 1
+            logger.debug(f"Progress poll {backend_url} gagal: {e}")
+            return None
+
+        state = data.get("state") or {}
+        event = {
+            "type": "progress",
+            "progress": round(float(data.get("progress") or 0.0), 4),
+            "eta": data.get("eta_relative"),
+            "step": state.get("sampling_step"),
+            "steps": state.get("sampling_steps"),
+        }
+        current_image = data.get("current_image")
+        if preview and current_image and current_image != last_preview:
+            try:
+                event["preview"] = await asyncio.to_thread(render_preview, current_image, self.preview_size)
+                event["_raw_preview"] = current_image
+                self._counters["previews"] += 1
+            except Exception as e:
+                logger.debug(f"Preview decode gagal: {e}")
+        return event
+
+    async def aclose(self):
+        for task in list(self._pollers.values()):
+            task.cancel()
+        await asyncio.gather(*self._pollers.values(), return_exceptions=True)
+        self._pollers.clear()
+        self._watchers.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "channels": len(self.channels),
+            "subscribers": sum(c.subscribers for c in self.channels.values()),
+            "pollers": len(self._pollers),
+            "poll_interval": self.poll_interval,
+        }
+
+
+progress_hub = ProgressHub()
+
+
+# ---------- transport ----------
+EventView = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+async def sse_stream(channel: ProgressChannel, preview: bool = False, view: Optional[EventView] = None) -> AsyncIterator[bytes]:
+    """Format event channel sebagai Server-Sent Events."""
+    async for event in channel.subscribe(preview=preview):
+        if event["type"] == "ping":
+            yield b": ping\n\n"
+            continue
+        if view is not None:
+            event = view(event)
+        yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n".encode("utf-8")
+
+
+async def websocket_stream(websocket, channel: ProgressChannel, preview: bool = False, view: Optional[EventView] = None):
+    """Kirim event channel lewat WebSocket (sudah di-accept) lalu tutup setelah event terakhir."""
+    async for event in channel.subscribe(preview=preview):
+        if view is not None and event["type"] != "ping":
+            event = view(event)
+        await websocket.send_text(json.dumps(event, default=str))
+    await websocket.close()
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from PIL import Image
+
+# codec -> (ekstensi, format Pillow, opsi save)
+CODECS = {
+    "none": None,
+    "png": (".png", "PNG", {"optimize": True}),
+    "webp-lossless": (".webp", "WEBP", {"lossless": True, "method": 4}),
+    "webp": (".webp", "WEBP", {"method": 4}),
+    "jpeg": (".jpg", "JPEG", {"optimize": True, "progressive": True}),
+}
+LOSSY_CODECS = ("webp", "jpeg")
+MEDIA_TYPES = {".png": "image/png", ".webp": "image/webp", ".jpg": "image/jpeg"}
+
+
+def compress_file(path: str, codec: str, quality: int = 90) -> Dict[str, Any]:
+    """
+    Encode ulang satu file output dengan codec penyimpanan. Chunk teks PNG
+    (`parameters` dari A1111) tidak ikut ditulis; isinya dikembalikan sebagai
+    `infotext` untuk disimpan di generation index. File asli tidak dihapus di
+    sini (`replaced`), pemanggil yang menghapusnya setelah store direlokasi.
+    Module-level supaya bisa dijalankan di process pool.
+    """
+    ext, pil_format, options = CODECS[codec]
+    start = time.time()
+    original_bytes = os.path.getsize(path)
+
+    with Image.open(path) as img:
+        img.load()
+        infotext = img.info.get("parameters", "")
+        source_format = img.format or "PNG"
+        encoded = img
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            encoded = img.convert("RGB")
+        buf = BytesIO()
+        save_options = dict(options)
+        if codec in LOSSY_CODECS:
+            save_options["quality"] = quality
+        encoded.save(buf, format=pil_format, **save_options)
+        data = buf.getvalue()
+        new_path, applied = os.path.splitext(path)[0] + ext, codec
+        if len(data) >= original_bytes:
+            # hasil codec tidak lebih kecil: format asli dipertahankan, tapi chunk
+            # parameters tetap dibuang (tersimpan di index, bukan di file)
+            new_path, data, applied = path, None, "none"
+            if infotext:
+                applied = "strip"
+                buf = BytesIO()
+                img.save(buf, format=source_format, **({"optimize": True} if source_format == "PNG" else {}))
+                data = buf.getvalue()
+
+    if data is not None:
+        tmp = f"{new_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, new_path)
+
+    stored_bytes = len(data) if data is not None else original_bytes
+    return {
+        "codec": applied,
+        "path": new_path,
+        "replaced": path if new_path != path else None,
+        "original_bytes": original_bytes,
+        "stored_bytes": stored_bytes,
+        "saved_bytes": original_bytes - stored_bytes,
+        "sha256": hashlib.sha256(data).hexdigest() if data is not None else None,
+        "infotext": infotext,
+        "seconds": time.time() - start,
+    }
+
+
+def read_png(path: str) -> bytes:
+    """
+    Isi file sebagai PNG. File yang sudah dipindah storage codec ke webp/jpeg
+    di-decode lalu di-encode ulang, karena field `base64` di response selalu PNG.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if os.path.splitext(path)[1].lower() == ".png":
+        return data
+    with Image.open(BytesIO(data)) as img:
+        buf = BytesIO()
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class StorageCodec:
+    """
+    Tahap kompresi output setelah response terkirim: file di-encode ulang di
+    background process pool dengan codec yang dikonfigurasi (png optimize,
+    webp lossless, atau webp/jpeg dengan batas kualitas). File lama yang diganti
+    ekstensi baru dihapus `unlink_delay` detik setelah `retire()`, supaya response
+    yang sedang men-stream path lama tidak gagal.
+    """
+
+    def __init__(self, codec: str = "png", quality: int = 90, max_workers: int = 1, unlink_delay: float = 30.0):
+        if codec not in CODECS:
+            raise ValueError(f"storage codec harus salah satu dari {', '.join(CODECS)}")
+        self.codec = codec
+        self.quality = quality
+        self.max_workers = max_workers
+        self.unlink_delay = unlink_delay
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._retired: Dict[str, asyncio.TimerHandle] = {}
+        self._counters = {"files": 0, "skipped": 0, "failed": 0, "original_bytes": 0, "stored_bytes": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return CODECS[self.codec] is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for path, handle in list(self._retired.items()):
+            handle.cancel()
+            self._unlink(path)
+
+    def retire(self, result: Dict[str, Any]):
+        """
+        Jadwalkan penghapusan file asli (`replaced`) setelah path baru dicatat di
+        store/index, sehingga pembaca yang sudah memegang path lama masih sempat selesai.
+        """
+        path = result.get("replaced")
+        if not path or path in self._retired:
+            return
+        self._retired[path] = asyncio.get_running_loop().call_later(self.unlink_delay, self._unlink, path)
+
+    def _unlink(self, path: str):
+        self._retired.pop(path, None)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def compress(self, path: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled or not os.path.isfile(path):
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._pool(), compress_file, path, self.codec, self.quality)
+        except Exception as e:
+            self._counters["failed"] += 1
+            logger.warning(f"Storage codec gagal untuk {path}: {e}")
+            return None
+
+        self._counters["files"] += 1
+        if result["codec"] == "none":
+            self._counters["skipped"] += 1
+        self._counters["original_bytes"] += result["original_bytes"]
+        self._counters["stored_bytes"] += result["stored_bytes"]
+        logger.info(
+            f"Stored {os.path.basename(result['path'])} as {result['codec']}: "
+            f"{result['original_bytes']} -> {result['stored_bytes']} bytes (saved {result['saved_bytes']})"
+        )
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self._counters)
+        counters["saved_bytes"] = counters["original_bytes"] - counters["stored_bytes"]
+        counters["avg_saved_bytes"] = counters["saved_bytes"] / counters["files"] if counters["files"] else 0.0
+        return {"codec": self.codec, "quality": self.quality, "pending_unlinks": len(self._retired), **counters}
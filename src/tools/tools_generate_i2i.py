@@ -1,21 +1,83 @@
-import base64, json, requests, sys, os, time
-from PIL import Image
-from io import BytesIO
+import asyncio
+import base64, hashlib, json, requests, sys, os, time, uuid
+from datetime import datetime
+import httpx
 from typing import List, Dict, Any, Optional
 
+path_this = os.path.dirname(os.path.abspath(__file__))
+path_root = os.path.dirname(path_this)
+sys.path.extend([path_root, path_this])
+
+from tools.backend_pool import BackendPool
+from tools.generation_index import GenerationIndex
+from tools.image_preprocess import ImagePreprocessor
+from tools.progress import progress_hub
+from tools.metrics import stage
+from tools.tracing import tracer, KIND_CLIENT, log_context
+from tools import deadline
+
+_SD_SECONDS = stage("sd_generation")
+_DECODE_SECONDS = stage("base64_decode")
+_WRITE_SECONDS = stage("disk_write")
+
 
 class SDImg2Img:
-    ENDPOINT = "http://172.16.100.249:7861/sdapi/v1/img2img"
+    DEFAULT_BACKEND = "http://172.16.100.249:7861"
+    PATH = "/sdapi/v1/img2img"
+    MAX_CONNECTIONS = 8
+
+    # shared antar instance: satu instance dibuat per request, koneksi tetap dipakai ulang
+    _session: Optional[requests.Session] = None
+    _async_client: Optional[httpx.AsyncClient] = None
+    pool: BackendPool = BackendPool([DEFAULT_BACKEND], probe_interval=0)
+    index: Optional[GenerationIndex] = None
+
+    @classmethod
+    def configure_pool(cls, pool: BackendPool):
+        cls.pool = pool
+        cls.MAX_CONNECTIONS = max(cls.MAX_CONNECTIONS, pool.total_capacity)
+
+    @classmethod
+    def configure_index(cls, index: GenerationIndex):
+        cls.index = index
+
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        if cls._session is None:
+            cls._session = requests.Session()
+        return cls._session
+
+    @classmethod
+    def _get_async_client(cls) -> httpx.AsyncClient:
+        if cls._async_client is None:
+            cls._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=cls.MAX_CONNECTIONS,
+                    max_keepalive_connections=cls.MAX_CONNECTIONS,
+                ),
+            )
+        return cls._async_client
+
+    @classmethod
+    async def aclose(cls):
+        if cls._async_client is not None:
+            await cls._async_client.aclose()
+            cls._async_client = None
+        if cls._session is not None:
+            cls._session.close()
+            cls._session = None
 
     # ---------- helper baca gambar -> base64 ----------
     @staticmethod
-    def file_to_base64(path: str) -> str:
-        """Mengambil file apapun, konversi ke PNG lalu base64 string."""
-        with Image.open(path) as img:
-            img = img.convert("RGBA") if img.mode == "RGBA" else img.convert("RGB")
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            return base64.b64encode(buf.getvalue()).decode("utf-8")
+    def file_to_base64(path: str, width: int = 512, height: int = 512) -> str:
+        """
+        Mengambil file apapun, konversi ke PNG ukuran target lalu base64 string.
+        PNG yang sudah sesuai target dikirim apa adanya tanpa decode ulang.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        data, _ = ImagePreprocessor(width, height).process_bytes(data)
+        return base64.b64encode(data).decode("utf-8")
 
     # ---------- init ----------
     def __init__(
@@ -29,11 +91,13 @@ class SDImg2Img:
         denoising_strength: float = 0.75,
         sampler_name: str = "DPM++ 2M Karras",
         output_dir: str = "result",
+        session_id: Optional[str] = None,
         **kw
     ):
         if not images_b64:
             raise ValueError("images_b64 tidak boleh kosong")
 
+        self.session_id = session_id or f"session_{uuid.uuid4().hex[:8]}"
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
 
@@ -53,44 +117,105 @@ class SDImg2Img:
 
     # ---------- call ----------
     def generate(self, timeout: int = 300) -> Dict[str, Any]:
-        r = requests.post(
-            self.ENDPOINT,
-            json=self.payload,
-            timeout=timeout,
-        )
+        backend = self.pool.choose()
+        start = time.time()
+        try:
+            with tracer.span("sd.img2img", kind=KIND_CLIENT, backend=backend.url, session_id=self.session_id):
+                r = self._get_session().post(
+                    f"{backend.url}{self.PATH}",
+                    json=self.payload,
+                    timeout=timeout,
+                )
+        except requests.RequestException:
+            self.pool.report_failure(backend)
+            raise
         if not r.ok:
+            if r.status_code >= 500:
+                self.pool.report_failure(backend)
             try:
                 detail = r.json()
             except Exception:
                 detail = r.text
             raise RuntimeError(f"HTTP {r.status_code}: {detail}")
+        _SD_SECONDS.observe(time.time() - start)
         return r.json()
 
-    def generate_and_save(self, timeout: int = 300) -> List[Dict[str, Any]]:
+    async def agenerate(self, timeout: int = 300) -> Dict[str, Any]:
+        """`timeout` dipotong deadline request aktif; kalau di-cancel, backend di-interrupt."""
+        async with deadline.bounded("sd_generation"):
+            with tracer.span("sd.img2img", kind=KIND_CLIENT, session_id=self.session_id) as span:
+                async with self.pool.acquire() as backend, progress_hub.track(backend.url):
+                    span.set("backend", backend.url)
+                    start = time.time()
+                    async with self.pool.interruptible(backend):
+                        r = await self._get_async_client().post(
+                            f"{backend.url}{self.PATH}",
+                            json=self.payload,
+                            timeout=deadline.timeout(timeout),
+                        )
+                if not r.is_success:
+                    if r.status_code >= 500:
+                        self.pool.report_failure(backend)
+                    try:
+                        detail = r.json()
+                    except Exception:
+                        detail = r.text
+                    raise RuntimeError(f"HTTP {r.status_code}: {detail}")
+        _SD_SECONDS.observe(time.time() - start)
+        return r.json()
+
+    def generate_and_save(self, timeout: int = 300, include_base64: bool = True) -> List[Dict[str, Any]]:
         start_time = time.time()
         resp = self.generate(timeout=timeout)
         elapsed_time = time.time() - start_time
+        return self._save_images(resp, elapsed_time, include_base64)
+
+    async def agenerate_and_save(self, timeout: int = 300, include_base64: bool = True) -> List[Dict[str, Any]]:
+        with log_context(session_id=self.session_id):
+            start_time = time.time()
+            resp = await self.agenerate(timeout=timeout)
+            elapsed_time = time.time() - start_time
+            return await asyncio.to_thread(self._save_images, resp, elapsed_time, include_base64)
 
+    def _save_images(self, resp: Dict[str, Any], elapsed_time: float, include_base64: bool = True) -> List[Dict[str, Any]]:
         images = resp.get("images", [])
         metadata = []
+        # nama file unik per request supaya request paralel tidak saling timpa
+        prefix = f"img2img_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        params = {k: v for k, v in self.payload.items() if k != "init_images"}
 
         for idx, im_b64 in enumerate(images):
-            filename = f"img2img_{idx}.png"
+            filename = f"{prefix}_{idx}.png"
             path_file = os.path.join(self.output_dir, filename)
 
-            with open(path_file, "wb") as f:
-                f.write(base64.b64decode(im_b64))
+            t0 = time.perf_counter()
+            with tracer.span("image.decode"):
+                png_bytes = base64.b64decode(im_b64)
+            t1 = time.perf_counter()
+            with tracer.span("image.write", bytes=len(png_bytes)), open(path_file, "wb") as f:
+                f.write(png_bytes)
+            _DECODE_SECONDS.observe(t1 - t0)
+            _WRITE_SECONDS.observe(time.perf_counter() - t1)
 
-            metadata.append({
-                "img_base64": im_b64,
+            item = {
                 "path_file": path_file,
                 "elapsed_time": elapsed_time
-            })
-
-        # Simpan metadata ke JSON
-        metadata_path = os.path.join(self.output_dir, "metadata.json")
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=2)
+            }
+            if self.index is not None:
+                item["id"] = self.index.record(
+                    "img2img",
+                    path_file,
+                    session_id=self.session_id,
+                    prompt=self.payload.get("prompt", ""),
+                    negative_prompt=self.payload.get("negative_prompt", ""),
+                    sha256=hashlib.sha256(png_bytes).hexdigest(),
+                    bytes=len(png_bytes),
+                    params=params,
+                    timings={"generate": elapsed_time},
+                )
+            if include_base64:
+                item["img_base64"] = im_b64
+            metadata.append(item)
 
         return metadata
 
@@ -116,4 +241,4 @@ if __name__ == "__main__":
     )
 
     metadata = sd.generate_and_save()
-    print("Selesai, cek result/img2img_*.png dan result/metadata.json")
\ No newline at end of file
+    print("Selesai, cek", ", ".join(item["path_file"] for item in metadata))
\ No newline at end of file
@@ -1,10 +1,34 @@
 #!/usr/bin/env python3
+import asyncio
 import base64
+import hashlib
 import json
-import pathlib
-from typing import Dict, Any
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, List, Optional
 import srsly
 import requests
+import httpx
+from loguru import logger
+
+path_this = os.path.dirname(os.path.abspath(__file__))
+path_root = os.path.dirname(path_this)
+sys.path.extend([path_root, path_this])
+
+from tools.image_store import ImageStore
+from tools.storage_codec import read_png
+from tools.backend_pool import BackendPool
+from tools.batch_dispatcher import BatchDispatcher
+from tools.progress import progress_hub
+from tools.metrics import stage
+from tools.tracing import tracer, KIND_CLIENT
+from tools import deadline
+
+_SD_SECONDS = stage("sd_generation")
+_DECODE_SECONDS = stage("base64_decode")
+_WRITE_SECONDS = stage("disk_write")
 
 class SDClientT2I:
     """
@@ -12,20 +36,63 @@ class SDClientT2I:
     Checkpoint hard-coded ke realisticUniversalBase_100.safetensors
     """
 
-    def __init__(self, base_url: str = ""):
-        self.base_url = base_url.rstrip("/")
-        self.endpoint = f"{self.base_url}/sdapi/v1/txt2img"
+    HEADERS = {"Accept": "application/json", "Content-Type": "application/json"}
+    PATH = "/sdapi/v1/txt2img"
+    # dipakai kalau prompt tidak membawa negative prompt sendiri (ekspansi LLM structured)
+    DEFAULT_NEGATIVE_PROMPT = "blurry, low quality, distorted face, extra limbs, watermark, text, logo, disabled, deformed, disfigured, bad anatomy, more than one person, multiple people"
+
+    def __init__(
+        self,
+        base_url: str = "",
+        timeout: Optional[float] = None,
+        max_connections: int = 8,
+        output_dir: str = "output",
+        store: Optional[ImageStore] = None,
+        pool: Optional[BackendPool] = None,
+        batch_window: float = 0.0,
+        max_batch_size: int = 1,
+        max_gpu_batch: int = 4,
+    ):
+        self.pool = pool if pool is not None else BackendPool([base_url or "http://127.0.0.1:7860"], probe_interval=0)
+        self.timeout = timeout
+        self.max_connections = max(max_connections, self.pool.total_capacity)
+        self.output_dir = output_dir
+        # batch_size maksimal per call A1111 (VRAM); sisanya lewat n_iter
+        self.max_gpu_batch = max(1, max_gpu_batch)
+        self.store = store if store is not None else ImageStore(output_dir)
         self.session = requests.Session()
-        self.session.headers.update({"Accept": "application/json",
-                                     "Content-Type": "application/json"})
+        self.session.headers.update(self.HEADERS)
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self.dispatcher: Optional[BatchDispatcher] = None
+        if batch_window > 0 and max_batch_size > 1:
+            self.dispatcher = BatchDispatcher(self._apost, window=batch_window, max_batch_size=max_batch_size)
 
-    def _build_payload(self, prompt: str) -> Dict[str, Any]:
+    def _aclient(self) -> httpx.AsyncClient:
+        """Async client dengan connection pool, dibuat sekali lalu dipakai ulang."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers=self.HEADERS,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        self.session.close()
+
+    def _build_payload(self, prompt: str, seed: int = -1) -> Dict[str, Any]:
         """Payload default + prompt + checkpoint hard-coded"""
         return {
             "prompt": prompt,
-            "negative_prompt": "blurry, low quality, distorted face, extra limbs, watermark, text, logo, disabled, deformed, disfigured, bad anatomy, more than one person, multiple people",
+            "negative_prompt": self.DEFAULT_NEGATIVE_PROMPT,
             "styles": [],
-            "seed": -1,
+            "seed": seed,
             "subseed": -1,
             "subseed_strength": 0,
             "seed_resize_from_h": -1,
@@ -47,7 +114,8 @@ class SDClientT2I:
             "override_settings": {
                 "sd_model_checkpoint": "realisticUniversalBase_100.safetensors"
             },
-            "override_settings_restore_afterwards": True,
+            # checkpoint dibiarkan resident; BackendPool yang mengatur kapan swap
+            "override_settings_restore_afterwards": False,
             "refiner_checkpoint": "",
             "refiner_switch_at": 0.8,
             "disable_extra_networks": False,
@@ -76,26 +144,227 @@ class SDClientT2I:
             "infotext": ""
         }
 
-    def generate(self, prompt: str) -> Dict[str, str]:
+    def generate(self, prompt: str, seed: int = -1, include_base64: bool = True, **overrides) -> Dict[str, str]:
         """
         Generate satu gambar dari prompt string.
-        Return dict: {"base64": <str>, "path": <str>}
+        Return dict: {"base64": <str>, "path": <str>, "seed": <int>, "cached": <bool>}
+        `base64` tidak diisi kalau include_base64=False (mode url/png/multipart).
         """
-        payload = self._build_payload(prompt)
-        response = self.session.post(self.endpoint, data=json.dumps(payload))
-        response.raise_for_status()
+        payload = {**self._build_payload(prompt, seed=seed), **overrides}
+        cached = self._from_store(payload, include_base64)
+        if cached is not None:
+            return cached
+        checkpoint = self._checkpoint(payload)
+        backend = self.pool.choose(checkpoint)
+        try:
+            with tracer.span("sd.txt2img", kind=KIND_CLIENT, backend=backend.url, steps=payload.get("steps")):
+                response = self.session.post(f"{backend.url}{self.PATH}", data=json.dumps(payload), timeout=self.timeout)
+                response.raise_for_status()
+        except requests.RequestException:
+            self.pool.report_failure(backend)
+            raise
+        # override_settings tidak di-restore, jadi checkpoint ini sekarang resident
+        self.pool.note_checkpoint(backend, checkpoint)
         data = response.json()
+        data["gpu_seconds"] = response.elapsed.total_seconds()
+        _SD_SECONDS.observe(data["gpu_seconds"])
+        return self._save_image(payload, data, include_base64)
+
+    async def agenerate(self, prompt: str, seed: int = -1, include_base64: bool = True, **overrides) -> Dict[str, str]:
+        """
+        Versi async dari generate(), memakai pooled httpx.AsyncClient.
+        `overrides` menimpa field payload default (mis. setting refine hires-fix).
+        """
+        payload = {**self._build_payload(prompt, seed=seed), **overrides}
+        cached = await asyncio.to_thread(self._from_store, payload, include_base64)
+        if cached is not None:
+            progress_hub.emit("cache_hit", seed=seed)
+            return cached
+        if self.dispatcher is not None:
+            # batch jalan di task dispatcher; yang dibatasi deadline hanya penantian request ini
+            async with deadline.bounded("sd_generation"):
+                data = await self.dispatcher.submit(payload)
+        else:
+            data = await self._apost(payload)
+        return await asyncio.to_thread(self._save_image, payload, data, include_base64)
+
+    async def agenerate_batch(
+        self,
+        prompt: str,
+        count: int,
+        seed: int = -1,
+        include_base64: bool = True,
+        variation_strength: float = 0.0,
+        subseed: int = -1,
+        **overrides,
+    ) -> List[Dict[str, Any]]:
+        """
+        `count` gambar dalam satu call A1111 (batch_size x n_iter). Seed -1 diacak di
+        sini supaya seed tiap gambar tercatat dan bisa direproduksi:
+        - variation_strength = 0 : seed, seed+1, ... (gambar berbeda)
+        - variation_strength > 0 : seed tetap, subseed, subseed+1, ... dengan
+          subseed_strength = variation_strength (variasi dari komposisi yang sama)
+        """
+        if seed == -1:
+            seed = random.randint(0, 2 ** 32 - count - 1)
+        if variation_strength > 0 and subseed == -1:
+            subseed = random.randint(0, 2 ** 32 - count - 1)
+        payload = {
+            **self._build_payload(prompt, seed=seed),
+            **overrides,
+            "subseed": subseed if variation_strength > 0 else -1,
+            "subseed_strength": variation_strength,
+        }
+
+        def image_payload(i: int) -> Dict[str, Any]:
+            # sama dengan cara A1111 menurunkan all_seeds/all_subseeds di dalam batch
+            if variation_strength > 0:
+                return {**payload, "subseed": subseed + i}
+            return {**payload, "seed": seed + i}
+
+        cached = [await asyncio.to_thread(self._from_store, image_payload(i), include_base64) for i in range(count)]
+        if all(c is not None for c in cached):
+            progress_hub.emit("cache_hit", seed=seed)
+            return cached
 
-        # simpan file
-        out_file = pathlib.Path("output") / f"{hash(prompt) % 1000000}.png"
-        out_file.parent.mkdir(exist_ok=True, parents=True)
-        png_bytes = base64.b64decode(data["images"][0])
-        out_file.write_bytes(png_bytes)
+        n_iter = -(-count // self.max_gpu_batch)
+        batch_size = -(-count // n_iter)
+        data = await self._apost({**payload, "batch_size": batch_size, "n_iter": n_iter, "do_not_save_grid": True})
+        images = data.get("images", [])
+        if len(images) == batch_size * n_iter + 1:
+            images = images[1:]
+        images = images[:count]
+        try:
+            info = json.loads(data.get("info") or "{}")
+        except ValueError:
+            info = {}
+        seeds = info.get("all_seeds") or [image_payload(i)["seed"] for i in range(len(images))]
+        subseeds = info.get("all_subseeds") or [image_payload(i)["subseed"] for i in range(len(images))]
+        gpu_share = data.get("gpu_seconds", 0.0) / max(len(images), 1)
 
+        results = []
+        for image_b64, image_seed, image_subseed in zip(images, seeds, subseeds):
+            one = {"images": [image_b64], "info": json.dumps({"seed": image_seed}), "gpu_seconds": gpu_share}
+            image_payload_i = {**payload, "seed": image_seed}
+            if variation_strength > 0:
+                image_payload_i["subseed"] = image_subseed
+            result = await asyncio.to_thread(self._save_image, image_payload_i, one, include_base64)
+            if variation_strength > 0:
+                result["subseed"] = image_subseed
+                result["subseed_strength"] = variation_strength
+            results.append(result)
+        return results
+
+    @staticmethod
+    def draft_settings(width: int = 384, height: int = 384, steps: int = 12) -> Dict[str, Any]:
+        """Draft murah: resolusi rendah, step sedikit, tanpa restore_faces."""
+        return {"width": width, "height": height, "steps": steps, "restore_faces": False, "enable_hr": False}
+
+    @staticmethod
+    def refine_settings(
+        draft_params: Dict[str, Any],
+        target_width: int = 512,
+        second_pass_steps: int = 20,
+        denoising_strength: float = 0.5,
+    ) -> Dict[str, Any]:
+        """
+        Refine satu draft: first pass identik dengan draft (ukuran, step, seed) supaya
+        komposisinya sama, lalu hires-fix ke `target_width` + restore_faces.
+        """
+        width, height = draft_params.get("width", 384), draft_params.get("height", 384)
         return {
-            "base64": data["images"][0],
-            "path": str(out_file.resolve())
+            "width": width,
+            "height": height,
+            "steps": draft_params.get("steps", 12),
+            "firstphase_width": width,
+            "firstphase_height": height,
+            "enable_hr": True,
+            "hr_scale": target_width / width,
+            "hr_second_pass_steps": second_pass_steps,
+            "denoising_strength": denoising_strength,
+            "restore_faces": True,
+        }
+
+    async def _apost(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST txt2img dibatasi deadline request aktif; kalau di-cancel, backend di-interrupt."""
+        async with deadline.bounded("sd_generation"):
+            with tracer.span(
+                "sd.txt2img", kind=KIND_CLIENT, steps=payload.get("steps"),
+                batch_size=payload.get("batch_size", 1), n_iter=payload.get("n_iter", 1),
+            ) as span:
+                async with self.pool.acquire(self._checkpoint(payload)) as backend, progress_hub.track(backend.url):
+                    span.set("backend", backend.url)
+                    start = time.time()
+                    async with self.pool.interruptible(backend):
+                        response = await self._aclient().post(
+                            f"{backend.url}{self.PATH}", json=payload, timeout=deadline.timeout(self.timeout)
+                        )
+                    response.raise_for_status()
+        data = response.json()
+        # waktu backend memegang request ini, dipakai sebagai estimasi GPU-seconds
+        data["gpu_seconds"] = time.time() - start
+        _SD_SECONDS.observe(data["gpu_seconds"])
+        return data
+
+    @staticmethod
+    def _checkpoint(payload: Dict[str, Any]) -> Optional[str]:
+        return (payload.get("override_settings") or {}).get("sd_model_checkpoint") or None
+
+    @staticmethod
+    def _actual_seed(data: Dict[str, Any], fallback: int) -> int:
+        """Seed yang benar-benar dipakai A1111 (ada di field `info`)."""
+        try:
+            return int(json.loads(data.get("info") or "{}").get("seed", fallback))
+        except (ValueError, TypeError):
+            return fallback
+
+    @staticmethod
+    def _index_params(payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Parameter yang dicatat di generation index (tanpa field kosong/noise)."""
+        params = {k: payload.get(k) for k in ImageStore.KEY_FIELDS if k not in ("prompt", "negative_prompt")}
+        params["checkpoint"] = (payload.get("override_settings") or {}).get("sd_model_checkpoint", "")
+        return params
+
+    def _from_store(self, payload: Dict[str, Any], include_base64: bool = True) -> Optional[Dict[str, Any]]:
+        # seed -1 berarti random, hasilnya tidak bisa dipakai ulang
+        if payload["seed"] == -1:
+            return None
+        path = self.store.get(ImageStore.make_key(payload))
+        if path is None:
+            return None
+        logger.info(f"Image store hit for seed {payload['seed']}, skip GPU")
+        result = {"path": path, "seed": payload["seed"], "cached": True, "gpu_seconds": 0.0, "params": self._index_params(payload)}
+        if payload.get("subseed_strength"):
+            result["subseed"] = payload["subseed"]
+            result["subseed_strength"] = payload["subseed_strength"]
+        if include_base64:
+            result["base64"] = base64.b64encode(read_png(path)).decode("utf-8")
+        return result
+
+    def _save_image(self, payload: Dict[str, Any], data: Dict[str, Any], include_base64: bool = True) -> Dict[str, Any]:
+        image_b64 = data["images"][0]
+        seed = self._actual_seed(data, payload["seed"])
+        t0 = time.perf_counter()
+        with tracer.span("image.decode"):
+            png_bytes = base64.b64decode(image_b64)
+        t1 = time.perf_counter()
+        with tracer.span("image.write", bytes=len(png_bytes)):
+            path = self.store.put(ImageStore.make_key({**payload, "seed": seed}), png_bytes)
+        _DECODE_SECONDS.observe(t1 - t0)
+        _WRITE_SECONDS.observe(time.perf_counter() - t1)
+
+        result = {
+            "path": path,
+            "seed": seed,
+            "cached": False,
+            "sha256": hashlib.sha256(png_bytes).hexdigest(),
+            "bytes": len(png_bytes),
+            "gpu_seconds": data.get("gpu_seconds", 0.0),
+            "params": self._index_params({**payload, "seed": seed}),
         }
+        if include_base64:
+            result["base64"] = image_b64
+        return result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,390 @@
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+EXPORTERS = ("none", "file", "otlp")
+
+# OTLP SpanKind / StatusCode
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# trace_id/session_id dari logger.contextualize, supaya baris log bisa dicocokkan dengan span
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "trace={extra[trace_id]} session={extra[session_id]} | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+
+def configure_logging(level: str = "DEBUG"):
+    """Sink stderr loguru dengan trace_id/session_id (default "-" di luar request)."""
+    logger.configure(extra={"trace_id": "-", "session_id": "-"})
+    logger.remove()
+    logger.add(sys.stderr, level=level, format=LOG_FORMAT)
+
+
+def log_context(**ids):
+    """logger.contextualize untuk id korelasi yang tidak kosong."""
+    return logger.contextualize(**{k: v for k, v in ids.items() if v})
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """W3C traceparent -> (trace_id, parent_span_id, sampled), None kalau tidak valid."""
+    if not header:
+        return None
+    match = TRACEPARENT_RE.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def _attr_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """
+    Satu span (model OpenTelemetry: trace_id/span_id/parent, waktu ns, atribut,
+    status). Dipakai sebagai context manager; selama blok berjalan span ini jadi
+    parent untuk span baru di task/thread yang sama (contextvars).
+    """
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message", "sampled", "_token", "_log")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 sampled: bool, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._token = None
+        self._log = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, key: str, value: Any) -> "Span":
+        if self.sampled and value is not None:
+            self.attributes[key] = value
+        return self
+
+    def error(self, exc: BaseException) -> "Span":
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"
+        return self
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                self.tracer.exporter.submit(self)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self._token = _current_span.set(self)
+        # trace id cukup di-bind sekali per trace (root / lanjutan dari task lain)
+        if parent is None or parent.trace_id != self.trace_id:
+            self._log = logger.contextualize(trace_id=self.trace_id)
+            self._log.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error(exc)
+        if self._log is not None:
+            self._log.__exit__(exc_type, exc, tb)
+            self._log = None
+        _current_span.reset(self._token)
+        self.end()
+        return False
+
+    def to_otlp(self) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status else {},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        return data
+
+
+class _NoopSpan:
+    """Span untuk trace yang tidak di-sample: semua method no-op, tanpa alokasi."""
+
+    __slots__ = ()
+    sampled = False
+
+    def set(self, key: str, value: Any) -> "_NoopSpan":
+        return self
+
+    def error(self, exc: BaseException) -> "_NoopSpan":
+        return self
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter:
+    """
+    Buffer span selesai lalu kirim per batch dari background thread, jadi hot
+    path hanya append ke deque. Sink:
+    - file : satu baris JSON per batch dalam bentuk OTLP/JSON ExportTraceServiceRequest
+    - otlp : POST JSON yang sama ke endpoint OTLP/HTTP (`.../v1/traces`)
+    Kalau buffer penuh span dibuang (dihitung di `dropped`), bukan menahan request.
+    """
+
+    def __init__(self, kind: str = "none", path: str = "traces/spans.jsonl", endpoint: str = "",
+                 service_name: str = "photo-generator", max_queue: int = 4096, batch_size: int = 512,
+                 interval: float = 2.0):
+        if kind not in EXPORTERS:
+            raise ValueError(f"trace exporter harus salah satu dari {', '.join(EXPORTERS)}")
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer: "deque[Span]" = deque()
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.Client] = None
+        self._counters = {"exported": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    @classmethod
+    def from_config(cls, config, service_name: str, section: str = "default") -> "SpanExporter":
+        """Exporter dari config.ini: `trace_exporter` (none/file/otlp), `trace_file`, `trace_otlp_endpoint`."""
+        return cls(
+            kind=config.get(section, "trace_exporter", fallback="none"),
+            path=config.get(section, "trace_file", fallback="traces/spans.jsonl"),
+            endpoint=config.get(section, "trace_otlp_endpoint", fallback="http://127.0.0.1:4318/v1/traces"),
+            service_name=service_name,
+            max_queue=config.getint(section, "trace_max_queue", fallback=4096),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "none"
+
+    def submit(self, span: Span):
+        if len(self._buffer) >= self.max_queue:
+            self._counters["dropped"] += 1
+            return
+        self._buffer.append(span)
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._start()
+        elif len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._loop, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        while self._buffer:
+            batch: List[Span] = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+            try:
+                self._write(batch)
+                self._counters["exported"] += len(batch)
+                self._counters["batches"] += 1
+            except Exception as e:
+                self._counters["failed"] += len(batch)
+                logger.warning(f"Export {len(batch)} span gagal: {e}")
+
+    def _payload(self, batch: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "photo-generator"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+
+    def _write(self, batch: List[Span]):
+        payload = self._payload(batch)
+        if self.kind == "file":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        elif self.kind == "otlp":
+            if self._client is None:
+                self._client = httpx.Client(timeout=10.0)
+            self._client.post(self.endpoint, json=payload).raise_for_status()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "exporter": self.kind, "queued": len(self._buffer)}
+
+
+class Tracer:
+    """
+    Tracer ringan dengan model span OpenTelemetry. Keputusan sampling diambil
+    sekali di root (head sampling, ikut flag `traceparent` kalau ada) lalu
+    diwarisi semua child; trace yang tidak di-sample hanya membawa trace id
+    untuk korelasi log/header, child span-nya NOOP_SPAN.
+    """
+
+    def __init__(self):
+        self.exporter = SpanExporter()
+        self.sample_ratio = 0.0
+
+    def configure(self, exporter: Optional[SpanExporter] = None, sample_ratio: Optional[float] = None):
+        if exporter is not None:
+            self.exporter.flush()
+            self.exporter = exporter
+        if sample_ratio is not None:
+            self.sample_ratio = max(0.0, min(1.0, sample_ratio))
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter.enabled
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current_span.get()
+
+    def _sample(self) -> bool:
+        return self.enabled and random.random() < self.sample_ratio
+
+    def start_root(self, name: str, traceparent: Optional[str] = None, kind: int = KIND_SERVER, **attributes) -> Span:
+        """Root span request, melanjutkan trace dari header `traceparent` kalau valid."""
+        parsed = parse_traceparent(traceparent)
+        if parsed is not None:
+            trace_id, parent_id, sampled = parsed
+            sampled = sampled and self.enabled
+        else:
+            trace_id, parent_id, sampled = _new_id(16), None, self._sample()
+        return Span(self, name, trace_id, parent_id, sampled, kind, attributes if sampled else None)
+
+    def span(self, name: str, parent: Optional[Span] = None, kind: int = KIND_INTERNAL, **attributes):
+        """
+        Child span dari `parent` (default span aktif). Tanpa parent sama sekali
+        span ini jadi root baru (mis. dari CLI batch) dengan sampling sendiri.
+        """
+        if parent is None:
+            parent = _current_span.get()
+        if parent is None:
+            if not self.enabled:
+                return NOOP_SPAN
+            return self.start_root(name, kind=kind, **attributes)
+        if not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, True, kind, attributes)
+
+    def record(self, name: str, start: float, end: float, parent: Optional[Span] = None, **attributes):
+        """Catat span yang waktunya sudah diketahui (detik epoch), mis. lama job menunggu di queue."""
+        span = self.span(name, parent=parent, **attributes)
+        if span is NOOP_SPAN:
+            return
+        span.start_ns = int(start * 1e9)
+        span.end_ns = int(end * 1e9)
+        self.exporter.submit(span)
+
+    def trace_id(self) -> Optional[str]:
+        span = _current_span.get()
+        return span.trace_id if span is not None else None
+
+    def shutdown(self):
+        self.exporter.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.exporter.stats(), "sample_ratio": self.sample_ratio}
+
+
+tracer = Tracer()
+
+
+# ---------- ASGI ----------
+class TracingMiddleware:
+    """
+    Root span per request HTTP. Trace id diambil dari header `traceparent`
+    (W3C) kalau ada; `traceparent` span server dikembalikan di response supaya
+    client bisa mencari trace-nya.
+    """
+
+    def __init__(self, app, service: str, exclude: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.service = service
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        incoming = headers.get(b"traceparent")
+        span = tracer.start_root(
+            f"{scope.get('method', 'WS')} {scope['path']}",
+            traceparent=incoming.decode("latin-1") if incoming else None,
+            **{"service.name": self.service, "http.target": scope["path"]},
+        )
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                span.set("http.status_code", message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"traceparent", span.traceparent.encode("latin-1"))]
+            await send(message)
+
+        with span:
+            await self.app(scope, receive, send_with_trace)
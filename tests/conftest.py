@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modul service di-import dari src/ seperti saat dijalankan (python src/main_service_*.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from tools.batch_dispatcher import BatchDispatcher
+
+
+class StubBackend:
+    """run_batch palsu: satu gambar per slot batch, seed berurutan seperti A1111."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self.cancelled = 0
+
+    async def __call__(self, payload):
+        self.calls.append(payload)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        size = payload["batch_size"]
+        return {
+            "images": [f"img{i}" for i in range(size)],
+            "info": json.dumps({"seed": 100, "all_seeds": [100 + i for i in range(size)]}),
+            "gpu_seconds": 2.0,
+        }
+
+
+def test_fan_out_maps_images_and_seeds():
+    async def run():
+        backend = StubBackend()
+        dispatcher = BatchDispatcher(backend, window=0.01, max_batch_size=4)
+        results = await asyncio.gather(*[dispatcher.submit({"prompt": "a", "seed": -1}) for _ in range(3)])
+        return backend, dispatcher, results
+
+    backend, dispatcher, results = asyncio.run(run())
+    assert len(backend.calls) == 1 and backend.calls[0]["batch_size"] == 3
+    assert [r["images"] for r in results] == [["img0"], ["img1"], ["img2"]]
+    assert [json.loads(r["info"])["seed"] for r in results] == [100, 101, 102]
+    assert all(r["gpu_seconds"] == pytest.approx(2.0 / 3) for r in results)
+    assert dispatcher.stats()["batch_size_histogram"] == {3: 1}
+
+
+def test_full_group_flushes_without_waiting_for_window():
+    async def run():
+        backend = StubBackend()
+        dispatcher = BatchDispatcher(backend, window=10.0, max_batch_size=2)
+        return await asyncio.wait_for(
+            asyncio.gather(*[dispatcher.submit({"prompt": "a"}) for _ in range(2)]), timeout=1.0
+        )
+
+    assert len(asyncio.run(run())) == 2
+
+
+def test_backend_error_reaches_every_waiter():
+    async def run():
+        dispatcher = BatchDispatcher(StubBackend(error=RuntimeError("backend down")), window=0.01)
+        return await asyncio.gather(*[dispatcher.submit({"prompt": "a"}) for _ in range(2)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [str(r) for r in results] == ["backend down", "backend down"]
+
+
+def test_cancelled_batch_cancels_waiters():
+    async def run():
+        dispatcher = BatchDispatcher(StubBackend(delay=10.0), window=0.0, max_batch_size=2)
+        waiters = [asyncio.ensure_future(dispatcher.submit({"prompt": "a"})) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for task in list(dispatcher._tasks):
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), timeout=1.0)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+def test_batch_cancelled_when_all_waiters_leave():
+    async def run():
+        backend = StubBackend(delay=10.0)
+        dispatcher = BatchDispatcher(backend, window=0.0, max_batch_size=2)
+        waiters = [asyncio.ensure_future(dispatcher.submit({"prompt": "a"})) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        # masih ada satu pemanggil, batch tetap jalan
+        assert backend.cancelled == 0
+        waiters[1].cancel()
+        await asyncio.sleep(0.01)
+        return backend, dispatcher
+
+    backend, dispatcher = asyncio.run(run())
+    assert backend.cancelled == 1
+    assert dispatcher.stats()["abandoned_batches"] == 1
+    assert not dispatcher._tasks
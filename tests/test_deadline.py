@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from tools import deadline
+
+
+def test_cancel_after_raises_timeout_and_restores_cancelling():
+    async def run():
+        task = asyncio.current_task()
+        with pytest.raises(asyncio.TimeoutError):
+            async with deadline.cancel_after(0.01):
+                await asyncio.sleep(1)
+        if hasattr(task, "cancelling"):
+            assert task.cancelling() == 0
+        # task masih bisa dipakai normal setelah timeout
+        await asyncio.sleep(0.02)
+
+    asyncio.run(run())
+
+
+def test_cancel_after_swallowed_cancel_is_uncancelled():
+    async def run():
+        task = asyncio.current_task()
+        async with deadline.cancel_after(0.01):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                pass
+        if hasattr(task, "cancelling"):
+            assert task.cancelling() == 0
+
+    asyncio.run(run())
+
+
+def test_cancel_after_no_stray_cancel_after_normal_exit():
+    async def run():
+        async with deadline.cancel_after(0.01):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.03)
+
+    asyncio.run(run())
+
+
+def test_external_cancel_stays_cancelled_error():
+    async def inner():
+        async with deadline.cancel_after(1.0):
+            await asyncio.sleep(5)
+
+    async def run():
+        task = asyncio.ensure_future(inner())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+
+def test_bounded_raises_deadline_exceeded():
+    async def run():
+        with deadline.scope(deadline.Deadline(0.01)):
+            async with deadline.bounded("sd_generation"):
+                await asyncio.sleep(1)
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        asyncio.run(run())
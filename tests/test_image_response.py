@@ -0,0 +1,80 @@
+import asyncio
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from tools.backend_pool import BackendPool
+from tools.image_response import build_image_response, wants_base64
+from tools.image_store import ImageStore
+from tools.tools_generate_t2i import SDClientT2I
+
+
+@pytest.fixture
+def stored_image(tmp_path):
+    """Satu PNG noise (~1.5 MB, tidak bisa dikompres) di ImageStore, seperti hasil generate yang di-cache."""
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (512, 1024, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    client = SDClientT2I(store=ImageStore(str(tmp_path)), pool=BackendPool(["http://127.0.0.1:7860"], probe_interval=0))
+    payload = client._build_payload("portrait", seed=1)
+    client.store.put(ImageStore.make_key(payload), buffer.getvalue())
+    yield client, payload, len(buffer.getvalue())
+    client.session.close()
+
+
+async def _drain(response) -> int:
+    """Jalankan response ASGI sampai selesai; body dihitung tapi tidak disimpan."""
+    sent = 0
+
+    async def receive():
+        # client tidak pernah putus; listener disconnect Starlette di-cancel setelah body terkirim
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal sent
+        if message["type"] == "http.response.body":
+            sent += len(message.get("body", b""))
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}
+    await response(scope, receive, send)
+    return sent
+
+
+def _serve(client: SDClientT2I, payload, response_format: str):
+    """Jalur endpoint generate untuk hasil cache: baca store, bangun response, kirim body. Return (peak, bytes)."""
+    tracemalloc.start()
+    try:
+        result = client._from_store(payload, include_base64=wants_base64(response_format))
+        data = {"id": "session_test", "path_file": result["path"], "seed": result["seed"]}
+        if "base64" in result:
+            data["base64"] = result["base64"]
+        else:
+            data["url"] = "/images/test.png"
+        content = {"status": "success", "data": data, "message": "Photo generated successfully"}
+        response = build_image_response(response_format, content, [result["path"]])
+        del result, data, content
+        sent = asyncio.run(_drain(response))
+        return tracemalloc.get_traced_memory()[1], sent
+    finally:
+        tracemalloc.stop()
+
+
+def test_non_base64_formats_allocate_much_less(stored_image):
+    client, payload, png_bytes = stored_image
+    # run pertama ikut menghitung import lazy + thread pool anyio, jadi tiap mode dipanaskan dulu
+    for response_format in ("json-base64", "url", "png"):
+        _serve(client, payload, response_format)
+    base64_peak, base64_sent = _serve(client, payload, "json-base64")
+    url_peak, _ = _serve(client, payload, "url")
+    png_peak, png_sent = _serve(client, payload, "png")
+
+    # base64 membaca file utuh + string base64 (4/3x) + body JSON
+    assert base64_sent > png_bytes * 4 / 3
+    assert base64_peak > png_bytes * 2
+    # png di-stream per chunk dari disk, url tidak menyentuh isi file sama sekali
+    assert png_sent == png_bytes
+    assert png_peak < base64_peak / 8
+    assert url_peak < base64_peak / 8
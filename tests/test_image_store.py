@@ -0,0 +1,62 @@
+import os
+
+from tools.generation_index import GenerationIndex
+from tools.image_store import ImageStore
+
+
+def _store(tmp_path, **kwargs):
+    index = GenerationIndex(str(tmp_path / "index" / "generations.sqlite3"))
+    store = ImageStore(str(tmp_path / "store"), on_change=index.relink, **kwargs)
+    return store, index
+
+
+def _key(i: int) -> str:
+    return f"{i:02d}" + "a" * 62
+
+
+def test_lru_eviction_marks_index_rows_evicted(tmp_path):
+    store, index = _store(tmp_path, max_bytes=250)
+    paths = [store.put(_key(i), b"x" * 100) for i in range(2)]
+    ids = [index.record("t2i", path) for path in paths]
+
+    # akses key 0 supaya key 1 jadi yang paling lama tidak dipakai
+    assert store.get(_key(0)) == paths[0]
+    store.put(_key(2), b"x" * 100)
+
+    assert store.get(_key(1)) is None and not os.path.exists(paths[1])
+    assert store.stats()["evictions"] == 1 and store.stats()["total_bytes"] == 200
+    evicted, kept = index.get(ids[1]), index.get(ids[0])
+    assert evicted["path"] is None and "evicted_at" in evicted["params"]
+    assert kept["path"] == paths[0]
+    index.close()
+
+
+def test_relocate_relinks_index_and_survives_reload(tmp_path):
+    store, index = _store(tmp_path, alt_suffixes=(".webp",))
+    path = store.put(_key(0), b"x" * 100)
+    gen_id = index.record("t2i", path)
+
+    new_path = path[:-len(".png")] + ".webp"
+    with open(new_path, "wb") as f:
+        f.write(b"y" * 40)
+    store.relocate(_key(0), new_path, 40)
+    assert index.get(gen_id)["path"] == new_path
+    assert store.get(_key(0)) == new_path
+
+    # restart sebelum file asli sempat di-unlink: duplikat .png dibuang, .webp dipakai
+    reloaded = ImageStore(str(tmp_path / "store"), alt_suffixes=(".webp",))
+    assert reloaded.get(_key(0)) == new_path and not os.path.exists(path)
+    assert reloaded.stats()["total_bytes"] == 40
+    index.close()
+
+
+def test_missing_file_unlinks_index_row(tmp_path):
+    store, index = _store(tmp_path)
+    path = store.put(_key(0), b"x" * 100)
+    gen_id = index.record("t2i", path)
+
+    os.unlink(path)
+    store.compact()
+    assert store.stats()["files"] == 0
+    assert index.get(gen_id)["path"] is None
+    index.close()
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import pytest
+
+import main_service_photo_gent2i as service
+from tools.job_queue import JobQueue, QueueFullError
+
+
+def test_full_queue_raises_and_service_returns_429(monkeypatch):
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(payload):
+            await release.wait()
+            return payload
+
+        queue = JobQueue(handler, max_size=1, workers=1)
+        await queue.start()
+        try:
+            queue.submit("running")
+            await asyncio.sleep(0)
+            queue.submit("queued")
+            with pytest.raises(QueueFullError) as exc:
+                queue.submit("rejected")
+            assert exc.value.retry_after >= 1
+
+            monkeypatch.setattr(service, "job_queue", queue)
+            response = await service.submit_job(service.PromptData(prompt="portrait"))
+            assert response.status_code == 429
+            assert int(response.headers["retry-after"]) >= 1
+            assert json.loads(response.body)["status"] == "error"
+            assert queue.stats()["jobs"] == {"running": 1, "queued": 1}
+        finally:
+            release.set()
+            await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_finished_jobs_evicted_least_recently_read_first():
+    async def run():
+        async def handler(payload):
+            return {"echo": payload}
+
+        queue = JobQueue(handler, workers=1, max_finished=2)
+        await queue.start()
+        try:
+            jobs = []
+            for i in range(3):
+                job = queue.submit(i)
+                await queue.wait(job, timeout=1.0)
+                jobs.append(job)
+                if i == 1:
+                    # baca job 0 lagi supaya job 1 yang paling lama tidak dibaca
+                    assert queue.get(jobs[0].id) is jobs[0]
+            return queue, jobs
+        finally:
+            await queue.stop()
+
+    queue, jobs = asyncio.run(run())
+    assert queue.get(jobs[1].id) is None
+    assert queue.get(jobs[0].id).result == {"echo": 0}
+    assert queue.get(jobs[2].id).status == "done"
+    assert all(job.payload is None for job in jobs)
+    assert queue.stats()["evicted"] == 1 and queue.stats()["jobs"] == {"done": 2}
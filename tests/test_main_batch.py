@@ -0,0 +1,103 @@
+import asyncio
+import json
+from collections import Counter
+
+import pytest
+
+import main_batch
+from main_batch import BatchRunner, parse_args
+
+
+class Crash(KeyboardInterrupt):
+    """Proses mati di tengah run (bukan error job); KeyboardInterrupt menembus event loop."""
+
+
+def _input(tmp_path, count=10):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("".join(json.dumps({"prompt": f"prompt {i}", "id": f"job{i}"}) + "\n" for i in range(count)))
+    return str(path)
+
+
+def _run(monkeypatch, argv, process):
+    monkeypatch.setattr(BatchRunner, "_process", process)
+    runner = BatchRunner(parse_args(argv))
+    asyncio.run(runner.run())
+    return runner
+
+
+def _last_status(out_dir):
+    rows = [json.loads(line) for line in (out_dir / "manifest.jsonl").read_text().splitlines()]
+    return {row["line"]: row["status"] for row in rows}
+
+
+def test_crash_truncated_manifest_resume_and_retry_failed(tmp_path, monkeypatch):
+    input_path, out_dir = _input(tmp_path), tmp_path / "run"
+    argv = [input_path, "--out", str(out_dir), "--concurrency", "1", "--retries", "0", "--checkpoint-every", "2"]
+    calls = Counter()
+    snapshots = []
+
+    save = main_batch.BatchCheckpoint.save
+
+    def save_and_snapshot(self, manifest_offset):
+        save(self, manifest_offset)
+        snapshots.append(open(self.path).read())
+
+    monkeypatch.setattr(main_batch.BatchCheckpoint, "save", save_and_snapshot)
+
+    async def outage_then_crash(self, job):
+        line = int(job["id"][3:])
+        calls[line] += 1
+        if line in (2, 3):
+            raise ConnectionError("backend down")
+        if line == 6:
+            raise Crash()
+        return {"ok": line}
+
+    with pytest.raises(Crash):
+        _run(monkeypatch, argv, outage_then_crash)
+
+    # crash keras: checkpoint terakhir yang sempat ditulis adalah yang lama, manifest terpotong di tengah baris
+    (out_dir / "checkpoint.json").write_text(snapshots[0])
+    with open(out_dir / "manifest.jsonl", "ab") as f:
+        f.write(b'{"line": 6, "status": "succ')
+
+    async def healthy_except_outage(self, job):
+        line = int(job["id"][3:])
+        calls[line] += 1
+        if line in (2, 3):
+            raise ConnectionError("backend down")
+        return {"ok": line}
+
+    runner = _run(monkeypatch, argv, healthy_except_outage)
+    # baris yang sudah di manifest tidak dikerjakan ulang, sisanya tepat sekali
+    assert all(calls[line] == 1 for line in (0, 1, 2, 3, 4, 5, 7, 8, 9))
+    assert calls[6] == 2
+    assert runner.checkpoint.finished
+    assert runner.checkpoint.counts == {"succeeded": 8, "failed": 2}
+
+    # tanpa --retry-failed batch yang selesai tidak mengerjakan apa pun
+    _run(monkeypatch, argv, healthy_except_outage)
+    assert calls[2] == 1
+
+    async def healthy(self, job):
+        line = int(job["id"][3:])
+        calls[line] += 1
+        return {"ok": line}
+
+    runner = _run(monkeypatch, [*argv, "--retry-failed"], healthy)
+    assert calls[2] == 2 and calls[3] == 2 and calls[0] == 1
+    assert runner.checkpoint.counts == {"succeeded": 10, "failed": 0}
+    assert set(_last_status(out_dir).values()) == {"success"}
+
+
+def test_invalid_lines_are_not_retried(tmp_path, monkeypatch):
+    input_path = tmp_path / "jobs.jsonl"
+    input_path.write_text('{"prompt": "a", "id": "job0"}\nnot json\n')
+    argv = [str(input_path), "--out", str(tmp_path / "run"), "--retries", "0"]
+
+    async def process(self, job):
+        return {"ok": True}
+
+    _run(monkeypatch, argv, process)
+    runner = _run(monkeypatch, [*argv, "--retry-failed"], process)
+    assert runner.checkpoint.counts == {"succeeded": 1, "failed": 1}
@@ -0,0 +1,166 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from agents import base_agent
+from agents.base_agent import BaseAgent
+from agents.retry_policy import (
+    AttemptCancelledError, HedgePolicy, IncompleteResponseError, RetryBudget, RetryPolicy, classify_error,
+)
+
+
+def _status_error(status: int, retry_after: str = None) -> openai.APIStatusError:
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://llm/v1/chat/completions"))
+    return openai.APIStatusError(f"status {status}", response=response, body=None)
+
+
+def _response(content: str = "ok", finish_reason: str = "stop"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason=finish_reason, message=SimpleNamespace(content=content))], usage=None,
+    )
+
+
+class StubLLM:
+    """Client palsu per base_url: tiap call menjalankan langkah berikutnya dari `script`."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else _response()
+        try:
+            if callable(step):
+                return await step()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+
+def _agent(monkeypatch, clients, hedge=None, budget=None):
+    monkeypatch.setattr(base_agent.llm_client_pool, "aget", lambda base_url, *args: clients[base_url])
+    return BaseAgent(
+        "system", "human", provider="openai", model_name="stub", base_url="http://primary", api_key="x",
+        retry_policy=RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.05, budget=budget), hedge=hedge,
+    )
+
+
+def _sleep(seconds, result=None):
+    async def step():
+        await asyncio.sleep(seconds)
+        return result or _response()
+    return step
+
+
+# ---------- RetryPolicy ----------
+@pytest.mark.parametrize("exc, reason", [
+    (httpx.ReadTimeout("slow"), "timeout"),
+    (httpx.ConnectError("refused"), "connection"),
+    (_status_error(429), "http_429"),
+    (_status_error(503), "http_503"),
+    (_status_error(400), None),
+    (_status_error(401), None),
+    (IncompleteResponseError("finish_reason=length"), "incomplete"),
+    (AttemptCancelledError("cancelled"), "cancelled"),
+    (ValueError("bug"), None),
+])
+def test_classify_error(exc, reason):
+    assert classify_error(exc) == reason
+
+
+def test_retry_after_is_honoured_and_capped():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.0, max_delay=5.0)
+    assert policy.next_delay(_status_error(429, retry_after="3"), 0) == pytest.approx(3.0)
+    assert policy.next_delay(_status_error(429, retry_after="60"), 1) == pytest.approx(5.0)
+    assert policy.next_delay(_status_error(503, retry_after="soon"), 2) == pytest.approx(0.0)
+    assert policy.reasons == {"http_429": 2, "http_503": 1}
+
+
+def test_gives_up_after_max_attempts_and_on_permanent_errors():
+    policy = RetryPolicy(max_attempts=2, base_delay=0.0)
+    assert policy.next_delay(_status_error(503), 0) is not None
+    assert policy.next_delay(_status_error(503), 1) is None
+    assert policy.next_delay(_status_error(400), 0) is None
+    assert policy.stats()["gave_up"] == 1 and policy.stats()["not_retryable"] == 1
+
+
+def test_budget_exhaustion_stops_retries():
+    budget = RetryBudget(ratio=0.0, window=60.0, min_retries=2)
+    policy = RetryPolicy(max_attempts=10, base_delay=0.0, budget=budget)
+    delays = [policy.next_delay(_status_error(503), attempt) for attempt in range(3)]
+    assert delays[:2] == [0.0, 0.0] and delays[2] is None
+    assert budget.exhausted == 1
+
+
+# ---------- BaseAgent attempt loop ----------
+def test_acomplete_retries_retryable_errors(monkeypatch):
+    llm = StubLLM([_status_error(503), httpx.ConnectError("refused"), _response("done")])
+    agent = _agent(monkeypatch, {"http://primary": llm})
+
+    response = asyncio.run(agent._acomplete([{"role": "user", "content": "x"}]))
+    assert response.choices[0].message.content == "done"
+    assert llm.calls == 3
+    assert agent.retry_policy.reasons == {"http_503": 1, "connection": 1}
+
+
+def test_acomplete_retries_incomplete_response_then_raises(monkeypatch):
+    llm = StubLLM([_response(finish_reason="length")] * 3)
+    agent = _agent(monkeypatch, {"http://primary": llm})
+
+    with pytest.raises(IncompleteResponseError):
+        asyncio.run(agent._acomplete([{"role": "user", "content": "x"}]))
+    assert llm.calls == 3
+
+
+def test_hedge_fires_wins_and_cancels_primary(monkeypatch):
+    primary, backup = StubLLM([_sleep(5.0)]), StubLLM([_response("hedge")])
+    hedge = HedgePolicy(["http://backup"], initial_delay=0.02)
+    agent = _agent(monkeypatch, {"http://primary": primary, "http://backup": backup}, hedge=hedge)
+
+    async def run():
+        response = await agent._acomplete([{"role": "user", "content": "x"}])
+        await asyncio.sleep(0)
+        return response
+
+    assert asyncio.run(run()).choices[0].message.content == "hedge"
+    assert primary.cancelled == 1
+    assert hedge.stats()["hedged"] == 1 and hedge.stats()["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    primary, backup = StubLLM([_response("primary")]), StubLLM([])
+    hedge = HedgePolicy(["http://backup"], initial_delay=1.0)
+    agent = _agent(monkeypatch, {"http://primary": primary, "http://backup": backup}, hedge=hedge)
+
+    assert asyncio.run(agent._acomplete([{"role": "user", "content": "x"}])).choices[0].message.content == "primary"
+    assert backup.calls == 0 and hedge.stats()["hedged"] == 0
+
+
+def test_cancelled_attempt_counts_as_failed_and_is_retried(monkeypatch):
+    primary = StubLLM([asyncio.CancelledError(), _response("retried")])
+    hedge = HedgePolicy(["http://backup"], initial_delay=1.0)
+    agent = _agent(monkeypatch, {"http://primary": primary, "http://backup": StubLLM([])}, hedge=hedge)
+
+    response = asyncio.run(agent._acomplete([{"role": "user", "content": "x"}]))
+    assert response.choices[0].message.content == "retried"
+    assert agent.retry_policy.reasons == {"cancelled": 1}
+
+
+def test_hedge_skipped_when_budget_exhausted(monkeypatch):
+    primary, backup = StubLLM([_sleep(0.05, _response("primary"))]), StubLLM([])
+    hedge = HedgePolicy(["http://backup"], initial_delay=0.01)
+    budget = RetryBudget(ratio=0.0, min_retries=0)
+    agent = _agent(monkeypatch, {"http://primary": primary, "http://backup": backup}, hedge=hedge, budget=budget)
+
+    assert asyncio.run(agent._acomplete([{"role": "user", "content": "x"}])).choices[0].message.content == "primary"
+    assert backup.calls == 0 and hedge.stats()["skipped_budget"] == 1
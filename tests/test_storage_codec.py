@@ -0,0 +1,78 @@
+import asyncio
+import base64
+import io
+import os
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+from tools.backend_pool import BackendPool
+from tools.image_store import ImageStore
+from tools.storage_codec import StorageCodec, compress_file
+from tools.tools_generate_t2i import SDClientT2I
+
+
+def _png(path, size=(64, 64), noise=False):
+    """PNG dengan chunk `parameters` seperti output A1111."""
+    if noise:
+        img = Image.fromarray(np.random.default_rng(0).integers(0, 256, (*size, 3), dtype=np.uint8))
+    else:
+        img = Image.new("RGB", size, (10, 20, 30))
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "portrait, Steps: 30, Seed: 1")
+    img.save(path, pnginfo=info)
+    return str(path)
+
+
+def test_parameters_stripped_when_codec_not_smaller(tmp_path):
+    path = _png(tmp_path / "a.png", size=(4, 4))
+    result = compress_file(path, "jpeg")
+
+    assert result["codec"] == "strip"
+    assert result["path"] == path and result["replaced"] is None
+    assert result["infotext"].startswith("portrait")
+    with Image.open(path) as img:
+        assert "parameters" not in img.info
+    assert os.listdir(tmp_path) == ["a.png"]
+
+
+def test_larger_output_keeps_original_whatever_extension(tmp_path):
+    path = str(tmp_path / "a.png")
+    Image.new("L", (256, 256)).save(path)
+    result = compress_file(path, "webp")
+
+    assert result["codec"] == "none"
+    assert result["path"] == path and result["saved_bytes"] == 0
+    assert os.listdir(tmp_path) == ["a.png"]
+
+
+def test_original_unlinked_only_after_retire(tmp_path):
+    async def run():
+        codec = StorageCodec("webp", unlink_delay=0.05)
+        result = await codec.compress(_png(tmp_path / "a.png", noise=True))
+        assert result["path"].endswith(".webp")
+        codec.retire(result)
+        assert os.path.exists(result["replaced"])
+        await asyncio.sleep(0.1)
+        assert not os.path.exists(result["replaced"])
+        codec.shutdown()
+
+    asyncio.run(run())
+
+
+def test_store_hit_after_relocation_serves_png_base64(tmp_path):
+    client = SDClientT2I(store=ImageStore(str(tmp_path)), pool=BackendPool(["http://127.0.0.1:7860"], probe_interval=0))
+    try:
+        payload = client._build_payload("portrait", seed=1)
+        key = ImageStore.make_key(payload)
+        buffer = io.BytesIO()
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(buffer, format="PNG")
+        path = client.store.put(key, buffer.getvalue())
+        result = compress_file(path, "jpeg", quality=50)
+        client.store.relocate(key, result["path"], result["stored_bytes"])
+
+        cached = client._from_store(payload)
+        assert cached["path"].endswith(".jpg")
+        assert base64.b64decode(cached["base64"]).startswith(b"\x89PNG\r\n\x1a\n")
+    finally:
+        client.session.close()